@@ -5,10 +5,12 @@ from .models import Item, Order, OrderItem, Coupon, Address, Payment, Refund, Re
 admin.site.register(Item)
 
 class OrderAdmin(admin.ModelAdmin):
-    list_display = ('user', 'ref_code', 'is_ordered', 'being_delivered', 'received', 'refund_requested', 'refund_granted')
+    list_display = ('user', 'ref_code', 'is_ordered', 'total', 'being_delivered', 'received', 'refund_requested', 'refund_granted')
     list_display_links = ('user', 'ref_code')
     list_filter = ('is_ordered', 'being_delivered', 'received', 'refund_requested', 'refund_granted')
     search_fields = ('user__username', 'ref_code')
+    # Written once at checkout
+    readonly_fields = ('subtotal', 'saving', 'coupon_discount_percentage', 'coupon_discount', 'total')
 
     actions = ['grant_refund']
 
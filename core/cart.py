@@ -0,0 +1,362 @@
+"""
+Cart totals computed in the database.
+
+get_cart_summary runs one aggregate over the lines of the user's open order
+and returns an immutable CartSummary. The result is memoized on the user
+object, so the views and the cart_items_count filter in the nav share it
+within a request. cart_lines loads the lines themselves, with their items,
+for the templates that list them.
+
+The number of lines, shown in the nav on every page, is also cached per user
+across requests, in the shared cache (see CACHES in the settings). Views that
+change a cart call forget_cart_count, and so do the signals for the lines
+saved or deleted elsewhere (the admin, the deletion of an item).
+
+Carts are changed with add_to_order, which relies on the unique constraints
+on the open Order of a user and on (order, item) instead of check-then-write,
+so concurrent requests cannot create a second cart or lose an increment.
+apply_cart_changes sets the quantities of several lines at once.
+
+place_order closes a cart at checkout. It copies the prices of the items to
+the lines and writes the totals to the order, a snapshot that order history,
+refunds and the admin read from then on, whatever happens to the items.
+A card payment places the order before charging it, so no transaction is
+held open during the call to Stripe, and reopen_order undoes the placement
+when the charge fails.
+"""
+
+from dataclasses import dataclass
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.db.models import Case, Count, DecimalField, F, Max, Q, Sum, When
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .models import Item, Order, OrderItem
+from .pagination import invalidate_counts
+
+CENT = Decimal("0.01")
+MAX_LINE_QUANTITY = 100
+MAX_CHANGES = 100
+_MEMO_ATTRIBUTE = "_cart_summary"
+
+MONEY = DecimalField(max_digits=12, decimal_places=2)
+# A discount price of 0 counts as no discount, like in OrderItem.get_final_price
+HAS_DISCOUNT = Q(item__discount_price__gt=0)
+
+
+@dataclass(frozen=True)
+class CartSummary:
+    item_count: int = 0  # Number of lines
+    quantity: int = 0  # Number of units
+    subtotal: Decimal = Decimal("0.00")  # At full price
+    saving: Decimal = Decimal("0.00")  # From the items' discount prices
+    coupon_discount_percentage: int = 0
+    coupon_discount: Decimal = Decimal("0.00")
+    shipping: Decimal = Decimal("0.00")
+
+    @property
+    def discounted_subtotal(self):
+        return self.subtotal - self.saving
+
+    @property
+    def total(self):
+        return self.discounted_subtotal - self.coupon_discount + self.shipping
+
+    def as_dict(self):
+        return {
+            "item_count": self.item_count,
+            "quantity": self.quantity,
+            "subtotal": str(self.subtotal),
+            "saving": str(self.saving),
+            "coupon_discount_percentage": self.coupon_discount_percentage,
+            "coupon_discount": str(self.coupon_discount),
+            "shipping": str(self.shipping),
+            "total": str(self.total),
+        }
+
+
+class InvalidCartChange(ValueError):
+    pass
+
+
+class OrderAlreadyPlaced(ValueError):
+    pass
+
+
+def coupon_discount(amount, percentage):
+    return (amount * percentage / 100).quantize(CENT)
+
+
+def open_order_lines(user):
+    return OrderItem.objects.filter(order__user=user, order__is_ordered=False)
+
+
+def cart_lines(user):
+    """The lines of the user's open order, with their items loaded."""
+    return list(open_order_lines(user).select_related("item").order_by("id"))
+
+
+def compute_cart_summary(user):
+    totals = open_order_lines(user).aggregate(
+        item_count=Count("id"),
+        total_quantity=Coalesce(Sum("quantity"), 0),
+        subtotal=Coalesce(
+            Sum(F("quantity") * F("item__price"), output_field=MONEY),
+            Decimal(0),
+            output_field=MONEY,
+        ),
+        saving=Coalesce(
+            Sum(
+                Case(
+                    When(
+                        HAS_DISCOUNT,
+                        then=F("quantity") * (F("item__price") - F("item__discount_price")),
+                    ),
+                    default=0,
+                    output_field=MONEY,
+                )
+            ),
+            Decimal(0),
+            output_field=MONEY,
+        ),
+        coupon_discount_percentage=Coalesce(Max("order__coupon__discount"), 0),
+    )
+    percentage = totals["coupon_discount_percentage"]
+    return CartSummary(
+        item_count=totals["item_count"],
+        quantity=totals["total_quantity"],
+        subtotal=totals["subtotal"].quantize(CENT),
+        saving=totals["saving"].quantize(CENT),
+        coupon_discount_percentage=percentage,
+        coupon_discount=coupon_discount(totals["subtotal"] - totals["saving"], percentage),
+    )
+
+
+def get_cart_summary(user):
+    """CartSummary of the user's open order, computed at most once per request."""
+    if not user.is_authenticated:
+        return CartSummary()
+    summary = getattr(user, _MEMO_ATTRIBUTE, None)
+    if summary is None:
+        summary = compute_cart_summary(user)
+        setattr(user, _MEMO_ATTRIBUTE, summary)
+        cache.set(
+            cart_count_cache_key(user.pk),
+            summary.item_count,
+            getattr(settings, "CART_COUNT_CACHE_TIMEOUT", 60 * 60),
+        )
+    return summary
+
+
+def cart_count_cache_key(user_id):
+    return f"core:cart_count:{user_id}"
+
+
+def get_cart_count(user):
+    """Number of lines in the user's open order, from the cache when possible."""
+    if not user.is_authenticated:
+        return 0
+    summary = getattr(user, _MEMO_ATTRIBUTE, None)
+    if summary is not None:
+        return summary.item_count
+    key = cart_count_cache_key(user.pk)
+    count = cache.get(key)
+    if count is None:
+        count = open_order_lines(user).count()
+        cache.set(key, count, getattr(settings, "CART_COUNT_CACHE_TIMEOUT", 60 * 60))
+    return count
+
+
+def forget_cart_count(user_id):
+    cache.delete(cart_count_cache_key(user_id))
+
+
+def get_or_create_open_order(user):
+    """The user's open Order (their cart), created on first use."""
+    order = Order.objects.filter(user=user, is_ordered=False).first()
+    if order is not None:
+        return order
+    try:
+        with transaction.atomic():
+            return Order.objects.create(user=user)
+    except IntegrityError:
+        # Another request created it first
+        return Order.objects.get(user=user, is_ordered=False)
+
+
+def add_to_order(order, item, quantity):
+    """
+    Adds `quantity` units of `item` to `order` with a single UPDATE, or an
+    INSERT when the order has no line for the item yet. Returns True when a
+    new line was created.
+    """
+    lines = OrderItem.objects.filter(order=order, item=item)
+    with transaction.atomic():
+        if lines.update(quantity=F("quantity") + quantity):
+            return False
+        try:
+            with transaction.atomic():
+                OrderItem.objects.create(user_id=order.user_id, order=order, item=item, quantity=quantity)
+            return True
+        except IntegrityError:
+            # A concurrent request inserted the line in between
+            lines.update(quantity=F("quantity") + quantity)
+            return False
+
+
+def parse_cart_changes(changes):
+    """
+    Validates a list of {"slug": ..., "quantity": ...} changes and returns
+    them as a {slug: quantity} dict. A later change of the same slug wins.
+    """
+    if not isinstance(changes, list) or not changes:
+        raise InvalidCartChange("Expected a non-empty list of changes.")
+    if len(changes) > MAX_CHANGES:
+        raise InvalidCartChange(f"At most {MAX_CHANGES} changes are accepted at once.")
+
+    quantities = {}
+    for change in changes:
+        if not isinstance(change, dict) or not isinstance(change.get("slug"), str):
+            raise InvalidCartChange("Each change needs a slug and a quantity.")
+        quantity = change.get("quantity")
+        if isinstance(quantity, str) and quantity.isdigit():
+            quantity = int(quantity)
+        if isinstance(quantity, bool) or not isinstance(quantity, int):
+            raise InvalidCartChange(f"Invalid quantity for {change['slug']!r}.")
+        if not 0 <= quantity <= MAX_LINE_QUANTITY:
+            raise InvalidCartChange(
+                f"The quantity of {change['slug']!r} must be between 0 and {MAX_LINE_QUANTITY}."
+            )
+        quantities[change["slug"]] = quantity
+    return quantities
+
+
+def apply_cart_changes(user, changes):
+    """
+    Sets the quantity of each item in the user's cart in one transaction, a
+    quantity of 0 removing the line, and returns the new CartSummary. Unknown
+    slugs reject the whole batch.
+    """
+    quantities = parse_cart_changes(changes)
+    items = Item.objects.only("pk", "slug").in_bulk(list(quantities), field_name="slug")
+    unknown = sorted(set(quantities) - set(items))
+    if unknown:
+        raise InvalidCartChange(f"Unknown items: {', '.join(unknown)}.")
+
+    removed = [items[slug].pk for slug, quantity in quantities.items() if quantity == 0]
+    kept = {slug: quantity for slug, quantity in quantities.items() if quantity > 0}
+    with transaction.atomic():
+        if kept:
+            order = get_or_create_open_order(user)
+            OrderItem.objects.bulk_create(
+                [
+                    OrderItem(user=user, order=order, item=items[slug], quantity=quantity)
+                    for slug, quantity in kept.items()
+                ],
+                update_conflicts=True,
+                unique_fields=["order", "item"],
+                update_fields=["quantity"],
+            )
+        if removed:
+            open_order_lines(user).filter(item__in=removed).delete()
+
+    forget_cart_count(user.pk)
+    if hasattr(user, _MEMO_ATTRIBUTE):
+        delattr(user, _MEMO_ATTRIBUTE)
+    return get_cart_summary(user)
+
+
+def place_order(order, ref_code):
+    """
+    Places the open `order`: freezes the prices of its lines and writes its
+    totals snapshot in one transaction, and returns the snapshot as a
+    CartSummary. The snapshot is written once, placing an order that is no
+    longer open raises OrderAlreadyPlaced.
+    """
+    with transaction.atomic():
+        lines = list(
+            OrderItem.objects.filter(order=order)
+            .select_related("item")
+            .select_for_update(of=("self",))
+        )
+        for line in lines:
+            line.unit_price = line.item.price
+            line.discount_unit_price = line.item.discount_price or None
+            line.is_ordered = True
+
+        subtotal = sum((line.get_total_cost() for line in lines), Decimal(0))
+        saving = sum((line.get_total_discount() for line in lines), Decimal(0))
+        percentage = order.coupon.discount if order.coupon_id else 0
+        summary = CartSummary(
+            item_count=len(lines),
+            quantity=sum(line.quantity for line in lines),
+            subtotal=subtotal.quantize(CENT),
+            saving=saving.quantize(CENT),
+            coupon_discount_percentage=percentage,
+            coupon_discount=coupon_discount(subtotal - saving, percentage),
+        )
+        snapshot = {
+            "is_ordered": True,
+            "ref_code": ref_code,
+            "ordered_date": timezone.now(),
+            "subtotal": summary.subtotal,
+            "saving": summary.saving,
+            "coupon_discount_percentage": percentage,
+            "coupon_discount": summary.coupon_discount,
+            "total": summary.total,
+        }
+        # Conditional, so two concurrent checkouts cannot both write it
+        if not Order.objects.filter(pk=order.pk, is_ordered=False).update(**snapshot):
+            raise OrderAlreadyPlaced(f"Order {order.pk} has already been placed.")
+        OrderItem.objects.bulk_update(lines, ["unit_price", "discount_unit_price", "is_ordered"])
+
+    for field, value in snapshot.items():
+        setattr(order, field, value)
+    # update() skips the post_save signal that does this
+    invalidate_counts(Order)
+    forget_cart_count(order.user_id)
+    return summary
+
+
+def reopen_order(order):
+    """
+    Undoes place_order for an order whose payment failed: the snapshot is
+    cleared and the order is the user's cart again. A cart started meanwhile
+    (in another tab, during the payment) is merged into it.
+    """
+    snapshot = {
+        "is_ordered": False,
+        "ref_code": None,
+        "subtotal": None,
+        "saving": None,
+        "coupon_discount_percentage": None,
+        "coupon_discount": None,
+        "total": None,
+    }
+    with transaction.atomic():
+        placed = Order.objects.select_for_update().filter(pk=order.pk, is_ordered=True)
+        if not placed.exists():
+            return
+        # A user has one open order at most, see unique_open_order_per_user
+        newer = list(
+            Order.objects.select_for_update()
+            .filter(user_id=order.user_id, is_ordered=False)
+            .values_list("pk", flat=True)
+        )
+        if newer:
+            for line in OrderItem.objects.filter(order__in=newer).select_related("item"):
+                add_to_order(order, line.item, line.quantity)
+            Order.objects.filter(pk__in=newer).delete()
+        placed.update(**snapshot)
+        OrderItem.objects.filter(order=order).update(
+            unit_price=None, discount_unit_price=None, is_ordered=False
+        )
+
+    for field, value in snapshot.items():
+        setattr(order, field, value)
+    invalidate_counts(Order)
+    forget_cart_count(order.user_id)
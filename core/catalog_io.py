@@ -0,0 +1,227 @@
+"""
+Streaming import and export of the catalog (Item rows) as CSV or JSON Lines.
+
+import_items reads the rows one at a time and validates each with
+ItemImportForm. It writes them in batches, one transaction per batch:
+
+- A row with the slug of an existing item updates that item with bulk_update.
+- Any other row creates an item with bulk_create. Items without a slug get
+  one from a SlugAllocator that is fed the slugs of the table once.
+
+Rows that do not validate are skipped and reported with their line number.
+Image values are file names relative to `images_dir`. Each file is copied into
+the storage next to the uploads of Item.image, under its name plus a digest
+of its content (shirt.<digest>.jpg): importing the same file again reuses the
+copy, and files of the same name from different directories or with another
+content never share one. Without `images_dir`, an image value is taken as the
+name of a file already in the storage, as written by export_items.
+
+bulk_create and bulk_update do not send the signals that keep the search index
+and the cached counts up to date, so each batch is indexed, and the Item
+version is bumped once at the end.
+
+export_items writes the same columns. It reads the table through
+iterator(chunk_size), so memory stays bounded whatever the size of the catalog.
+"""
+
+import csv
+import hashlib
+import json
+from dataclasses import dataclass, field
+from pathlib import Path
+
+from django.core.exceptions import ValidationError
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.db import transaction
+
+from . import search
+from .forms import ItemImportForm
+from .models import Item, assign_slugs, taken_slugs_allocator
+from .pagination import invalidate_counts
+
+FIELDS = ["slug", "title", "price", "discount_price", "description", "available", "category", "label", "image"]
+# Everything but the slug, which identifies the item to update, and the width
+# of the image, reset when the image changes
+UPDATE_FIELDS = FIELDS[1:] + ["image_width"]
+FORMATS = ("csv", "jsonl")
+DEFAULT_BATCH_SIZE = 1000
+# Hex digits of the SHA-256 of its content in the name of an imported image
+DIGEST_LENGTH = 16
+
+
+def detect_format(path):
+    suffix = Path(path).suffix.lower().lstrip(".")
+    if suffix == "json":
+        suffix = "jsonl"
+    if suffix not in FORMATS:
+        raise ValueError(f"Cannot tell the format of {path}, expected one of: {', '.join(FORMATS)}.")
+    return suffix
+
+
+def read_rows(stream, format):
+    """
+    Yields (line number, row) for each record of `stream`. A row is a dict,
+    or the ValueError raised when the record could not be parsed.
+    """
+    if format == "csv":
+        reader = csv.DictReader(stream)
+        for row in reader:
+            yield reader.line_num, row
+        return
+    for line_number, line in enumerate(stream, 1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError as error:
+            yield line_number, ValueError(f"Invalid JSON: {error}")
+            continue
+        if not isinstance(row, dict):
+            row = ValueError("Expected a JSON object.")
+        yield line_number, row
+
+
+class ImageResolver:
+    """Maps the image values of the rows to names in the storage."""
+
+    def __init__(self, directory=None, storage=default_storage, copy=True):
+        self.directory = Path(directory).resolve() if directory else None
+        self.storage = storage
+        self.copy = copy
+        self.upload_to = Item._meta.get_field("image").upload_to
+        self.resolved = {}
+
+    def resolve(self, value):
+        if not value or self.directory is None:
+            return value
+        if value not in self.resolved:
+            self.resolved[value] = self._store(value)
+        return self.resolved[value]
+
+    def _store(self, value):
+        path = (self.directory / value).resolve()
+        if not path.is_relative_to(self.directory) or not path.is_file():
+            raise ValidationError(f"Image not found: {value}")
+        with path.open("rb") as f:
+            digest = hashlib.file_digest(f, "sha256").hexdigest()[:DIGEST_LENGTH]
+            name = f"{self.upload_to}{path.stem}.{digest}{path.suffix}"
+            if not self.copy or self.storage.exists(name):
+                # The same content, imported before by this run or an earlier one
+                return name
+            f.seek(0)
+            return self.storage.save(name, File(f))
+
+
+@dataclass
+class ImportResult:
+    created: int = 0
+    updated: int = 0
+    errors: list = field(default_factory=list)  # (line number, message)
+
+
+def _error_message(form):
+    return "; ".join(
+        f"{name}: {' '.join(messages)}" if name != "__all__" else " ".join(messages)
+        for name, messages in form.errors.items()
+    )
+
+
+class ItemImporter:
+    def __init__(self, images_dir=None, batch_size=DEFAULT_BATCH_SIZE, dry_run=False):
+        self.batch_size = batch_size
+        self.dry_run = dry_run
+        self.images = ImageResolver(images_dir, copy=not dry_run)
+        self.allocator = taken_slugs_allocator()
+        self.seen_slugs = set()  # Given in the file
+        self.generated_slugs = set()  # Allocated by this import
+        self.result = ImportResult()
+
+    def run(self, stream, format):
+        batch = []
+        for line_number, row in read_rows(stream, format):
+            try:
+                batch.append(self.item_for(row))
+            except ValidationError as error:
+                self.result.errors.append((line_number, " ".join(error.messages)))
+                continue
+            if len(batch) >= self.batch_size:
+                self.write(batch)
+                batch = []
+        if batch:
+            self.write(batch)
+
+        if not self.dry_run and (self.result.created or self.result.updated):
+            invalidate_counts(Item)
+        return self.result
+
+    def item_for(self, row):
+        if isinstance(row, Exception):
+            raise ValidationError(str(row))
+        form = ItemImportForm(row)
+        if not form.is_valid():
+            raise ValidationError(_error_message(form))
+        data = form.cleaned_data
+        slug = data["slug"]
+        if slug in self.seen_slugs:
+            raise ValidationError(f"Duplicate slug in the file: {slug}")
+        if slug in self.generated_slugs:
+            raise ValidationError(f"The slug {slug} was given to an earlier row without a slug")
+        data["image"] = self.images.resolve(data["image"])
+        if slug:
+            self.seen_slugs.add(slug)
+        return Item(**{**data, "label": data["label"] or None})
+
+    def write(self, items):
+        existing = Item.objects.only("pk", "slug", "image", "image_width").in_bulk(
+            [item.slug for item in items if item.slug], field_name="slug"
+        )
+        to_update, to_create = [], []
+        for item in items:
+            if item.slug in existing:
+                current = existing[item.slug]
+                item.pk = current.pk
+                # The derivatives of the previous image do not apply to a new one
+                if item.image.name == current.image.name:
+                    item.image_width = current.image_width
+                to_update.append(item)
+            else:
+                to_create.append(item)
+        generated = [item for item in to_create if not item.slug]
+        assign_slugs(to_create, self.allocator)
+        self.generated_slugs.update(item.slug for item in generated)
+        self.result.created += len(to_create)
+        self.result.updated += len(to_update)
+        if self.dry_run:
+            return
+
+        with transaction.atomic():
+            Item.objects.bulk_create(to_create, batch_size=500)
+            Item.objects.bulk_update(to_update, UPDATE_FIELDS, batch_size=500)
+            search.index_items([item.pk for item in items])
+
+
+def import_items(stream, format, images_dir=None, batch_size=DEFAULT_BATCH_SIZE, dry_run=False):
+    """Imports the rows of `stream` and returns an ImportResult. Only validates with `dry_run`."""
+    return ItemImporter(images_dir, batch_size, dry_run).run(stream, format)
+
+
+def _csv_value(value):
+    return "" if value is None else value
+
+
+def export_items(stream, format, chunk_size=2000):
+    """Writes every item to `stream` in `format`, oldest first, and returns the number of rows."""
+    rows = Item.objects.order_by("pk").values_list(*FIELDS).iterator(chunk_size=chunk_size)
+    count = 0
+    if format == "csv":
+        writer = csv.writer(stream)
+        writer.writerow(FIELDS)
+        for row in rows:
+            writer.writerow([_csv_value(value) for value in row])
+            count += 1
+        return count
+    for row in rows:
+        stream.write(json.dumps(dict(zip(FIELDS, row)), default=str) + "\n")
+        count += 1
+    return count
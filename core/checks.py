@@ -0,0 +1,23 @@
+from django.conf import settings
+from django.core.checks import Tags, Warning, register
+
+PROCESS_LOCAL_BACKENDS = ("django.core.cache.backends.locmem.LocMemCache",)
+
+
+@register(Tags.caches)
+def check_shared_cache(app_configs, **kwargs):
+    """The cached counts and versions of core are only reset in a cache every worker shares."""
+    backend = settings.CACHES.get("default", {}).get("BACKEND")
+    if backend not in PROCESS_LOCAL_BACKENDS:
+        return []
+    return [
+        Warning(
+            "The default cache is not shared between processes.",
+            hint=(
+                "Cart counts, listing counts and the catalog version are invalidated "
+                "in the cache; with several workers, the others keep serving stale "
+                "values. Configure CACHES with a shared backend."
+            ),
+            id="core.W001",
+        )
+    ]
@@ -1,7 +1,7 @@
 from django import forms
 from django_countries.fields import CountryField
 from django_countries.widgets import CountrySelectWidget
-from .models import Refund, Address, Review
+from .models import Refund, Address, Review, CATEGORY_CHOICES, LABEL_CHOICES, SLUG_MAX_LENGTH
 from crispy_forms.helper import FormHelper
 from crispy_forms.layout import Submit
 
@@ -244,4 +244,53 @@ class ReviewForm(forms.ModelForm):
 class RefundForm(forms.ModelForm):
     class Meta:
         model = Refund
-        fields = ['ref_code', 'email', 'reason']
\ No newline at end of file
+        fields = ['ref_code', 'email', 'reason']
+
+
+class CatalogFilterForm(forms.Form):
+    """Facets of the product listings, read from the query string."""
+    category = forms.ChoiceField(choices=[('', 'All')] + list(CATEGORY_CHOICES), required=False)
+    label = forms.ChoiceField(choices=[('', 'All')] + list(LABEL_CHOICES), required=False)
+    min_price = forms.DecimalField(min_value=0, decimal_places=2, required=False)
+    max_price = forms.DecimalField(min_value=0, decimal_places=2, required=False)
+    in_stock = forms.BooleanField(required=False)
+
+    def has_facets(self):
+        self.is_valid()
+        return any(value not in (None, '', False) for value in self.cleaned_data.values())
+
+    def filter(self, queryset):
+        """Applies the valid facets to an Item queryset; invalid values are ignored."""
+        self.is_valid()
+        data = self.cleaned_data
+        return queryset.filter_facets(
+            category=data.get('category') or None,
+            label=data.get('label') or None,
+            min_price=data.get('min_price'),
+            max_price=data.get('max_price'),
+            # Unchecked means "everything", not "only out of stock"
+            in_stock=True if data.get('in_stock') else None,
+        )
+
+
+class ItemImportForm(forms.Form):
+    """One row of a catalog import, see core.catalog_io."""
+    slug = forms.SlugField(max_length=SLUG_MAX_LENGTH, required=False)
+    title = forms.CharField(max_length=100)
+    price = forms.DecimalField(min_value=0, max_digits=10, decimal_places=2)
+    discount_price = forms.DecimalField(min_value=0, max_digits=10, decimal_places=2, required=False)
+    description = forms.CharField()
+    # Left out or empty means available
+    available = forms.NullBooleanField(required=False)
+    category = forms.ChoiceField(choices=CATEGORY_CHOICES)
+    label = forms.ChoiceField(choices=[('', '')] + list(LABEL_CHOICES), required=False)
+    image = forms.CharField(max_length=100, required=False)
+
+    def clean(self):
+        cleaned_data = super().clean()
+        price, discount_price = cleaned_data.get('price'), cleaned_data.get('discount_price')
+        if price is not None and discount_price and discount_price >= price:
+            self.add_error('discount_price', 'The discount price must be lower than the price.')
+        if cleaned_data.get('available') is None:
+            cleaned_data['available'] = True
+        return cleaned_data
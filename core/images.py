@@ -0,0 +1,140 @@
+"""
+Responsive derivatives of the uploaded product images.
+
+For an image stored as item_images/shirt.jpg, build_derivatives writes, next
+to the original:
+
+- item_images/shirt.w320.jpg, item_images/shirt.w640.jpg... in the format of
+  the original, one per width of IMAGE_DERIVATIVE_WIDTHS narrower than the
+  original (images are never upscaled);
+- item_images/shirt.w320.webp... the same widths in WebP, plus one at the
+  width of the original.
+
+The width of the original is saved on the row (image_width), which tells the
+srcset template tags which files exist without touching the storage. It is
+None until the derivatives have been built, and the templates then fall back
+to the original alone.
+
+Derivatives are built after a new image is uploaded through a form or the
+admin (see schedule_derivatives), and for existing or bulk imported images
+by the build_image_derivatives command.
+"""
+
+import io
+import logging
+import posixpath
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import transaction
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+logger = logging.getLogger(__name__)
+
+WIDTHS = tuple(getattr(settings, "IMAGE_DERIVATIVE_WIDTHS", (320, 640, 960, 1280)))
+SAVE_OPTIONS = {
+    "JPEG": {"quality": 85, "optimize": True, "progressive": True},
+    "PNG": {"optimize": True},
+    "WEBP": {"quality": 80, "method": 4},
+}
+
+
+def derivative_widths(width):
+    """Widths with a derivative for an original `width` pixels wide, ascending."""
+    return [w for w in WIDTHS if w < width] + [width]
+
+
+def derivative_name(name, width, extension=None):
+    root, original_extension = posixpath.splitext(name)
+    return f"{root}.w{width}.{extension or original_extension.lstrip('.')}"
+
+
+def _save(storage, name, image, format):
+    if format == "JPEG" and image.mode not in ("RGB", "L"):
+        image = image.convert("RGB")
+    buffer = io.BytesIO()
+    image.save(buffer, format=format, **SAVE_OPTIONS.get(format, {}))
+    # Overwritten in place; the storage would pick another name otherwise
+    if storage.exists(name):
+        storage.delete(name)
+    storage.save(name, ContentFile(buffer.getvalue()))
+
+
+def build_derivatives(name, storage=None):
+    """
+    Writes the derivatives of the image stored under `name` and returns the
+    width of the original, or None when it cannot be read as an image.
+    """
+    storage = storage or default_storage
+    try:
+        with storage.open(name, "rb") as f:
+            original = Image.open(f)
+            format = original.format
+            original.load()
+    except (OSError, UnidentifiedImageError, Image.DecompressionBombError, ValueError) as e:
+        logger.warning("Cannot build the derivatives of %s: %s", name, e)
+        return None
+
+    # Phones store the orientation in the EXIF data rather than the pixels
+    image = ImageOps.exif_transpose(original)
+    width, height = image.size
+    for target in derivative_widths(width):
+        if target == width:
+            resized = image
+        else:
+            resized = image.resize((target, max(1, round(height * target / width))), Image.LANCZOS)
+            _save(storage, derivative_name(name, target), resized, format)
+        _save(storage, derivative_name(name, target, "webp"), resized, "WEBP")
+    return width
+
+
+def build_and_record(model, pk, name):
+    """
+    Builds the derivatives of a row's image and saves the width on the row.
+    Runs once the upload is committed, so any failure is logged, not raised.
+    """
+    try:
+        width = build_derivatives(name)
+        if width is not None:
+            # The image may have been replaced in the meantime
+            model.objects.filter(pk=pk, image=name).update(image_width=width)
+        return width
+    except Exception:
+        logger.exception("Cannot build the derivatives of %s", name)
+        return None
+
+
+def mark_uploaded_image(instance):
+    """Remembers, before the save, whether a new image file comes with it."""
+    instance._image_uploaded = bool(instance.image) and not instance.image._committed
+    if instance._image_uploaded:
+        # The derivatives of the previous image do not apply any more
+        instance.image_width = None
+
+
+def schedule_derivatives(instance):
+    """Builds the derivatives of a newly uploaded image once the save is committed."""
+    if not getattr(instance, "_image_uploaded", False):
+        return
+    instance._image_uploaded = False
+    model, pk, name = type(instance), instance.pk, instance.image.name
+    transaction.on_commit(lambda: build_and_record(model, pk, name))
+
+
+def srcset(image, width, extension=None):
+    """
+    The srcset of the derivatives of `image`, in WebP when `extension` is
+    "webp". Empty until the derivatives have been built.
+    """
+    if not image or not width:
+        return ""
+    storage = image.storage
+    entries = []
+    for target in derivative_widths(width):
+        if target == width and extension is None:
+            url = image.url
+        else:
+            url = storage.url(derivative_name(image.name, target, extension))
+        entries.append(f"{url} {target}w")
+    return ", ".join(entries)
@@ -0,0 +1,213 @@
+import json
+import random
+import statistics
+import subprocess
+import time
+from datetime import datetime, timezone as dt_timezone
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from core import search
+from core.cart import forget_cart_count
+from core.models import Item, Order, OrderItem, Review, rebuild_rating_summaries
+from core.pagination import invalidate_counts
+
+WORDS = [
+    'classic', 'slim', 'cotton', 'linen', 'denim', 'wool', 'summer', 'winter',
+    'casual', 'formal', 'striped', 'printed', 'shirt', 'dress', 'jacket',
+    'trousers', 'skirt', 'sweater', 'hoodie', 'coat',
+]
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(fraction * (len(values) - 1))))]
+
+
+def current_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Command(BaseCommand):
+    help = (
+        'Seeds a deterministic catalog, drives the storefront views through the test client '
+        'and reports p50/p95 latency and query counts per view (the seed data is rolled back)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--items', type=int, default=1000, help='Number of items to seed')
+        parser.add_argument('--reviews', type=int, default=10, help='Reviews per item')
+        parser.add_argument('--users', type=int, default=50, help='Number of users to seed')
+        parser.add_argument('--orders', type=int, default=5, help='Completed orders per user')
+        parser.add_argument('--cart-size', type=int, default=5, help='Items in the benchmark user\'s cart')
+        parser.add_argument('--iterations', type=int, default=30, help='Measured requests per view')
+        parser.add_argument('--warmup', type=int, default=3, help='Unmeasured requests per view')
+        parser.add_argument('--seed', type=int, default=0, help='Random seed for the generated data')
+        parser.add_argument('--output', help='Write the results as JSON to this file')
+        parser.add_argument('--compare', help='JSON results of an earlier run to print the differences against')
+
+    def seed(self, options):
+        rng = random.Random(options['seed'])
+
+        items = []
+        for i in range(options['items']):
+            title = ' '.join(rng.sample(WORDS, 3)).title()
+            price = rng.randint(10, 300)
+            items.append(Item(
+                title=title,
+                price=price,
+                discount_price=price * 0.8 if rng.random() < 0.3 else None,
+                description=' '.join(rng.choices(WORDS, k=30)),
+                available=rng.random() < 0.9,
+                category=rng.choice('MW'),
+                label=rng.choice(['P', 'S', 'D', None]),
+                # Slugs are set here because bulk_create skips Item.save
+                slug=f'benchmark-item-{i}',
+                image='item_images/benchmark.jpg',
+            ))
+        items = Item.objects.bulk_create(items, batch_size=500)
+        # bulk_create skips the signals that maintain the search index
+        search.index_items([item.pk for item in items])
+
+        users = User.objects.bulk_create([
+            User(username=f'benchmark-user-{i}', email=f'benchmark-user-{i}@example.com')
+            for i in range(options['users'])
+        ])
+        if not users:
+            raise ValueError('--users must be at least 1')
+
+        Review.objects.bulk_create([
+            Review(item=item, user=rng.choice(users), rating=rng.randint(1, 5), comment='Benchmark review.')
+            for item in items
+            for _ in range(options['reviews'])
+        ], batch_size=500)
+        # bulk_create bypasses Review.save, which maintains the rating summaries
+        rebuild_rating_summaries()
+
+        orders = Order.objects.bulk_create([
+            Order(user=user, ref_code=f'BENCH{user.pk:06d}{n:04d}', is_ordered=True)
+            for user in users
+            for n in range(options['orders'])
+        ])
+        OrderItem.objects.bulk_create([
+            OrderItem(user=order.user, order=order, item=item, quantity=rng.randint(1, 3), is_ordered=True)
+            for order in orders
+            for item in rng.sample(items, min(3, len(items)))
+        ], batch_size=500)
+
+        # The user the cart and checkout pages are rendered for
+        shopper = users[0]
+        cart = Order.objects.create(user=shopper)
+        OrderItem.objects.bulk_create([
+            OrderItem(user=shopper, order=cart, item=item, quantity=rng.randint(1, 3))
+            for item in rng.sample(items, min(options['cart_size'], len(items)))
+        ])
+        # bulk_create sends no signals either: the cached counts and search
+        # results of the real catalog must not be served for the seeded one
+        self.forget_cached(shopper)
+        return items, shopper
+
+    def forget_cached(self, shopper=None):
+        invalidate_counts(Item)
+        invalidate_counts(Order)
+        if shopper is not None:
+            forget_cart_count(shopper.pk)
+
+    def targets(self, items):
+        detail = max(items, key=lambda item: item.pk)
+        return [
+            ('HomeView', reverse('core:index'), False),
+            ('MenView', reverse('core:men'), False),
+            ('WomenView', reverse('core:women'), False),
+            ('AllProductsView', reverse('core:all-products'), False),
+            ('AllProductsView (last page)', reverse('core:all-products') + '?page=last', False),
+            ('SearchResultsView', reverse('core:search-results') + '?q=cotton', False),
+            ('search_items (typeahead)', reverse('core:search_items') + '?q=cot', False),
+            ('ItemDetailView', detail.get_absolute_url(), False),
+            ('CartView', reverse('core:cart'), True),
+            ('CheckoutView.get', reverse('core:checkout'), True),
+        ]
+
+    def measure(self, client, url, iterations, warmup):
+        for _ in range(warmup):
+            client.get(url)
+
+        timings, queries = [], []
+        for _ in range(iterations):
+            with CaptureQueriesContext(connection) as captured:
+                started = time.perf_counter()
+                response = client.get(url)
+                timings.append(time.perf_counter() - started)
+            if response.status_code != 200:
+                raise RuntimeError(f'GET {url} returned {response.status_code}')
+            queries.append(len(captured))
+
+        return {
+            'url': url,
+            'p50_ms': round(percentile(timings, 0.5) * 1000, 3),
+            'p95_ms': round(percentile(timings, 0.95) * 1000, 3),
+            'mean_ms': round(statistics.mean(timings) * 1000, 3),
+            'queries': max(queries),
+        }
+
+    def compare(self, results, path):
+        with open(path) as f:
+            baseline = json.load(f)
+        self.stdout.write(f"Compared with {path} (commit {baseline.get('commit')})")
+        for name, result in results['views'].items():
+            before = baseline['views'].get(name)
+            if before is None:
+                continue
+            self.stdout.write(
+                f"{name:<30} p50 {result['p50_ms'] - before['p50_ms']:>+8.2f} ms  "
+                f"p95 {result['p95_ms'] - before['p95_ms']:>+8.2f} ms  "
+                f"{result['queries'] - before['queries']:>+4} queries"
+            )
+
+    def handle(self, *args, **options):
+        results = {
+            'commit': current_commit(),
+            'started_at': datetime.now(dt_timezone.utc).isoformat(),
+            'parameters': {
+                key: options[key]
+                for key in ('items', 'reviews', 'users', 'orders', 'cart_size', 'iterations', 'warmup', 'seed')
+            },
+            'views': {},
+        }
+
+        shopper = None
+        try:
+            with transaction.atomic(), override_settings(ALLOWED_HOSTS=['testserver']):
+                items, shopper = self.seed(options)
+                anonymous, logged_in = Client(), Client()
+                logged_in.force_login(shopper)
+
+                for name, url, login in self.targets(items):
+                    client = logged_in if login else anonymous
+                    result = self.measure(client, url, options['iterations'], options['warmup'])
+                    results['views'][name] = result
+                    self.stdout.write(
+                        f"{name:<30} p50 {result['p50_ms']:>8.2f} ms  p95 {result['p95_ms']:>8.2f} ms  "
+                        f"{result['queries']:>4} queries"
+                    )
+                transaction.set_rollback(True)
+        finally:
+            # What was cached for the seeded data is gone with the rollback
+            self.forget_cached(shopper)
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(results, f, indent=2)
+            self.stdout.write(self.style.SUCCESS(f"Results written to {options['output']}"))
+        if options['compare']:
+            self.compare(results, options['compare'])
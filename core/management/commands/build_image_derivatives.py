@@ -0,0 +1,73 @@
+import logging
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+from django.apps import apps
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from core.images import build_derivatives
+
+logger = logging.getLogger(__name__)
+
+MODELS = ['core.Item', 'zbon_company.Product']
+
+
+def build(task):
+    pk, name = task
+    try:
+        return pk, build_derivatives(name)
+    except Exception:
+        # One image that cannot be written must not stop the others
+        logger.exception('Cannot build the derivatives of %s', name)
+        return pk, None
+
+
+class Command(BaseCommand):
+    help = (
+        'Builds the resized and WebP derivatives of the item and product images that have none yet, '
+        'in a pool of processes'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--model', action='append', choices=MODELS, help='Only these models (repeatable)')
+        parser.add_argument('--workers', type=int, default=None, help='Processes to use, one per CPU by default')
+        parser.add_argument('--chunk-size', type=int, default=20, help='Images handed to a process at a time')
+        parser.add_argument('--force', action='store_true', help='Also rebuild the images that have derivatives')
+
+    def handle(self, *args, **options):
+        if options['workers'] is not None and options['workers'] < 1:
+            raise CommandError('--workers must be at least 1')
+
+        for label in options['model'] or MODELS:
+            model = apps.get_model(label)
+            images = model.objects.exclude(image='').exclude(image__isnull=True)
+            if not options['force']:
+                images = images.filter(image_width__isnull=True)
+            tasks = list(images.order_by('pk').values_list('pk', 'image'))
+            if not tasks:
+                self.stdout.write(f'{label}: nothing to build')
+                continue
+
+            # The workers only touch the storage; forked database
+            # connections must not be shared with them
+            connections.close_all()
+            built, failed = 0, 0
+            widths = defaultdict(list)  # width -> pks
+            with ProcessPoolExecutor(max_workers=options['workers'], initializer=django.setup) as pool:
+                for pk, width in pool.map(build, tasks, chunksize=options['chunk_size']):
+                    if width is None:
+                        failed += 1
+                        continue
+                    built += 1
+                    widths[width].append(pk)
+
+            for width, pks in widths.items():
+                for start in range(0, len(pks), 500):
+                    model.objects.filter(pk__in=pks[start:start + 500]).update(image_width=width)
+            summary = f'{label}: built the derivatives of {built} image(s)'
+            if failed:
+                self.stdout.write(self.style.WARNING(f'{summary}, {failed} could not be read'))
+            else:
+                self.stdout.write(self.style.SUCCESS(summary))
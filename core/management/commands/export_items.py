@@ -0,0 +1,31 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core.catalog_io import FORMATS, detect_format, export_items
+
+
+class Command(BaseCommand):
+    help = 'Exports the catalog items to a CSV or JSON Lines file that import_items can read back'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='File to write, or - for the standard output')
+        parser.add_argument('--format', choices=FORMATS, help='Defaults to the extension of the file')
+        parser.add_argument('--chunk-size', type=int, default=2000, help='Rows fetched from the database at a time')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        try:
+            format = options['format'] or detect_format(path)
+        except ValueError as e:
+            raise CommandError(f'{e} Use --format.')
+
+        if path == '-':
+            export_items(sys.stdout, format, options['chunk_size'])
+            return
+        try:
+            with open(path, 'w', newline='', encoding='utf-8') as f:
+                count = export_items(f, format, options['chunk_size'])
+        except OSError as e:
+            raise CommandError(e)
+        self.stdout.write(self.style.SUCCESS(f'Exported {count} item(s) to {path}'))
@@ -0,0 +1,59 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core.catalog_io import DEFAULT_BATCH_SIZE, FORMATS, detect_format, import_items
+
+# Errors printed in full; the rest are only counted
+MAX_REPORTED_ERRORS = 50
+
+
+class Command(BaseCommand):
+    help = (
+        'Imports catalog items from a CSV or JSON Lines file, creating new items and updating the ones '
+        'whose slug already exists'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='File to import, or - for the standard input')
+        parser.add_argument('--format', choices=FORMATS, help='Defaults to the extension of the file')
+        parser.add_argument('--images-dir', help='Directory the image column is relative to')
+        parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE, help='Rows written per transaction')
+        parser.add_argument('--dry-run', action='store_true', help='Only validate the rows')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        try:
+            format = options['format'] or detect_format(path)
+        except ValueError as e:
+            raise CommandError(f'{e} Use --format.')
+
+        if path == '-':
+            result = self.run_import(sys.stdin, format, options)
+        else:
+            try:
+                with open(path, newline='', encoding='utf-8') as f:
+                    result = self.run_import(f, format, options)
+            except OSError as e:
+                raise CommandError(e)
+
+        for line_number, message in result.errors[:MAX_REPORTED_ERRORS]:
+            self.stderr.write(f'Line {line_number}: {message}')
+        if len(result.errors) > MAX_REPORTED_ERRORS:
+            self.stderr.write(f'... and {len(result.errors) - MAX_REPORTED_ERRORS} more')
+
+        verb = 'Would import' if options['dry_run'] else 'Imported'
+        summary = f'{verb} {result.created} new and {result.updated} updated item(s)'
+        if result.errors:
+            self.stdout.write(self.style.WARNING(f'{summary}, {len(result.errors)} invalid row(s) skipped'))
+        else:
+            self.stdout.write(self.style.SUCCESS(summary))
+
+    def run_import(self, stream, format, options):
+        return import_items(
+            stream,
+            format,
+            images_dir=options['images_dir'],
+            batch_size=options['batch_size'],
+            dry_run=options['dry_run'],
+        )
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from core.models import rebuild_rating_summaries
+
+
+class Command(BaseCommand):
+    help = 'Recomputes the rating count, sum and per-star histogram of every item from its reviews'
+
+    def handle(self, *args, **options):
+        changed = rebuild_rating_summaries()
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt rating summaries, {changed} item(s) corrected'))
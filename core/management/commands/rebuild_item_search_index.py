@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from core.models import Item
+from core.search import rebuild_index
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the full-text search index of the product catalog from the Item table'
+
+    def handle(self, *args, **options):
+        rebuild_index()
+        self.stdout.write(self.style.SUCCESS(f'Indexed {Item.objects.count()} item(s)'))
@@ -0,0 +1,62 @@
+# Generated by Django 5.0.3 on 2026-10-18 20:04
+
+from django.db import migrations, models
+from django.db.models import Count, Q, Sum
+
+
+def fill_rating_summaries(apps, schema_editor):
+    Item = apps.get_model('core', 'Item')
+    Review = apps.get_model('core', 'Review')
+    rows = Review.objects.order_by().values('item').annotate(
+        rating_count=Count('id'),
+        rating_sum=Sum('rating'),
+        **{f'stars_{star}': Count('id', filter=Q(rating=star)) for star in range(1, 6)},
+    )
+    for row in rows:
+        Item.objects.filter(pk=row.pop('item')).update(**row)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0004_alter_item_label_alter_item_slug'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='item',
+            name='rating_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='item',
+            name='rating_sum',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='item',
+            name='stars_1',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='item',
+            name='stars_2',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='item',
+            name='stars_3',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='item',
+            name='stars_4',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='item',
+            name='stars_5',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(fill_rating_summaries, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,52 @@
+# Generated by Django 5.0.3 on 2026-10-18 20:15
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Sum
+
+
+def merge_duplicate_carts(apps, schema_editor):
+    Order = apps.get_model('core', 'Order')
+    OrderItem = apps.get_model('core', 'OrderItem')
+
+    # Several open orders of a user are folded into the oldest one
+    users = (
+        Order.objects.filter(is_ordered=False, user__isnull=False)
+        .values('user').annotate(open_orders=Count('id')).filter(open_orders__gt=1)
+        .values_list('user', flat=True)
+    )
+    for user_id in list(users):
+        keep, *others = Order.objects.filter(user_id=user_id, is_ordered=False).order_by('id')
+        OrderItem.objects.filter(order__in=others).update(order=keep)
+        Order.objects.filter(pk__in=[order.pk for order in others]).delete()
+
+    # Several lines for the same item are folded into one, adding up the quantities
+    duplicates = (
+        OrderItem.objects.values('order', 'item')
+        .annotate(lines=Count('id'), total=Sum('quantity')).filter(lines__gt=1)
+    )
+    for row in list(duplicates):
+        keep, *others = OrderItem.objects.filter(order=row['order'], item=row['item']).order_by('id')
+        keep.quantity = row['total']
+        keep.save(update_fields=['quantity'])
+        OrderItem.objects.filter(pk__in=[line.pk for line in others]).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0005_item_rating_summary'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_carts, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='order',
+            constraint=models.UniqueConstraint(condition=models.Q(('is_ordered', False)), fields=('user',), name='unique_open_order_per_user'),
+        ),
+        migrations.AddConstraint(
+            model_name='orderitem',
+            constraint=models.UniqueConstraint(fields=('order', 'item'), name='unique_order_item'),
+        ),
+    ]
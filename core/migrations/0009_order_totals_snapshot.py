@@ -0,0 +1,81 @@
+# Generated by Django 5.0.3 on 2026-10-18 20:32
+
+from decimal import Decimal
+
+from django.db import migrations, models
+
+
+def snapshot_placed_orders(apps, schema_editor):
+    Order = apps.get_model('core', 'Order')
+    OrderItem = apps.get_model('core', 'OrderItem')
+
+    # The prices at checkout are lost, so orders placed before the snapshot
+    # existed are frozen at the current prices
+    cent = Decimal('0.01')
+    orders = Order.objects.filter(is_ordered=True, total__isnull=True).select_related('coupon')
+    for order in orders.iterator(chunk_size=500):
+        lines = list(OrderItem.objects.filter(order=order).select_related('item'))
+        subtotal = saving = Decimal(0)
+        for line in lines:
+            line.unit_price = line.item.price
+            line.discount_unit_price = line.item.discount_price or None
+            subtotal += line.quantity * line.unit_price
+            if line.discount_unit_price:
+                saving += line.quantity * (line.unit_price - line.discount_unit_price)
+        OrderItem.objects.bulk_update(lines, ['unit_price', 'discount_unit_price'])
+
+        percentage = order.coupon.discount if order.coupon_id else 0
+        coupon_discount = ((subtotal - saving) * percentage / 100).quantize(cent)
+        Order.objects.filter(pk=order.pk).update(
+            subtotal=subtotal.quantize(cent),
+            saving=saving.quantize(cent),
+            coupon_discount_percentage=percentage,
+            coupon_discount=coupon_discount,
+            total=(subtotal - saving).quantize(cent) - coupon_discount,
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0008_item_search_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='coupon_discount',
+            field=models.DecimalField(blank=True, decimal_places=2, max_digits=12, null=True),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='coupon_discount_percentage',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='saving',
+            field=models.DecimalField(blank=True, decimal_places=2, max_digits=12, null=True),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='subtotal',
+            field=models.DecimalField(blank=True, decimal_places=2, max_digits=12, null=True),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='total',
+            field=models.DecimalField(blank=True, decimal_places=2, max_digits=12, null=True),
+        ),
+        migrations.AddField(
+            model_name='orderitem',
+            name='discount_unit_price',
+            field=models.DecimalField(blank=True, decimal_places=2, max_digits=10, null=True),
+        ),
+        migrations.AddField(
+            model_name='orderitem',
+            name='unit_price',
+            field=models.DecimalField(blank=True, decimal_places=2, max_digits=10, null=True),
+        ),
+        migrations.RunPython(snapshot_placed_orders, migrations.RunPython.noop),
+    ]
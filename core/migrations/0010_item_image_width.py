@@ -0,0 +1,18 @@
+# Generated by Django 5.0.3 on 2026-10-18 20:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0009_order_totals_snapshot'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='item',
+            name='image_width',
+            field=models.PositiveIntegerField(blank=True, editable=False, null=True),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 5.0.3 on 2026-10-18 21:12
+
+from django.db import migrations
+from django.db.models import OuterRef, Subquery
+
+
+def copy_order_users(apps, schema_editor):
+    Order = apps.get_model('core', 'Order')
+    OrderItem = apps.get_model('core', 'OrderItem')
+
+    # Lines of the cart used to be created without a user
+    OrderItem.objects.filter(user__isnull=True).update(
+        user=Subquery(Order.objects.filter(pk=OuterRef('order_id')).values('user')[:1])
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0010_item_image_width'),
+    ]
+
+    operations = [
+        migrations.RunPython(copy_order_users, migrations.RunPython.noop),
+    ]
@@ -1,9 +1,12 @@
-from django.db import models
+from django.db import IntegrityError, models, transaction
 from django.conf import settings
+from django.db.models import Case, Count, DecimalField, F, Q, Sum, Value, When
+from django.db.models.functions import Coalesce, Round
 from django.urls import reverse
 from django_countries.fields import CountryField
 from django.core.validators import MinValueValidator, MaxValueValidator
-from django.utils.text import slugify
+from .slugs import SlugAllocator, slug_base
+from decimal import Decimal
 
 CATEGORY_CHOICES = (
     ('M', 'Men'),
@@ -21,6 +24,51 @@ ADDRESS_CHOESIES=(
     ('S','Shipping')
 )
 
+STAR_FIELDS = [f"stars_{star}" for star in range(1, 6)]
+RATING_SUMMARY_FIELDS = ["rating_count", "rating_sum", *STAR_FIELDS]
+MONEY = DecimalField(max_digits=12, decimal_places=2)
+SLUG_MAX_LENGTH = 50  # Of Item.slug
+SLUG_ATTEMPTS = 5
+
+
+class ItemQuerySet(models.QuerySet):
+    """
+    Catalog queries, shaped to the indexes declared on Item. Listings are
+    ordered newest first with the id as the last key, so pages never overlap.
+    """
+
+    def listed(self):
+        return self.order_by("-id")
+
+    def featured(self):
+        # Best sellers (label 'P') first, then big discounts (label 'D'); 'P'
+        # sorts after 'D', so a descending label order walks item_label_idx
+        return self.filter(label__in=["P", "D"]).order_by("-label", "-id")
+
+    def filter_facets(self, category=None, label=None, min_price=None, max_price=None, in_stock=None):
+        """Narrows the queryset by the given facets, leaving out the ones that are None."""
+        filters = {}
+        if category is not None:
+            filters["category"] = category
+        if label is not None:
+            filters["label"] = label
+        if min_price is not None:
+            filters["price__gte"] = min_price
+        if max_price is not None:
+            filters["price__lte"] = max_price
+        if in_stock is not None:
+            filters["available"] = in_stock
+        return self.filter(**filters)
+
+    def facet_counts(self):
+        """Number of items per category and per label, for the current filters."""
+        counts = {}
+        for facet in ("category", "label"):
+            rows = self.order_by().values_list(facet).annotate(count=Count("id"))
+            counts[facet] = {value: count for value, count in rows if value is not None}
+        return counts
+
+
 class Item(models.Model):
     title = models.CharField(max_length=100)
     price = models.DecimalField(max_digits=10, decimal_places=2)
@@ -29,22 +77,98 @@ class Item(models.Model):
     available = models.BooleanField(default=True)
     category = models.CharField(max_length=1, choices=CATEGORY_CHOICES)
     label = models.CharField(max_length=1, choices=LABEL_CHOICES, null=True, blank=True)
-    slug = models.SlugField(unique=True, blank=True)
+    slug = models.SlugField(max_length=SLUG_MAX_LENGTH, unique=True, blank=True)
     image = models.ImageField(upload_to='item_images/', null=True, blank=True)
+    # Width of the image once its derivatives are built, see core.images
+    image_width = models.PositiveIntegerField(null=True, blank=True, editable=False)
+    # Rating summary, kept up to date by Review.save and the post_delete signal
+    rating_count = models.PositiveIntegerField(default=0)
+    rating_sum = models.PositiveIntegerField(default=0)
+    stars_1 = models.PositiveIntegerField(default=0)
+    stars_2 = models.PositiveIntegerField(default=0)
+    stars_3 = models.PositiveIntegerField(default=0)
+    stars_4 = models.PositiveIntegerField(default=0)
+    stars_5 = models.PositiveIntegerField(default=0)
+
+    objects = ItemQuerySet.as_manager()
 
     def __str__(self):
         return self.title
     
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # To tell an explicit title change in save
+        instance._loaded_title = instance.__dict__.get("title")
+        return instance
+
+    def needs_slug(self):
+        """True on create without a slug, and when the title changed its slug base."""
+        if not self.slug:
+            return True
+        loaded_title = getattr(self, "_loaded_title", None)
+        if self._state.adding or loaded_title is None or loaded_title == self.title:
+            return False
+        return slug_base(loaded_title, SLUG_MAX_LENGTH) != slug_base(self.title, SLUG_MAX_LENGTH)
+
     def save(self, *args, **kwargs):
-        self.slug = slugify(self.title)
-        original_slug = self.slug
-        count = 1
-        while Item.objects.filter(slug=self.slug).exists():
-            self.slug = original_slug + '-' + str(count)
-            count += 1
-        super().save(*args, **kwargs)
+        if not self.needs_slug():
+            super().save(*args, **kwargs)
+            self._loaded_title = self.title
+            return
+
+        update_fields = kwargs.get("update_fields")
+        if update_fields is not None:
+            kwargs["update_fields"] = {*update_fields, "slug"}
+        base = slug_base(self.title, SLUG_MAX_LENGTH)
+        for attempt in range(SLUG_ATTEMPTS):
+            # One query for the slugs that can conflict with the base
+            allocator = SlugAllocator()
+            allocator.add_taken(
+                Item.objects.filter(slug__startswith=base)
+                .exclude(pk=self.pk)
+                .values_list("slug", flat=True)
+            )
+            self.slug = allocator.allocate(base)
+            try:
+                with transaction.atomic():
+                    super().save(*args, **kwargs)
+                break
+            except IntegrityError:
+                # Retried when a concurrent save took the slug in between
+                taken = Item.objects.filter(slug=self.slug).exclude(pk=self.pk).exists()
+                if not taken or attempt == SLUG_ATTEMPTS - 1:
+                    raise
+        self._loaded_title = self.title
 
     
+    @property
+    def rating_average(self):
+        return self.rating_sum / self.rating_count if self.rating_count else 0
+
+    def get_review_stats(self):
+        """
+        Average rating, number of reviews and number of reviews per star
+        ("stars_1" to "stars_5"), read from the rating summary of the row.
+        """
+        return {
+            "average_rating": self.rating_average,
+            "number_of_reviews": self.rating_count,
+            **{field: getattr(self, field) for field in STAR_FIELDS},
+        }
+
+    @staticmethod
+    def adjust_rating_summary(item_id, rating, delta):
+        """Adds (delta=1) or removes (delta=-1) one rating from an item's summary."""
+        # The rating names a column, so it must be one of the stars_* fields
+        if rating not in range(1, 6):
+            raise ValueError(f"A rating must be an integer from 1 to 5, not {rating!r}.")
+        Item.objects.filter(pk=item_id).update(
+            rating_count=F("rating_count") + delta,
+            rating_sum=F("rating_sum") + delta * rating,
+            **{f"stars_{rating}": F(f"stars_{rating}") + delta},
+        )
+
     def get_absolute_url(self):
         return reverse("core:product-detail",kwargs={
             'slug':self.slug
@@ -77,6 +201,17 @@ class Item(models.Model):
         else:
             # If the user is not authenticated, return False
             return False
+
+    class Meta:
+        indexes = [
+            # Men / women listings and the category and price facets. `available`
+            # is left out: Django filters booleans as a bare column on SQLite,
+            # which cannot seek into an index, and most items are in stock anyway
+            models.Index(fields=['category', '-id'], name='item_category_idx'),
+            models.Index(fields=['category', 'price'], name='item_category_price_idx'),
+            # Home page shelves and the label facet
+            models.Index(fields=['label', '-id'], name='item_label_idx'),
+        ]
     
 class Review(models.Model):
     item = models.ForeignKey('Item', on_delete=models.CASCADE)
@@ -88,8 +223,78 @@ class Review(models.Model):
     def __str__(self):
         return f"Review by {self.user} for {self.item}"
 
+    def save(self, *args, **kwargs):
+        # The item's rating summary changes in the same transaction as the review
+        with transaction.atomic():
+            previous = None
+            if not self._state.adding:
+                previous = (
+                    Review.objects.select_for_update()
+                    .filter(pk=self.pk)
+                    .values_list("item_id", "rating")
+                    .first()
+                )
+            super().save(*args, **kwargs)
+            if previous != (self.item_id, self.rating):
+                if previous is not None:
+                    Item.adjust_rating_summary(*previous, -1)
+                Item.adjust_rating_summary(self.item_id, self.rating, 1)
+
     class Meta:
         ordering = ['-date_added']
+
+
+def taken_slugs_allocator():
+    """A SlugAllocator fed with every slug of the table, in one pass."""
+    allocator = SlugAllocator()
+    allocator.add_taken(Item.objects.values_list("slug", flat=True).iterator(chunk_size=5000))
+    return allocator
+
+
+def assign_slugs(items, allocator=None):
+    """
+    Gives a unique slug to each of `items` that has none, for imports that
+    go around Item.save (bulk_create). The slugs taken are read in one pass
+    over the table, so thousands of items cost a single query; an import
+    done in batches passes the same `allocator` to every call instead.
+    """
+    pending = [item for item in items if not item.slug]
+    if not pending:
+        return
+    if allocator is None:
+        allocator = taken_slugs_allocator()
+    # Slugs given in the batch itself are taken too
+    allocator.add_taken(item.slug for item in items if item.slug)
+    for item in pending:
+        item.slug = allocator.allocate(slug_base(item.title, SLUG_MAX_LENGTH))
+
+
+def rebuild_rating_summaries():
+    """
+    Recomputes the rating summary of every item from its reviews, for data
+    written around Review.save (bulk_create, raw SQL, fixtures). Returns the
+    number of items whose summary was wrong.
+    """
+    with transaction.atomic():
+        summaries = {
+            row.pop("item"): row
+            for row in Review.objects.order_by().values("item").annotate(
+                rating_count=Count("id"),
+                rating_sum=Sum("rating"),
+                **{f"stars_{star}": Count("id", filter=Q(rating=star)) for star in range(1, 6)},
+            )
+        }
+        empty = dict.fromkeys(RATING_SUMMARY_FIELDS, 0)
+        changed = []
+        for item in Item.objects.only("pk", *RATING_SUMMARY_FIELDS).iterator(chunk_size=2000):
+            summary = summaries.get(item.pk, empty)
+            if any(getattr(item, field) != summary[field] for field in RATING_SUMMARY_FIELDS):
+                for field in RATING_SUMMARY_FIELDS:
+                    setattr(item, field, summary[field])
+                changed.append(item)
+        Item.objects.bulk_update(changed, RATING_SUMMARY_FIELDS, batch_size=500)
+    return len(changed)
+
     
 class OrderItem(models.Model):
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, null=True, blank=True)
@@ -97,21 +302,33 @@ class OrderItem(models.Model):
     item = models.ForeignKey('Item', on_delete=models.CASCADE)
     quantity = models.PositiveIntegerField(default=1)
     is_ordered = models.BooleanField(default=False)
+    # Prices of the item when the order was placed, see place_order in cart.py
+    unit_price = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)
+    discount_unit_price = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)
 
     def __str__(self):
         return f"{self.quantity} of {self.item.title} ordered by {self.user}"
+
+    def get_unit_price(self):
+        """The price at checkout once the order is placed, the item's price until then."""
+        return self.unit_price if self.unit_price is not None else self.item.price
+
+    def get_discount_unit_price(self):
+        if self.unit_price is not None:
+            return self.discount_unit_price
+        return self.item.discount_price
     
     def get_total_cost(self):
-        return self.quantity * self.item.price
+        return self.quantity * self.get_unit_price()
     
     def get_discount_total_cost(self):
-        if self.item.discount_price:
-            return self.quantity * self.item.discount_price
+        if self.get_discount_unit_price():
+            return self.quantity * self.get_discount_unit_price()
         return 0
     
     def get_total_discount(self):
-        if self.item.discount_price:
-            return self.quantity * (self.item.price - self.item.discount_price)
+        if self.get_discount_unit_price():
+            return self.quantity * (self.get_unit_price() - self.get_discount_unit_price())
         return 0
     
     def get_total_saving(self):
@@ -121,11 +338,81 @@ class OrderItem(models.Model):
         return self.order.coupon.discount if self.order.coupon else 0
     
     def get_final_price(self):
-        if self.item.discount_price:
+        if self.get_discount_unit_price():
             return self.get_discount_total_cost()
         return self.get_total_cost()
+
+    class Meta:
+        constraints = [
+            # One line per item in an order, so quantities can be upserted
+            models.UniqueConstraint(fields=['order', 'item'], name='unique_order_item'),
+        ]
     
     
+class OrderQuerySet(models.QuerySet):
+    def with_totals(self):
+        """
+        Annotates each order with its number of lines (line_count) and units
+        (unit_count), its subtotal at full price (subtotal_amount), the saving
+        from discount prices (saving_amount) and the total after the coupon
+        (total_amount, to the cent), all computed by the database. Placed
+        orders take the amounts from their snapshot instead of the items.
+        """
+        line_saving = Case(
+            When(
+                orderitem__item__discount_price__gt=0,
+                then=F("orderitem__quantity")
+                * (F("orderitem__item__price") - F("orderitem__item__discount_price")),
+            ),
+            default=0,
+            output_field=MONEY,
+        )
+        live = self.alias(
+            live_subtotal=Coalesce(
+                Sum(F("orderitem__quantity") * F("orderitem__item__price"), output_field=MONEY),
+                Decimal(0),
+                output_field=MONEY,
+            ),
+            live_saving=Coalesce(Sum(line_saving), Decimal(0), output_field=MONEY),
+        ).alias(
+            live_total=Round(
+                Case(
+                    When(
+                        coupon__isnull=False,
+                        then=(F("live_subtotal") - F("live_saving"))
+                        * (Value(Decimal(100)) - F("coupon__discount"))
+                        / Value(Decimal(100)),
+                    ),
+                    default=F("live_subtotal") - F("live_saving"),
+                    output_field=MONEY,
+                ),
+                2,
+            )
+        )
+        return live.annotate(
+            line_count=Count("orderitem"),
+            unit_count=Coalesce(Sum("orderitem__quantity"), 0),
+            subtotal_amount=Coalesce(F("subtotal"), F("live_subtotal"), output_field=MONEY),
+            saving_amount=Coalesce(F("saving"), F("live_saving"), output_field=MONEY),
+            total_amount=Coalesce(F("total"), F("live_total"), output_field=MONEY),
+        )
+
+    def history(self, user):
+        """
+        The orders of `user`, newest first, with their totals, coupon and
+        lines (as `lines`, each with its item) loaded in a fixed number of
+        queries.
+        """
+        lines = OrderItem.objects.select_related("item").order_by("id")
+        return (
+            self.filter(user=user)
+            .with_totals()
+            .select_related("coupon")
+            .prefetch_related(models.Prefetch("orderitem_set", queryset=lines, to_attr="lines"))
+            .order_by("-ordered_date", "-id")
+        )
+
+
 class Order(models.Model):
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, null=True, blank=True)
     ref_code = models.CharField(max_length=20, blank=True, null=True)
@@ -140,6 +427,15 @@ class Order(models.Model):
     received = models.BooleanField(default=False)
     refund_requested = models.BooleanField(default=False)
     refund_granted = models.BooleanField(default=False)
+    # Totals snapshot written once by place_order in cart.py; None while the
+    # order is a cart
+    subtotal = models.DecimalField(max_digits=12, decimal_places=2, null=True, blank=True)
+    saving = models.DecimalField(max_digits=12, decimal_places=2, null=True, blank=True)
+    coupon_discount_percentage = models.PositiveIntegerField(null=True, blank=True)
+    coupon_discount = models.DecimalField(max_digits=12, decimal_places=2, null=True, blank=True)
+    total = models.DecimalField(max_digits=12, decimal_places=2, null=True, blank=True)
+
+    objects = OrderQuerySet.as_manager()
 
     def __str__(self):
         return f"Order by {self.user.username} and the ref code is {self.ref_code}"
@@ -148,6 +444,14 @@ class Order(models.Model):
         self.refund_requested = True
         self.save()
 
+    class Meta:
+        constraints = [
+            # A user has at most one open order, their cart
+            models.UniqueConstraint(
+                fields=['user'], condition=models.Q(is_ordered=False), name='unique_open_order_per_user'
+            ),
+        ]
+
 class Address(models.Model):
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
     country = CountryField(multiple=False)
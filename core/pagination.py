@@ -0,0 +1,66 @@
+"""
+Paginator with cached counts for the product and order listings.
+
+Django's Paginator runs a COUNT(*) on every page request. CachingPaginator
+caches that count under a digest of the SQL and parameters of the query (its
+"filter signature") for a short time. The key also holds a version number
+per model, which core.signals bumps whenever an Item or an Order is saved or
+deleted. Writes that send no signals (queryset.update(), bulk_create...) must
+call invalidate_counts themselves, or wait for the timeout.
+
+The versions are only seen by every worker when the cache is shared between
+them (see CACHES in the settings, and the core.W001 check). A per-process
+cache such as LocMemCache only bumps the version of the worker that made the
+change; the others keep their counts until PAGINATOR_COUNT_CACHE_TIMEOUT.
+"""
+
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import EmptyResultSet
+from django.core.paginator import Paginator
+from django.db.models.query import QuerySet
+from django.utils.functional import cached_property
+
+
+def _version_key(model):
+    return f"core:count_version:{model._meta.label_lower}"
+
+
+def count_version(model):
+    return cache.get_or_set(_version_key(model), time.time_ns, None)
+
+
+def invalidate_counts(model):
+    """Makes every cached count of `model` querysets stale."""
+    try:
+        cache.incr(_version_key(model))
+    except ValueError:
+        # Not in the cache (yet, or any more): start from a version that
+        # cannot have been used before
+        cache.set(_version_key(model), time.time_ns(), None)
+
+
+def count_cache_key(queryset):
+    sql, params = queryset.query.sql_with_params()
+    signature = hashlib.md5(repr((sql, params)).encode()).hexdigest()
+    return f"core:count:{queryset.model._meta.label_lower}:{count_version(queryset.model)}:{signature}"
+
+
+class CachingPaginator(Paginator):
+    @cached_property
+    def count(self):
+        if not isinstance(self.object_list, QuerySet):
+            return super().count
+        try:
+            key = count_cache_key(self.object_list)
+        except EmptyResultSet:
+            # For example Item.objects.none()
+            return 0
+        count = cache.get(key)
+        if count is None:
+            count = self.object_list.count()
+            cache.set(key, count, getattr(settings, "PAGINATOR_COUNT_CACHE_TIMEOUT", 60))
+        return count
@@ -0,0 +1,218 @@
+"""
+Full-text product search over Item titles and descriptions.
+
+The index lives in the database and is reached through a backend picked from
+the connection vendor, or from the CORE_SEARCH_BACKEND setting (a dotted
+path) to swap it:
+
+- SQLiteSearchBackend keeps an FTS5 table in step with Item through the
+  signals in signals.py and ranks with BM25, titles weighing the most.
+- PostgresSearchBackend relies on a generated, GIN-indexed tsvector column,
+  which the database maintains by itself, and ranks with ts_rank_cd.
+- ContainsSearchBackend is the icontains fallback for any other database.
+
+Every word of a query has to match, as a prefix of a word, so the same
+index serves the typeahead and the search results page. Ranked ids are
+cached under the Item version of core.pagination, in the shared cache, so
+they are dropped when the catalog changes. CORE_SEARCH_CACHE_TIMEOUT is kept
+short to bound how long a write that bypasses the signals goes unseen.
+"""
+
+import hashlib
+import re
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+from django.db.models import Q
+from django.utils.module_loading import import_string
+
+from .models import Item
+from .pagination import count_version
+
+FTS_TABLE = "core_item_fts"
+# Upper bound of the results page; nobody pages through more than that
+SEARCH_RESULT_LIMIT = 1000
+
+
+def query_terms(query):
+    return re.findall(r"\w+", query.lower())
+
+
+class SQLiteSearchBackend:
+    # BM25 column weights: title, description
+    rank = f"bm25({FTS_TABLE}, 10.0, 1.0)"
+
+    def match_expression(self, terms, title_only):
+        expression = " ".join(f'"{term}"*' for term in terms)
+        return f"title : ({expression})" if title_only else expression
+
+    def search(self, terms, limit, title_only=False):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"SELECT item.id FROM {FTS_TABLE} "
+                f"JOIN {Item._meta.db_table} item ON item.id = {FTS_TABLE}.rowid "
+                f"WHERE {FTS_TABLE} MATCH %s AND item.available "
+                f"ORDER BY {self.rank}, item.id DESC LIMIT %s",
+                [self.match_expression(terms, title_only), limit],
+            )
+            return [row[0] for row in cursor.fetchall()]
+
+    def index(self, pks):
+        pks = list(pks)
+        with connection.cursor() as cursor:
+            for start in range(0, len(pks), 500):
+                chunk = pks[start : start + 500]
+                placeholders = ", ".join(["%s"] * len(chunk))
+                cursor.execute(f"DELETE FROM {FTS_TABLE} WHERE rowid IN ({placeholders})", chunk)
+                cursor.execute(
+                    f"INSERT INTO {FTS_TABLE} (rowid, title, description) "
+                    f"SELECT id, title, description FROM {Item._meta.db_table} "
+                    f"WHERE id IN ({placeholders})",
+                    chunk,
+                )
+
+    def unindex(self, pk):
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {FTS_TABLE} WHERE rowid = %s", [pk])
+
+    def rebuild(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {FTS_TABLE}")
+            cursor.execute(
+                f"INSERT INTO {FTS_TABLE} (rowid, title, description) "
+                f"SELECT id, title, description FROM {Item._meta.db_table}"
+            )
+
+
+class PostgresSearchBackend:
+    def tsquery(self, terms, title_only):
+        # Title words carry the weight A in the search_vector column
+        suffix = ":*A" if title_only else ":*"
+        return " & ".join(f"{term}{suffix}" for term in terms)
+
+    def search(self, terms, limit, title_only=False):
+        tsquery = self.tsquery(terms, title_only)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"SELECT id FROM {Item._meta.db_table} "
+                "WHERE search_vector @@ to_tsquery('simple', %s) AND available "
+                "ORDER BY ts_rank_cd(search_vector, to_tsquery('simple', %s)) DESC, id DESC "
+                "LIMIT %s",
+                [tsquery, tsquery, limit],
+            )
+            return [row[0] for row in cursor.fetchall()]
+
+    # The tsvector column is generated by the database
+    def index(self, pks):
+        pass
+
+    def unindex(self, pk):
+        pass
+
+    def rebuild(self):
+        pass
+
+
+class ContainsSearchBackend:
+    def search(self, terms, limit, title_only=False):
+        matches = Q()
+        for term in terms:
+            term_matches = Q(title__icontains=term)
+            if not title_only:
+                term_matches |= Q(description__icontains=term)
+            matches &= term_matches
+        items = Item.objects.filter(matches, available=True).listed()
+        return list(items.values_list("pk", flat=True)[:limit])
+
+    def index(self, pks):
+        pass
+
+    def unindex(self, pk):
+        pass
+
+    def rebuild(self):
+        pass
+
+
+VENDOR_BACKENDS = {
+    "sqlite": SQLiteSearchBackend,
+    "postgresql": PostgresSearchBackend,
+}
+
+
+_backend = None
+
+
+def get_backend():
+    global _backend
+    if _backend is None:
+        path = getattr(settings, "CORE_SEARCH_BACKEND", None)
+        if path:
+            _backend = import_string(path)()
+        else:
+            _backend = VENDOR_BACKENDS.get(connection.vendor, ContainsSearchBackend)()
+    return _backend
+
+
+def _cached_search(kind, query, limit, title_only):
+    terms = query_terms(query)
+    if not terms:
+        return []
+    digest = hashlib.md5(" ".join(terms).encode()).hexdigest()
+    # The Item version changes whenever an item is saved or deleted
+    key = f"core:search:{kind}:{count_version(Item)}:{limit}:{digest}"
+    ids = cache.get(key)
+    if ids is None:
+        ids = get_backend().search(terms, limit, title_only=title_only)
+        cache.set(key, ids, getattr(settings, "CORE_SEARCH_CACHE_TIMEOUT", 60))
+    return ids
+
+
+def search_item_ids(query, limit=SEARCH_RESULT_LIMIT):
+    """Ids of the available items matching `query` in title or description, best first."""
+    return _cached_search("results", query, limit, title_only=False)
+
+
+def typeahead_item_ids(query, limit=10):
+    """Ids of the available items with a title matching `query`, best first."""
+    return _cached_search("typeahead", query, limit, title_only=True)
+
+
+def index_items(pks):
+    get_backend().index(pks)
+
+
+def unindex_item(pk):
+    get_backend().unindex(pk)
+
+
+def rebuild_index():
+    get_backend().rebuild()
+
+
+class RankedItems:
+    """
+    Items in the order of a list of ids, for ListView pagination: only the
+    slice of the current page is loaded.
+    """
+
+    def __init__(self, ids, queryset=None):
+        self.ids = list(ids)
+        self.queryset = queryset if queryset is not None else Item.objects.all()
+
+    def __len__(self):
+        return len(self.ids)
+
+    def count(self):
+        return len(self.ids)
+
+    def __iter__(self):
+        return iter(self[:])
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            ids = self.ids[index]
+            items = self.queryset.in_bulk(ids)
+            return [items[pk] for pk in ids if pk in items]
+        return self[index : index + 1][0]
@@ -0,0 +1,55 @@
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from . import images, search
+from .cart import forget_cart_count
+from .models import Item, Order, OrderItem, Review
+from .pagination import invalidate_counts
+
+
+@receiver(post_delete, sender=Review)
+def remove_rating_from_summary(sender, instance, **kwargs):
+    # Sent inside the deletion's transaction, also for reviews deleted in bulk
+    # or by cascade
+    Item.adjust_rating_summary(instance.item_id, instance.rating, -1)
+
+
+@receiver(post_save, sender=Item)
+@receiver(post_delete, sender=Item)
+@receiver(post_save, sender=Order)
+@receiver(post_delete, sender=Order)
+def invalidate_paginator_counts(sender, **kwargs):
+    invalidate_counts(sender)
+
+
+@receiver(post_save, sender=OrderItem)
+@receiver(post_delete, sender=OrderItem)
+def reset_cart_count(sender, instance, **kwargs):
+    """Covers the lines changed outside of the cart views: admin, cascades..."""
+    user_id = instance.user_id
+    if user_id is None:
+        # Only for lines created without a user, the cart service sets it
+        user_id = Order.objects.filter(pk=instance.order_id).values_list("user_id", flat=True).first()
+    if user_id is not None:
+        forget_cart_count(user_id)
+
+
+@receiver(post_save, sender=Item)
+def index_item(sender, instance, **kwargs):
+    """Keeps the full-text search index in step with the saved item."""
+    search.index_items([instance.pk])
+
+
+@receiver(post_delete, sender=Item)
+def unindex_item(sender, instance, **kwargs):
+    search.unindex_item(instance.pk)
+
+
+@receiver(pre_save, sender=Item)
+def mark_uploaded_image(sender, instance, **kwargs):
+    images.mark_uploaded_image(instance)
+
+
+@receiver(post_save, sender=Item)
+def build_image_derivatives(sender, instance, **kwargs):
+    images.schedule_derivatives(instance)
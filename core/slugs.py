@@ -0,0 +1,47 @@
+"""
+Unique slugs for Item, allocated from the slugs already taken.
+
+A title gives a base slug, and the base is used as is while it is free.
+Otherwise the item gets the next suffix after the highest one in use, so
+'shirt' is followed by 'shirt-1', 'shirt-2'... Gaps left by deleted items
+are not reused. SlugAllocator is fed the taken slugs once, from a single
+query, and then hands out any number of slugs without another lookup.
+"""
+
+import re
+
+from django.utils.text import slugify
+
+# Room kept for a suffix like "-12345" under the max_length of the field
+SUFFIX_ROOM = 6
+DEFAULT_BASE = "item"
+_SUFFIXED = re.compile(r"^(?P<base>.+)-(?P<suffix>\d+)$")
+
+
+def slug_base(title, max_length):
+    base = slugify(title)[: max_length - SUFFIX_ROOM].strip("-")
+    return base or DEFAULT_BASE
+
+
+class SlugAllocator:
+    def __init__(self):
+        self.bare = set()  # Bases taken as slugs themselves
+        self.highest = {}  # base -> highest suffix taken
+
+    def add_taken(self, slugs):
+        for slug in slugs:
+            self.bare.add(slug)
+            match = _SUFFIXED.match(slug)
+            if match:
+                base, suffix = match["base"], int(match["suffix"])
+                self.highest[base] = max(self.highest.get(base, 0), suffix)
+
+    def allocate(self, base):
+        if base not in self.bare:
+            self.bare.add(base)
+            return base
+        suffix = self.highest.get(base, 0) + 1
+        self.highest[base] = suffix
+        slug = f"{base}-{suffix}"
+        self.bare.add(slug)
+        return slug
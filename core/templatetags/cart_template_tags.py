@@ -1,12 +1,9 @@
 from django import template
-from core.models import Order
+from core.cart import get_cart_count
 
 register = template.Library()
 
 @register.filter
 def cart_items_count(user):
     if user.is_authenticated:
-        qs = Order.objects.filter(user=user, is_ordered=False)
-        if qs.exists():
-            return qs[0].items.count()
-        return 0
\ No newline at end of file
+        return get_cart_count(user)
\ No newline at end of file
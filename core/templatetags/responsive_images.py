@@ -0,0 +1,24 @@
+from django import template
+
+from core import images
+
+register = template.Library()
+
+
+@register.simple_tag
+def srcset(image, width, format=None):
+    """srcset of the derivatives of an image, `format` being None or "webp"."""
+    return images.srcset(image, width, format)
+
+
+@register.inclusion_tag('responsive_image.html')
+def responsive_image(image, width, sizes='100vw', css_class='', alt=''):
+    """A <picture> offering the WebP and resized derivatives of an image, sized by `sizes`."""
+    return {
+        'image': image,
+        'srcset': images.srcset(image, width),
+        'webp_srcset': images.srcset(image, width, 'webp'),
+        'sizes': sizes,
+        'css_class': css_class,
+        'alt': alt,
+    }
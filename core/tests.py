@@ -1,3 +1,1220 @@
-from django.test import TestCase
+import hashlib
+import io
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.cache import cache, caches
+from django.core.cache.backends.filebased import FileBasedCache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import OperationalError, close_old_connections, connection
+from django.template import Context, Template
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from PIL import Image as PILImage
+import stripe
+
+from core import images, search, typeahead
+from core.cart import (
+    OrderAlreadyPlaced,
+    add_to_order,
+    get_cart_count,
+    get_cart_summary,
+    get_or_create_open_order,
+    place_order,
+)
+from core.checks import check_shared_cache
+from core.models import Coupon, Item, Order, OrderItem, Payment, Review, assign_slugs
+from core.slugs import SlugAllocator
+
+from e_commerce_website import instrumentation
+
+
+class InstrumentationTests(TestCase):
+    def setUp(self):
+        instrumentation.store.clear()
+
+    def test_records_view_name_and_queries(self):
+        self.client.get(reverse("core:index"))
+
+        records, totals = instrumentation.store.snapshot()
+        self.assertEqual(records[-1]["view"], "core:index")
+        self.assertEqual(records[-1]["status"], 200)
+        self.assertGreater(records[-1]["db_queries"], 0)
+        self.assertGreater(records[-1]["template_time"], 0)
+        self.assertEqual(totals["core:index"]["requests"], 1)
+
+    def test_outbound_time_is_attributed_to_service(self):
+        metrics = instrumentation.RequestMetrics()
+        token = instrumentation._current.set(metrics)
+        try:
+            with instrumentation.track_outbound("gemini"):
+                with instrumentation.track_outbound("gemini"):
+                    pass
+        finally:
+            instrumentation._current.reset(token)
+
+        self.assertEqual(list(metrics.outbound), ["gemini"])
+        self.assertEqual(
+            instrumentation.service_for_url("https://api.assemblyai.com/v2/upload"),
+            "assemblyai",
+        )
+        self.assertIsNone(instrumentation.service_for_url("https://example.com/"))
+
+    def test_endpoints_are_staff_only(self):
+        User.objects.create_user("user", password="password")
+        self.client.login(username="user", password="password")
+        response = self.client.get(reverse("instrumentation"))
+        self.assertEqual(response.status_code, 302)
+
+    def test_json_and_prometheus_endpoints(self):
+        User.objects.create_user("staff", password="password", is_staff=True)
+        self.client.login(username="staff", password="password")
+        self.client.get(reverse("core:index"))
+
+        data = self.client.get(reverse("instrumentation")).json()
+        self.assertEqual(data["views"]["core:index"]["requests"], 1)
+
+        text = self.client.get(reverse("instrumentation-prometheus")).content.decode()
+        self.assertIn('django_view_requests_total{view="core:index"} 1', text)
+        self.assertIn('django_view_wall_seconds{view="core:index",quantile="0.95"}', text)
+
+    def test_prometheus_summary_count_is_cumulative(self):
+        User.objects.create_user("staff", password="password", is_staff=True)
+        self.client.login(username="staff", password="password")
+        with mock.patch.object(instrumentation, "store", instrumentation.MetricsStore(2)):
+            for _ in range(3):
+                self.client.get(reverse("core:index"))
+            text = self.client.get(reverse("instrumentation-prometheus")).content.decode()
+
+        # Three requests, of which the buffer only keeps the latest two
+        self.assertIn('django_view_wall_seconds_count{view="core:index"} 3', text)
+
+    def test_recent_parameter_is_parsed_leniently(self):
+        User.objects.create_user("staff", password="password", is_staff=True)
+        self.client.login(username="staff", password="password")
+        for _ in range(3):
+            self.client.get(reverse("core:index"))
+
+        response = self.client.get(reverse("instrumentation"), {"recent": "many"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()["recent"]), 3)
+        response = self.client.get(reverse("instrumentation"), {"recent": "1"})
+        self.assertEqual(len(response.json()["recent"]), 1)
+        response = self.client.get(reverse("instrumentation"), {"recent": "-5"})
+        self.assertEqual(response.json()["recent"], [])
+
+
+class BenchmarkViewsCommandTests(TestCase):
+    def test_writes_results_and_rolls_back(self):
+        with tempfile.TemporaryDirectory() as directory:
+            output = os.path.join(directory, "results.json")
+            call_command(
+                "benchmark_views", items=20, reviews=2, users=3, orders=1,
+                iterations=2, warmup=0, output=output, stdout=io.StringIO(),
+            )
+            with open(output) as f:
+                results = json.load(f)
+
+        self.assertIn("CheckoutView.get", results["views"])
+        self.assertEqual(set(results["views"]["ItemDetailView"]), {"url", "p50_ms", "p95_ms", "mean_ms", "queries"})
+        self.assertFalse(Item.objects.exists())
+
+    def test_does_not_share_cached_results_with_the_real_catalog(self):
+        real = Item.objects.create(
+            title="Cotton Shirt", price=10, description="A shirt.", category="M", image="item_images/shirt.jpg",
+        )
+        call_command(
+            "benchmark_views", items=20, reviews=1, users=2, orders=1, iterations=1, warmup=0,
+            stdout=io.StringIO(),
+        )
+
+        # What the views cached for the seeded catalog went with the rollback
+        self.assertEqual(self.client.get(reverse("core:all-products")).context["paginator"].count, 1)
+        self.assertEqual(search.search_item_ids("cotton"), [real.pk])
+
+
+class ReviewStatsTests(TestCase):
+    def setUp(self):
+        self.item = Item.objects.create(
+            title="Linen Shirt", price=40, description="A shirt.", category="M",
+            image="item_images/shirt.jpg",
+        )
+        self.users = [User.objects.create_user(f"user{i}", password="password") for i in range(4)]
+        for user, rating in zip(self.users, [5, 5, 4, 1]):
+            Review.objects.create(item=self.item, user=user, rating=rating, comment="Nice.")
+
+    def summary(self):
+        self.item.refresh_from_db()
+        return self.item.get_review_stats()
+
+    def test_summary_is_maintained_on_create(self):
+        stats = self.summary()
+        self.assertEqual(stats["number_of_reviews"], 4)
+        self.assertEqual(stats["average_rating"], 3.75)
+        self.assertEqual([stats[f"stars_{star}"] for star in range(1, 6)], [1, 0, 0, 1, 2])
+        with self.assertNumQueries(0):
+            self.item.get_review_stats()
+
+    def test_summary_is_maintained_on_update_and_delete(self):
+        review = Review.objects.create(item=self.item, user=self.users[3], rating=3, comment="Ok.")
+        self.assertEqual(self.summary()["stars_3"], 1)
+
+        review.rating = 2
+        review.save()
+        stats = self.summary()
+        self.assertEqual((stats["stars_3"], stats["stars_2"], stats["number_of_reviews"]), (0, 1, 5))
+        self.assertEqual(self.item.rating_sum, 17)
+
+        review.delete()
+        self.assertEqual(self.summary()["number_of_reviews"], 4)
+
+        # Cascades go through post_delete as well
+        self.users[0].delete()
+        stats = self.summary()
+        self.assertEqual((stats["number_of_reviews"], stats["stars_5"]), (3, 1))
+
+    def test_out_of_range_rating_is_rejected(self):
+        with self.assertRaises(ValueError):
+            Review.objects.create(item=self.item, user=self.users[3], rating=6, comment="Wow.")
+        with self.assertRaises(ValueError):
+            Item.adjust_rating_summary(self.item.pk, "5", 1)
+
+        stats = self.summary()
+        self.assertEqual(stats["number_of_reviews"], 4)
+        self.assertEqual(Review.objects.count(), 4)
+
+    def test_rebuild(self):
+        Item.objects.filter(pk=self.item.pk).update(rating_count=0, rating_sum=0, stars_5=7)
+        out = io.StringIO()
+        call_command("rebuild_item_ratings", stdout=out)
+        self.assertIn("1 item(s) corrected", out.getvalue())
+        stats = self.summary()
+        self.assertEqual((stats["number_of_reviews"], stats["stars_5"]), (4, 2))
+        self.assertEqual(self.item.rating_sum, 15)
+
+    def test_detail_page_query_count_does_not_grow_with_reviews(self):
+        url = self.item.get_absolute_url()
+        self.client.get(url)
+        with CaptureQueriesContext(connection) as before:
+            response = self.client.get(url)
+        self.assertEqual(response.context["5_stars"], 2)
+        self.assertEqual(response.context["5_stars_percentage"], "50%")
+
+        for i in range(10):
+            user = User.objects.create_user(f"extra{i}", password="password")
+            Review.objects.create(item=self.item, user=user, rating=2, comment="Meh.")
+        self.client.get(url)
+        with CaptureQueriesContext(connection) as after:
+            response = self.client.get(url)
+        self.assertEqual(response.context["2_stars"], 10)
+        self.assertEqual(len(after), len(before))
+
+
+class CartSummaryTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user("shopper", password="password")
+        self.order = Order.objects.create(user=self.user)
+        self.items = []
+        for i, (price, discount_price) in enumerate([(100, 80), (50, None), (20, 0)]):
+            item = Item.objects.create(
+                title=f"Item {i}", price=price, discount_price=discount_price,
+                description="An item.", category="M", image="item_images/item.jpg",
+            )
+            OrderItem.objects.create(order=self.order, item=item, quantity=2)
+            self.items.append(item)
+
+    def test_totals(self):
+        self.order.coupon = Coupon.objects.create(
+            code="TEN", valid_from=timezone.now() - timedelta(days=1),
+            valid_to=timezone.now() + timedelta(days=1), discount=10, active=True,
+        )
+        self.order.save()
+
+        with self.assertNumQueries(1):
+            summary = get_cart_summary(self.user)
+        self.assertEqual((summary.item_count, summary.quantity), (3, 6))
+        self.assertEqual(summary.subtotal, Decimal("340.00"))
+        self.assertEqual(summary.saving, Decimal("40.00"))
+        self.assertEqual(summary.coupon_discount, Decimal("30.00"))
+        self.assertEqual(summary.total, Decimal("270.00"))
+        with self.assertNumQueries(0):
+            get_cart_summary(self.user)
+
+    def test_empty_cart(self):
+        other = User.objects.create_user("other", password="password")
+        summary = get_cart_summary(other)
+        self.assertEqual((summary.item_count, summary.total), (0, Decimal("0.00")))
+
+    def test_cart_and_checkout_query_counts_do_not_grow_with_lines(self):
+        self.client.login(username="shopper", password="password")
+        counts = {}
+        for lines in (3, 8):
+            for i in range(len(self.order.orderitem_set.all()), lines):
+                item = Item.objects.create(
+                    title=f"Extra {i}", price=10, description="An item.", category="W",
+                    image="item_images/item.jpg",
+                )
+                OrderItem.objects.create(order=self.order, item=item)
+            for url in (reverse("core:cart"), reverse("core:checkout")):
+                with CaptureQueriesContext(connection) as queries:
+                    response = self.client.get(url)
+                self.assertEqual(response.status_code, 200)
+                counts.setdefault(url, []).append(len(queries))
+
+        for url, (few, many) in counts.items():
+            self.assertEqual(few, many, url)
+        self.assertContains(response, "Cart [8]")
+
+
+class CartCountCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user("shopper", password="password")
+        self.item = Item.objects.create(
+            title="Wool Coat", price=120, description="A coat.", category="W",
+            image="item_images/coat.jpg",
+        )
+        self.client.login(username="shopper", password="password")
+
+    def add_to_cart(self, quantity="1"):
+        return self.client.post(
+            self.item.get_add_to_cart_url(),
+            data=json.dumps({"quantity": quantity}),
+            content_type="application/json",
+        )
+
+    def test_cached_count_needs_no_queries(self):
+        self.assertEqual(get_cart_count(self.user), 0)
+        with self.assertNumQueries(0):
+            self.assertEqual(get_cart_count(self.user), 0)
+
+    def test_cart_views_invalidate_the_count(self):
+        self.assertEqual(get_cart_count(self.user), 0)
+        self.add_to_cart()
+        self.assertEqual(get_cart_count(self.user), 1)
+
+        order_item = OrderItem.objects.get()
+        self.client.post(reverse("core:update-quantity", args=[order_item.pk]), {"quantity": 3})
+        self.assertEqual(get_cart_count(self.user), 1)
+
+        self.client.get(self.item.get_remove_from_cart_url())
+        self.assertEqual(get_cart_count(self.user), 0)
+
+        self.add_to_cart()
+        self.client.get(self.item.get_remove_completely_from_cart_url())
+        self.assertEqual(get_cart_count(self.user), 0)
+
+    def test_checkout_invalidates_the_count(self):
+        self.add_to_cart()
+        self.assertEqual(get_cart_count(self.user), 1)
+        self.client.post(reverse("core:checkout"), {
+            "billing_country": "US", "billing_address": "1 Main St", "billing_zip_code": "12345",
+            "shipping_country": "US", "shipping_address": "1 Main St", "shipping_zip_code": "12345",
+            "payment_options": "S",
+        })
+        self.assertTrue(Order.objects.get().is_ordered)
+        self.assertEqual(get_cart_count(self.user), 0)
+
+    def test_lines_changed_outside_the_cart_views_invalidate_the_count(self):
+        self.add_to_cart()
+        self.assertEqual(get_cart_count(self.user), 1)
+
+        # As the admin would, on a line without a user
+        order = Order.objects.get()
+        OrderItem.objects.create(order=order, item=Item.objects.create(
+            title="Silk Scarf", price=30, description="A scarf.", category="W",
+            image="item_images/scarf.jpg",
+        ))
+        self.assertEqual(get_cart_count(self.user), 2)
+
+        # Deleting an item cascades to the lines holding it
+        self.item.delete()
+        self.assertEqual(get_cart_count(self.user), 1)
+
+
+class AddToCartTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user("shopper", password="password")
+        self.item = Item.objects.create(
+            title="Denim Jacket", price=90, description="A jacket.", category="M",
+            image="item_images/jacket.jpg",
+        )
+        self.client.login(username="shopper", password="password")
+
+    def add_to_cart(self, quantity):
+        return self.client.post(
+            self.item.get_add_to_cart_url(),
+            data=json.dumps({"quantity": quantity}),
+            content_type="application/json",
+        )
+
+    def test_adds_then_increments_one_line(self):
+        self.add_to_cart("2")
+        self.add_to_cart("3")
+        line = OrderItem.objects.get()
+        self.assertEqual(line.quantity, 5)
+        self.assertEqual(Order.objects.filter(user=self.user, is_ordered=False).count(), 1)
+
+    def test_increment_is_a_single_update(self):
+        order = get_or_create_open_order(self.user)
+        add_to_order(order, self.item, 1)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertFalse(add_to_order(order, self.item, 1))
+        statements = [q["sql"] for q in queries if not q["sql"].startswith(("SAVEPOINT", "RELEASE"))]
+        self.assertEqual(len(statements), 1)
+        self.assertTrue(statements[0].startswith("UPDATE"))
+
+
+class ConcurrentAddToCartTests(TransactionTestCase):
+    def test_parallel_adds_lose_no_increment(self):
+        user = User.objects.create_user("shopper", password="password")
+        item = Item.objects.create(
+            title="Denim Jacket", price=90, description="A jacket.", category="M",
+            image="item_images/jacket.jpg",
+        )
+        workers, adds = 4, 5
+        barrier = threading.Barrier(workers)
+        errors = []
+
+        def worker():
+            try:
+                barrier.wait()
+                for _ in range(adds):
+                    # SQLite's in-memory test database locks whole tables and
+                    # fails instead of waiting; an add either commits as a
+                    # whole or not at all, so it is simply retried
+                    while True:
+                        try:
+                            add_to_order(get_or_create_open_order(user), item, 1)
+                            break
+                        except OperationalError as e:
+                            if "locked" not in str(e):
+                                raise
+                            time.sleep(0.001)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                close_old_connections()
+
+        threads = [threading.Thread(target=worker) for _ in range(workers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(Order.objects.filter(user=user, is_ordered=False).count(), 1)
+        self.assertEqual(OrderItem.objects.get().quantity, workers * adds)
+
+
+class UpdateCartTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user("shopper", password="password")
+        self.items = [
+            Item.objects.create(
+                title=f"Shirt {i}", price=10 * (i + 1), description="A shirt.", category="M",
+                image="item_images/shirt.jpg",
+            )
+            for i in range(3)
+        ]
+        self.client.login(username="shopper", password="password")
+
+    def update_cart(self, changes):
+        return self.client.post(
+            reverse("core:update-cart"), data=json.dumps({"changes": changes}),
+            content_type="application/json",
+        )
+
+    def test_sets_and_removes_lines(self):
+        response = self.update_cart([
+            {"slug": self.items[0].slug, "quantity": 2},
+            {"slug": self.items[1].slug, "quantity": 1},
+        ])
+        self.assertEqual(response.json()["summary"]["total"], "40.00")
+
+        response = self.update_cart([
+            {"slug": self.items[0].slug, "quantity": 0},
+            {"slug": self.items[1].slug, "quantity": 3},
+            {"slug": self.items[2].slug, "quantity": 1},
+        ])
+        summary = response.json()["summary"]
+        self.assertEqual((summary["item_count"], summary["quantity"], summary["total"]), (2, 4, "90.00"))
+        self.assertEqual(
+            dict(OrderItem.objects.values_list("item__slug", "quantity")),
+            {self.items[1].slug: 3, self.items[2].slug: 1},
+        )
+        self.assertEqual(get_cart_count(self.user), 2)
+
+    def test_query_count_does_not_grow_with_changes(self):
+        self.update_cart([{"slug": self.items[0].slug, "quantity": 1}])
+        with CaptureQueriesContext(connection) as few:
+            self.update_cart([{"slug": self.items[0].slug, "quantity": 2}])
+        with CaptureQueriesContext(connection) as many:
+            self.update_cart([{"slug": item.slug, "quantity": 2} for item in self.items])
+        self.assertEqual(len(few), len(many))
+
+        # Removals too: no query per removed line
+        with CaptureQueriesContext(connection) as few:
+            self.update_cart([{"slug": self.items[0].slug, "quantity": 0}])
+        removing_one = len(few)
+        self.update_cart([{"slug": item.slug, "quantity": 2} for item in self.items])
+        with CaptureQueriesContext(connection) as many:
+            self.update_cart([{"slug": item.slug, "quantity": 0} for item in self.items])
+        self.assertEqual(removing_one, len(many))
+        self.assertFalse(OrderItem.objects.exists())
+
+    def test_invalid_batches_change_nothing(self):
+        for changes in (
+            [{"slug": self.items[0].slug, "quantity": 1}, {"slug": "missing", "quantity": 1}],
+            [{"slug": self.items[0].slug, "quantity": -1}],
+            [{"slug": self.items[0].slug}],
+            [],
+        ):
+            response = self.update_cart(changes)
+            self.assertEqual(response.status_code, 400, changes)
+        self.assertFalse(OrderItem.objects.exists())
+
+
+class CatalogFilterTests(TestCase):
+    def setUp(self):
+        for i, (category, label, price, available) in enumerate([
+            ("M", "P", 20, True), ("M", "D", 40, True), ("M", None, 60, False),
+            ("W", "P", 30, True), ("W", "S", 80, True), ("W", "D", 10, False),
+        ]):
+            Item.objects.create(
+                title=f"Item {i}", price=price, description="An item.", category=category,
+                label=label, available=available, image="item_images/item.jpg",
+            )
+
+    def titles(self, queryset):
+        return [item.title for item in queryset]
+
+    def test_filter_facets(self):
+        self.assertEqual(
+            self.titles(Item.objects.listed().filter_facets(category="W", min_price=20, in_stock=True)),
+            ["Item 4", "Item 3"],
+        )
+        self.assertEqual(
+            self.titles(Item.objects.listed().filter_facets(label="D", max_price=40)),
+            ["Item 5", "Item 1"],
+        )
+        self.assertEqual(
+            Item.objects.filter_facets(in_stock=True).facet_counts(),
+            {"category": {"M": 2, "W": 2}, "label": {"P": 2, "D": 1, "S": 1}},
+        )
+
+    def test_featured_order(self):
+        self.assertEqual(self.titles(Item.objects.featured()), ["Item 3", "Item 0", "Item 5", "Item 1"])
+
+    def test_listing_views_apply_query_string_facets(self):
+        response = self.client.get(reverse("core:women"), {"min_price": "50"})
+        self.assertEqual(self.titles(response.context["items"]), ["Item 4"])
+
+        response = self.client.get(reverse("core:all-products"), {"label": "P", "max_price": "bad"})
+        self.assertEqual(self.titles(response.context["items"]), ["Item 3", "Item 0"])
+        self.assertEqual(response.context["filter_query"], "label=P&max_price=bad")
+
+    def test_catalog_api(self):
+        data = self.client.get(reverse("core:catalog-items"), {"category": "M", "in_stock": "on"}).json()
+        self.assertEqual([item["title"] for item in data["results"]], ["Item 1", "Item 0"])
+        self.assertEqual(data["results"][0]["url"], Item.objects.get(title="Item 1").get_absolute_url())
+        self.assertEqual(data["facets"]["label"], {"P": 1, "D": 1})
+
+
+@skipUnless(connection.vendor == "sqlite", "EXPLAIN output is SQLite specific")
+class CatalogIndexTests(TestCase):
+    def assertUsesIndex(self, queryset, index, sorted_by_index=True):
+        plan = queryset.explain()
+        self.assertIn(f"USING INDEX {index}", plan)
+        if sorted_by_index:
+            self.assertNotIn("TEMP B-TREE", plan)
+
+    def test_category_listing(self):
+        self.assertUsesIndex(
+            Item.objects.filter(category="M", available=True).listed()[:12], "item_category_idx"
+        )
+
+    def test_price_facet(self):
+        self.assertUsesIndex(
+            Item.objects.filter(category="W", available=True).filter_facets(min_price=10, max_price=50).listed()[:12],
+            "item_category_price_idx (category=? AND price>? AND price<?)",
+            sorted_by_index=False,
+        )
+
+    def test_label_listing(self):
+        self.assertUsesIndex(Item.objects.listed().filter_facets(label="S")[:8], "item_label_idx")
+        # The two labels are read from the index, only merging them needs sorting
+        self.assertUsesIndex(Item.objects.featured()[:8], "item_label_idx", sorted_by_index=False)
+
+
+class CachingPaginatorTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        for i in range(20):
+            Item.objects.create(
+                title=f"Shirt {i}", price=10, description="A shirt.", category="M",
+                image="item_images/shirt.jpg",
+            )
+
+    def count_queries(self, url, params=None):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, params)
+        return response, [q["sql"] for q in queries if "COUNT(*)" in q["sql"]]
+
+    def test_count_is_cached_per_filter_signature(self):
+        url = reverse("core:men")
+        response, counts = self.count_queries(url)
+        self.assertEqual(len(counts), 1)
+        response, counts = self.count_queries(url, {"page": 2})
+        self.assertEqual((len(counts), response.context["paginator"].count), (0, 20))
+
+        response, counts = self.count_queries(url, {"max_price": "5"})
+        self.assertEqual((len(counts), response.context["paginator"].count), (1, 0))
+
+    def test_item_save_invalidates_counts(self):
+        url = reverse("core:all-products")
+        self.count_queries(url)
+        Item.objects.create(
+            title="Coat", price=10, description="A coat.", category="W", image="item_images/coat.jpg",
+        )
+        response, counts = self.count_queries(url)
+        self.assertEqual((len(counts), response.context["paginator"].count), (1, 21))
+
+    def test_empty_search(self):
+        response, counts = self.count_queries(reverse("core:search-results"))
+        self.assertEqual((counts, response.context["paginator"].count), ([], 0))
+
+    def test_tests_run_on_a_shared_cache_of_their_own(self):
+        # The same kind of backend as the site, away from its entries
+        self.assertIsInstance(caches["default"], FileBasedCache)
+        self.assertNotEqual(caches["default"]._dir, os.path.join(tempfile.gettempdir(), "e_commerce_website_cache"))
+
+    def test_process_local_cache_is_reported(self):
+        self.assertEqual(check_shared_cache(None), [])
+        locmem = {"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+        with override_settings(CACHES=locmem):
+            self.assertEqual([message.id for message in check_shared_cache(None)], ["core.W001"])
+
+
+class ProductSearchTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.linen = self.create("Linen Shirt", "Light summer shirt.")
+        self.dress = self.create("Summer Dress", "Flowing dress in linen.")
+        self.coat = self.create("Wool Coat", "Warm winter coat.")
+        self.hidden = self.create("Linen Trousers", "Out of stock.", available=False)
+
+    def create(self, title, description, available=True):
+        return Item.objects.create(
+            title=title, price=30, description=description, category="W",
+            available=available, image="item_images/item.jpg",
+        )
+
+    def test_ranks_title_matches_first_and_skips_unavailable(self):
+        self.assertEqual(search.search_item_ids("linen"), [self.linen.pk, self.dress.pk])
+        self.assertEqual(search.search_item_ids("summ lin"), [self.linen.pk, self.dress.pk])
+        self.assertEqual(search.search_item_ids("  "), [])
+
+    def test_typeahead_matches_title_prefixes(self):
+        self.assertEqual(search.typeahead_item_ids("lin"), [self.linen.pk])
+        response = self.client.get(reverse("core:search_items"), {"q": "wo co"})
+        self.assertEqual(
+            response.json()["results"], [{"name": "Wool Coat", "url": self.coat.get_absolute_url()}]
+        )
+
+    def test_index_follows_item_changes(self):
+        self.assertEqual(search.search_item_ids("winter"), [self.coat.pk])
+        self.coat.title = "Alpaca Coat"
+        self.coat.save()
+        self.assertEqual(search.typeahead_item_ids("alpa"), [self.coat.pk])
+        self.coat.delete()
+        self.assertEqual(search.search_item_ids("winter"), [])
+
+    def test_results_are_cached(self):
+        search.search_item_ids("linen")
+        with self.assertNumQueries(0):
+            search.search_item_ids("Linen!")
+
+    def test_results_page(self):
+        response = self.client.get(reverse("core:search-results"), {"q": "linen"})
+        self.assertEqual(list(response.context["items"]), [self.linen, self.dress])
+        self.assertEqual(response.context["paginator"].count, 2)
+
+        self.dress.label = "S"
+        self.dress.save()
+        response = self.client.get(reverse("core:search-results"), {"q": "linen", "label": "S"})
+        self.assertEqual(list(response.context["items"]), [self.dress])
+
+
+class TypeaheadTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.items = [
+            Item.objects.create(
+                title=title, price=30, description="Soft.", category="M",
+                available=available, image="item_images/item.jpg",
+            )
+            for title, available in [
+                ("Slim Cotton Shirt", True),
+                ("Cotton Hoodie", True),
+                ("Corduroy Jacket", True),
+                ("Cotton Socks", False),
+            ]
+        ]
+        self.url = reverse("core:search_items")
+
+    def names(self, response):
+        return [result["name"] for result in response.json()["results"]]
+
+    def test_prefix_lookup_is_served_from_memory(self):
+        typeahead.get_index()
+        with self.assertNumQueries(0):
+            suggestions = typeahead.suggest("co")
+        self.assertEqual(
+            [suggestion["name"] for suggestion in suggestions],
+            ["Corduroy Jacket", "Cotton Hoodie", "Slim Cotton Shirt"],
+        )
+        self.assertEqual(suggestions[0]["url"], self.items[2].get_absolute_url())
+
+    def test_limit(self):
+        response = self.client.get(self.url, {"q": "c", "limit": 2})
+        self.assertEqual(self.names(response), ["Corduroy Jacket", "Cotton Hoodie"])
+        response = self.client.get(self.url, {"q": "c", "limit": 1000})
+        self.assertEqual(len(self.names(response)), 3)
+        response = self.client.get(self.url, {"q": "c", "limit": "all"})
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(response.has_header("Cache-Control"))
+
+    def test_index_is_rebuilt_on_catalog_change(self):
+        self.assertEqual(typeahead.suggest("hood")[0]["name"], "Cotton Hoodie")
+        self.items[1].title = "Fleece Top"
+        self.items[1].save()
+        self.assertEqual(typeahead.suggest("hood"), [])
+        self.assertEqual(typeahead.suggest("fle")[0]["name"], "Fleece Top")
+
+    def test_conditional_requests(self):
+        with self.settings(CORE_TYPEAHEAD_MAX_AGE=30):
+            response = self.client.get(self.url, {"q": "cot"})
+        self.assertEqual(response["Cache-Control"], "public, max-age=30")
+        etag = response["ETag"]
+
+        response = self.client.get(self.url, {"q": "cot"}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertIn("public", response["Cache-Control"])
+        response = self.client.get(self.url, {"q": "cot", "limit": 1}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+        Item.objects.filter(pk=self.items[0].pk).get().save()
+        response = self.client.get(self.url, {"q": "cot"}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+
+class TypeaheadRebuildTests(TransactionTestCase):
+    def test_catalog_changes_rebuild_in_the_background(self):
+        Item.objects.create(
+            title="Cotton Hoodie", price=10, description="A hoodie.", category="M", image="item_images/hoodie.jpg",
+        )
+        typeahead.rebuild()
+        started, release = threading.Event(), threading.Event()
+        build = typeahead.TypeaheadIndex.build
+
+        def slow_build(version):
+            started.set()
+            release.wait(5)
+            return build(version)
+
+        Item.objects.create(
+            title="Fleece Top", price=10, description="A top.", category="M", image="item_images/top.jpg",
+        )
+        with mock.patch.object(typeahead.TypeaheadIndex, "build", side_effect=slow_build):
+            # Served from the previous trie while the new one is built
+            self.assertEqual(typeahead.suggest("fle"), [])
+            self.assertTrue(started.wait(5))
+            self.assertEqual(typeahead.suggest("hood")[0]["name"], "Cotton Hoodie")
+            release.set()
+            for thread in threading.enumerate():
+                if thread.name == "typeahead-rebuild":
+                    thread.join(5)
+
+        self.assertEqual(typeahead.suggest("fle")[0]["name"], "Fleece Top")
+
+
+class OrderHistoryTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user("buyer", password="secret")
+        self.client.force_login(self.user)
+        self.shirt = Item.objects.create(
+            title="Shirt", price=Decimal("25.00"), description="A shirt.", category="M",
+            image="item_images/shirt.jpg",
+        )
+        self.socks = Item.objects.create(
+            title="Socks", price=Decimal("10.55"), discount_price=Decimal("9.99"), description="Socks.",
+            category="M", image="item_images/socks.jpg",
+        )
+        self.coupon = Coupon.objects.create(
+            code="FIVE", discount=5, active=True,
+            valid_from=timezone.now(), valid_to=timezone.now() + timedelta(days=1),
+        )
+
+    def place_orders(self, count):
+        for n in range(count):
+            order = Order.objects.create(user=self.user, is_ordered=True, ref_code=f"REF{n}")
+            OrderItem.objects.create(order=order, item=self.shirt, quantity=1)
+            OrderItem.objects.create(order=order, item=self.socks, quantity=3)
+
+    def test_totals_are_computed_in_sql(self):
+        self.place_orders(1)
+        Order.objects.update(coupon=self.coupon)
+        order = Order.objects.history(self.user).get()
+        self.assertEqual((order.line_count, order.unit_count), (2, 4))
+        self.assertEqual(order.subtotal_amount, Decimal("56.65"))
+        self.assertEqual(order.saving_amount, Decimal("1.68"))
+        # (56.65 - 1.68) * 95%
+        self.assertEqual(order.total_amount, Decimal("52.22"))
+        self.assertEqual([line.item.title for line in order.lines], ["Shirt", "Socks"])
+
+    def test_query_count_does_not_grow_with_orders(self):
+        url = reverse("core:order-list")
+        self.place_orders(2)
+        self.client.get(url)
+        with CaptureQueriesContext(connection) as few:
+            self.client.get(url)
+
+        self.place_orders(30)
+        self.client.get(url)
+        with CaptureQueriesContext(connection) as many:
+            response = self.client.get(url)
+        self.assertEqual(len(many), len(few))
+        self.assertEqual(len(response.context["user_orders"]), 10)
+        self.assertEqual(response.context["paginator"].num_pages, 4)
+        self.assertContains(response, "$54.97")
+
+    def test_requires_login(self):
+        self.client.logout()
+        response = self.client.get(reverse("core:order-list"))
+        self.assertEqual(response.status_code, 302)
+
+
+class PlaceOrderTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user("buyer", password="secret")
+        self.shirt = Item.objects.create(
+            title="Shirt", price=Decimal("25.00"), description="A shirt.", category="M",
+            image="item_images/shirt.jpg",
+        )
+        self.socks = Item.objects.create(
+            title="Socks", price=Decimal("10.55"), discount_price=Decimal("9.99"), description="Socks.",
+            category="M", image="item_images/socks.jpg",
+        )
+        coupon = Coupon.objects.create(
+            code="FIVE", discount=5, active=True,
+            valid_from=timezone.now(), valid_to=timezone.now() + timedelta(days=1),
+        )
+        self.order = Order.objects.create(user=self.user, coupon=coupon)
+        add_to_order(self.order, self.shirt, 1)
+        add_to_order(self.order, self.socks, 3)
+
+    def test_snapshot_matches_the_cart_summary(self):
+        expected = get_cart_summary(self.user)
+        summary = place_order(self.order, ref_code="REF1")
+        self.assertEqual(summary.total, expected.total)
+
+        order = Order.objects.get(pk=self.order.pk)
+        self.assertTrue(order.is_ordered)
+        self.assertEqual(
+            (order.subtotal, order.saving, order.coupon_discount_percentage, order.coupon_discount, order.total),
+            (Decimal("56.65"), Decimal("1.68"), 5, Decimal("2.75"), Decimal("52.22")),
+        )
+        self.assertEqual(
+            sorted(OrderItem.objects.values_list("unit_price", "discount_unit_price", "is_ordered")),
+            [(Decimal("10.55"), Decimal("9.99"), True), (Decimal("25.00"), None, True)],
+        )
+
+    def test_later_price_changes_do_not_change_placed_orders(self):
+        place_order(self.order, ref_code="REF1")
+        Item.objects.update(price=Decimal("99.00"), discount_price=None)
+        Coupon.objects.update(discount=50)
+
+        order = Order.objects.history(self.user).get()
+        self.assertEqual((order.subtotal_amount, order.total_amount), (Decimal("56.65"), Decimal("52.22")))
+        line = OrderItem.objects.select_related("item").get(item=self.socks)
+        self.assertEqual(line.get_final_price(), Decimal("29.97"))
+
+    def test_an_order_is_placed_once(self):
+        place_order(self.order, ref_code="REF1")
+        with self.assertRaises(OrderAlreadyPlaced):
+            place_order(self.order, ref_code="REF2")
+        self.assertEqual(Order.objects.get(pk=self.order.pk).ref_code, "REF1")
+
+    def pay(self):
+        self.client.force_login(self.user)
+        return self.client.post(reverse("core:payment", args=["stripe"]), {"stripeToken": "tok"})
+
+    def test_payment_places_the_order_before_charging_it(self):
+        def charge(**kwargs):
+            # Placed and committed by the time Stripe is called
+            self.assertTrue(Order.objects.get(pk=self.order.pk).is_ordered)
+            return {"id": "ch_1"}
+
+        with mock.patch("core.views.stripe.Charge.create", side_effect=charge) as create:
+            self.pay()
+
+        kwargs = create.call_args.kwargs
+        self.assertEqual(kwargs["amount"], 5222)
+        self.order.refresh_from_db()
+        self.assertEqual(kwargs["idempotency_key"], f"order-{self.order.pk}-{self.order.ref_code}")
+        self.assertEqual(Payment.objects.get().stripe_charge_id, "ch_1")
+
+    def test_failed_charge_reopens_the_order(self):
+        error = stripe.error.CardError("Declined", param=None, code="card_declined")
+        with mock.patch("core.views.stripe.Charge.create", side_effect=error):
+            self.pay()
+
+        order = Order.objects.get(pk=self.order.pk)
+        self.assertEqual((order.is_ordered, order.total, order.ref_code), (False, None, None))
+        self.assertEqual(
+            set(OrderItem.objects.values_list("unit_price", "is_ordered")), {(None, False)}
+        )
+        self.assertFalse(Payment.objects.exists())
+        self.assertEqual(get_cart_count(self.user), 2)
+
+    def test_retry_after_a_decline_uses_a_new_idempotency_key(self):
+        error = stripe.error.CardError("Declined", param=None, code="card_declined")
+        with mock.patch("core.views.stripe.Charge.create", side_effect=[error, {"id": "ch_2"}]) as create:
+            self.pay()
+            self.pay()
+
+        first, second = (call.kwargs["idempotency_key"] for call in create.call_args_list)
+        self.assertNotEqual(first, second)
+        self.assertTrue(Order.objects.get(pk=self.order.pk).is_ordered)
+        self.assertEqual(Payment.objects.get().stripe_charge_id, "ch_2")
+
+    def test_failed_charge_merges_a_cart_started_meanwhile(self):
+        def decline(**kwargs):
+            # The user adds items in another tab during the payment
+            cart = get_or_create_open_order(self.user)
+            add_to_order(cart, self.shirt, 2)
+            add_to_order(cart, hat, 1)
+            raise stripe.error.CardError("Declined", param=None, code="card_declined")
+
+        hat = Item.objects.create(
+            title="Hat", price=Decimal("15.00"), description="A hat.", category="M", image="item_images/hat.jpg",
+        )
+        with mock.patch("core.views.stripe.Charge.create", side_effect=decline):
+            response = self.pay()
+
+        self.assertEqual(response.status_code, 302)
+        order = Order.objects.get(is_ordered=False)
+        self.assertEqual(order.pk, self.order.pk)
+        self.assertEqual(
+            dict(order.orderitem_set.values_list("item__title", "quantity")),
+            {"Shirt": 3, "Socks": 3, "Hat": 1},
+        )
+        self.assertEqual(get_cart_count(self.user), 3)
+
+    def test_order_placed_concurrently_is_not_an_error(self):
+        with mock.patch("core.views.place_order", side_effect=OrderAlreadyPlaced), mock.patch(
+            "core.views.stripe.Charge.create"
+        ) as create:
+            response = self.pay()
+
+        self.assertRedirects(response, reverse("core:order-list"))
+        create.assert_not_called()
+
+
+class ItemSlugTests(TestCase):
+    def create(self, title, **fields):
+        return Item.objects.create(
+            title=title, price=10, description="An item.", category="M", image="item_images/item.jpg", **fields
+        )
+
+    def test_same_titles_get_increasing_suffixes(self):
+        slugs = [self.create("Linen Shirt").slug for _ in range(3)]
+        self.assertEqual(slugs, ["linen-shirt", "linen-shirt-1", "linen-shirt-2"])
+        self.assertEqual(self.create("Linen Shirt 1").slug, "linen-shirt-1-1")
+        self.assertEqual(self.create("!!!").slug, "item")
+
+    def test_one_lookup_per_new_slug(self):
+        for _ in range(5):
+            self.create("Linen Shirt")
+        with CaptureQueriesContext(connection) as queries:
+            self.create("Linen Shirt")
+        lookups = [q["sql"] for q in queries if '"slug" LIKE' in q["sql"]]
+        self.assertEqual(len(lookups), 1)
+
+    def test_slug_is_kept_on_edits(self):
+        item = self.create("Linen Shirt")
+        self.create("Wool Coat")
+        item.price = 12
+        item.save()
+        item = Item.objects.get(pk=item.pk)
+        item.title = "Linen  shirt!"
+        item.save()
+        self.assertEqual(item.slug, "linen-shirt")
+
+        item.title = "Wool Coat"
+        item.save(update_fields=["title"])
+        self.assertEqual(Item.objects.get(pk=item.pk).slug, "wool-coat-1")
+
+    def test_retries_when_the_slug_was_taken_concurrently(self):
+        self.create("Linen Shirt")
+        add_taken = SlugAllocator.add_taken
+        calls = []
+
+        def miss_first_lookup(allocator, slugs):
+            calls.append(slugs)
+            if len(calls) > 1:
+                add_taken(allocator, slugs)
+
+        with mock.patch.object(SlugAllocator, "add_taken", miss_first_lookup):
+            item = self.create("Linen Shirt")
+        self.assertEqual((item.slug, len(calls)), ("linen-shirt-1", 2))
+
+    def test_assign_slugs_in_bulk(self):
+        self.create("Linen Shirt")
+        items = [
+            Item(title="Linen Shirt", price=10, description="An item.", category="M") for _ in range(3)
+        ] + [Item(title="Coat", slug="coat", price=10, description="An item.", category="M")]
+        with self.assertNumQueries(1):
+            assign_slugs(items)
+        self.assertEqual(
+            [item.slug for item in items], ["linen-shirt-1", "linen-shirt-2", "linen-shirt-3", "coat"]
+        )
+
+
+class CatalogImportExportTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        media = override_settings(MEDIA_ROOT=os.path.join(self.directory.name, "media"))
+        media.enable()
+        self.addCleanup(media.disable)
+
+    def write(self, name, content):
+        path = os.path.join(self.directory.name, name)
+        with open(path, "w", newline="") as f:
+            f.write(content)
+        return path
+
+    def run_import(self, path, *args):
+        out, err = io.StringIO(), io.StringIO()
+        call_command("import_items", path, *args, stdout=out, stderr=err)
+        return out.getvalue(), err.getvalue()
+
+    def test_csv_import_validates_rows_and_resolves_images(self):
+        images = os.path.join(self.directory.name, "images")
+        os.mkdir(images)
+        with open(os.path.join(images, "shirt.jpg"), "wb") as f:
+            f.write(b"jpeg")
+        Item.objects.create(
+            title="Old Shirt", slug="shirt", price=5, description="Old.", category="M",
+            image="item_images/old.jpg",
+        )
+        path = self.write("items.csv", (
+            "slug,title,price,discount_price,description,available,category,label,image\n"
+            "shirt,Linen Shirt,30.00,25.00,Light.,True,M,P,shirt.jpg\n"
+            ",Linen Shirt,30.00,,Light.,,M,,\n"
+            ",Linen Shirt,30.00,,Light.,False,W,,\n"
+            ",Coat,abc,,Warm.,,X,,\n"
+            ",Dress,30.00,40.00,Long.,,W,,\n"
+            ",Scarf,10.00,,Soft.,,W,,missing.jpg\n"
+        ))
+        out, err = self.run_import(path, "--images-dir", images, "--batch-size", "2")
+
+        self.assertIn("Imported 2 new and 1 updated item(s), 3 invalid row(s) skipped", out)
+        self.assertIn("Line 5: price: Enter a number.; category: Select a valid choice.", err)
+        self.assertIn("Line 6: discount_price: The discount price must be lower than the price.", err)
+        self.assertIn("Line 7: Image not found: missing.jpg", err)
+        self.assertEqual(
+            list(Item.objects.order_by("pk").values_list("slug", "title", "available", "label")),
+            [("shirt", "Linen Shirt", True, "P"), ("linen-shirt", "Linen Shirt", True, None),
+             ("linen-shirt-1", "Linen Shirt", False, None)],
+        )
+        shirt = Item.objects.get(slug="shirt")
+        image_name = f"item_images/shirt.{hashlib.sha256(b'jpeg').hexdigest()[:16]}.jpg"
+        self.assertEqual((shirt.discount_price, shirt.image.name), (Decimal("25.00"), image_name))
+        self.assertTrue(shirt.image.storage.exists(image_name))
+        # The bulk writes are visible to search and the cached counts
+        self.assertEqual(search.search_item_ids("linen"), [item.pk for item in Item.objects.filter(available=True).listed()])
+
+    def test_images_are_named_after_their_content(self):
+        for directory, content in [("a", b"first"), ("b", b"second"), ("c", b"first")]:
+            os.makedirs(os.path.join(self.directory.name, "images", directory))
+            with open(os.path.join(self.directory.name, "images", directory, "shirt.jpg"), "wb") as f:
+                f.write(content)
+        default_storage.save("item_images/shirt.jpg", ContentFile(b"an earlier upload"))
+        path = self.write("items.csv", (
+            "slug,title,price,discount_price,description,available,category,label,image\n"
+            "a,Shirt A,30.00,,Light.,True,M,,a/shirt.jpg\n"
+            "b,Shirt B,30.00,,Light.,True,M,,b/shirt.jpg\n"
+            "c,Shirt C,30.00,,Light.,True,M,,c/shirt.jpg\n"
+        ))
+        self.run_import(path, "--images-dir", os.path.join(self.directory.name, "images"))
+
+        names = dict(Item.objects.values_list("slug", "image"))
+        self.assertNotEqual(names["a"], names["b"])
+        self.assertEqual(names["a"], names["c"])
+        self.assertNotIn("item_images/shirt.jpg", names.values())
+        with default_storage.open(names["b"]) as f:
+            self.assertEqual(f.read(), b"second")
+
+    def test_image_width_is_reset_when_the_image_changes(self):
+        for slug, image in [("kept", "item_images/kept.jpg"), ("changed", "item_images/old.jpg")]:
+            item = Item.objects.create(
+                title="Shirt", slug=slug, price=5, description="Old.", category="M", image=image,
+            )
+            Item.objects.filter(pk=item.pk).update(image_width=700)
+        path = self.write("items.csv", (
+            "slug,title,price,discount_price,description,available,category,label,image\n"
+            "kept,Linen Shirt,30.00,,Light.,True,M,,item_images/kept.jpg\n"
+            "changed,Linen Shirt,30.00,,Light.,True,M,,item_images/new.jpg\n"
+        ))
+        self.run_import(path)
+
+        self.assertEqual(
+            dict(Item.objects.values_list("slug", "image_width")), {"kept": 700, "changed": None}
+        )
+
+    def test_dry_run_writes_nothing(self):
+        path = self.write("items.jsonl", '{"title": "Coat", "price": 50, "description": "Warm.", "category": "W"}\n')
+        out, err = self.run_import(path, "--dry-run")
+        self.assertIn("Would import 1 new and 0 updated item(s)", out)
+        self.assertFalse(Item.objects.exists())
+
+    def test_jsonl_round_trip(self):
+        for n in range(5):
+            Item.objects.create(
+                title=f"Shirt {n}", price=Decimal("19.99"), discount_price=Decimal("9.99") if n % 2 else None,
+                description="A shirt.\nWith two lines.", category="M", label="S" if n % 2 else None,
+                image="item_images/shirt.jpg",
+            )
+        fields = ["slug", "title", "price", "discount_price", "description", "available", "category", "label", "image"]
+        before = list(Item.objects.order_by("pk").values_list(*fields))
+
+        for format in ("jsonl", "csv"):
+            path = os.path.join(self.directory.name, f"items.{format}")
+            call_command("export_items", path, "--chunk-size", "2", stdout=io.StringIO())
+            Item.objects.all().delete()
+            self.run_import(path)
+            self.assertEqual(list(Item.objects.order_by("pk").values_list(*fields)), before)
+
+
+class ImageDerivativeTests(TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        media = override_settings(MEDIA_ROOT=self.directory.name, MEDIA_URL="/media/")
+        media.enable()
+        self.addCleanup(media.disable)
+
+    def jpeg(self, width, height):
+        buffer = io.BytesIO()
+        PILImage.new("RGB", (width, height), "navy").save(buffer, format="JPEG")
+        return buffer.getvalue()
+
+    def stored(self, name):
+        return os.path.exists(os.path.join(self.directory.name, name))
+
+    def test_builds_width_buckets_and_webp_next_to_the_original(self):
+        default_storage.save("item_images/shirt.jpg", ContentFile(self.jpeg(1000, 500)))
+        self.assertEqual(images.build_derivatives("item_images/shirt.jpg"), 1000)
+
+        for width in (320, 640, 960):
+            self.assertTrue(self.stored(f"item_images/shirt.w{width}.jpg"))
+            self.assertTrue(self.stored(f"item_images/shirt.w{width}.webp"))
+        self.assertTrue(self.stored("item_images/shirt.w1000.webp"))
+        self.assertFalse(self.stored("item_images/shirt.w1280.jpg"))
+        with PILImage.open(os.path.join(self.directory.name, "item_images/shirt.w320.webp")) as image:
+            self.assertEqual((image.format, image.size), ("WEBP", (320, 160)))
+
+        with self.assertLogs("core.images", "WARNING"):
+            self.assertIsNone(images.build_derivatives("item_images/missing.jpg"))
+
+    def test_uploads_are_processed_after_commit(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            item = Item.objects.create(
+                title="Shirt", price=10, description="A shirt.", category="M",
+                image=SimpleUploadedFile("shirt.jpg", self.jpeg(400, 400), content_type="image/jpeg"),
+            )
+        item.refresh_from_db()
+        self.assertEqual(item.image_width, 400)
+        self.assertTrue(self.stored(images.derivative_name(item.image.name, 320, "webp")))
+
+        # Edits without a new upload keep the derivatives
+        item.price = 12
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            item.save()
+        self.assertEqual((len(callbacks), item.image_width), (0, 400))
+
+    def test_failures_after_commit_are_logged(self):
+        default_storage.save("item_images/shirt.jpg", ContentFile(self.jpeg(400, 400)))
+        item = Item.objects.create(
+            title="Shirt", price=10, description="A shirt.", category="M", image="item_images/shirt.jpg",
+        )
+
+        with mock.patch.object(images, "_save", side_effect=OSError("Disk full")):
+            with self.assertLogs("core.images", "ERROR"):
+                self.assertIsNone(images.build_and_record(Item, item.pk, item.image.name))
+        with mock.patch.object(images.Image, "open", side_effect=images.Image.DecompressionBombError):
+            with self.assertLogs("core.images", "WARNING"):
+                self.assertIsNone(images.build_and_record(Item, item.pk, item.image.name))
+        item.refresh_from_db()
+        self.assertIsNone(item.image_width)
+
+    def test_srcset_template_tags(self):
+        item = Item(title="Shirt", image="item_images/shirt.jpg", image_width=700)
+        html = Template(
+            '{% load responsive_images %}<i>{% srcset item.image item.image_width %}</i>'
+            '{% responsive_image item.image item.image_width sizes="25vw" css_class="img-fluid" alt=item.title %}'
+        ).render(Context({"item": item}))
+        self.assertIn(
+            "<i>/media/item_images/shirt.w320.jpg 320w, /media/item_images/shirt.w640.jpg 640w, "
+            "/media/item_images/shirt.jpg 700w</i>",
+            html,
+        )
+        self.assertIn('<source type="image/webp" srcset="/media/item_images/shirt.w320.webp 320w, ', html)
+        self.assertIn('/media/item_images/shirt.w700.webp 700w" sizes="25vw">', html)
+
+        # Not processed yet: the original alone
+        item.image_width = None
+        html = Template("{% load responsive_images %}{% responsive_image item.image item.image_width %}").render(
+            Context({"item": item})
+        )
+        self.assertEqual(html.strip(), '<picture><img src="/media/item_images/shirt.jpg" class="" alt=""></picture>')
+
+    def test_backfill_command(self):
+        default_storage.save("item_images/coat.jpg", ContentFile(self.jpeg(800, 600)))
+        coat = Item.objects.create(
+            title="Coat", price=10, description="A coat.", category="W", image="item_images/coat.jpg",
+        )
+        broken = Item.objects.create(
+            title="Hat", price=10, description="A hat.", category="W", image="item_images/missing.jpg",
+        )
+        # Logged by the worker process
+        logging.disable(logging.WARNING)
+        self.addCleanup(logging.disable, logging.NOTSET)
+        out = io.StringIO()
+        call_command("build_image_derivatives", "--model", "core.Item", "--workers", "1", stdout=out)
+        self.assertIn("core.Item: built the derivatives of 1 image(s), 1 could not be read", out.getvalue())
+        coat.refresh_from_db()
+        broken.refresh_from_db()
+        self.assertEqual((coat.image_width, broken.image_width), (800, None))
+        self.assertTrue(self.stored("item_images/coat.w640.jpg"))
@@ -0,0 +1,178 @@
+"""
+Typeahead suggestions served from memory.
+
+TypeaheadIndex is a trie over the words of the titles of the available items.
+Every node keeps the best MAX_LIMIT suggestions for its prefix, ranked by the
+position of the matching word in the title and then newest first, as ready
+made (title, url) pairs, so a one-word query is a walk down the trie without
+touching the database. Queries of several words go to the full-text index in
+core.search and are mapped back to the suggestions of the trie.
+
+The trie is built per process and rebuilt after the Item version of
+core.pagination has changed, that is after any item was saved or deleted.
+Building it takes seconds for a large catalog, so the first lookup that sees
+a new version starts the rebuild on a background thread, and lookups keep
+being served from the previous trie until the new one replaces it. Only the
+very first trie of a process, and a rebuild asked for inside a transaction
+(whose rows another thread could not see), are built on the calling thread.
+The same version feeds the ETag of the responses. The version lives
+in the cache, which must be shared by the workers (see CACHES in the
+settings): every worker then rebuilds after a change made by any of them, and
+they all hand out the same ETags.
+"""
+
+import hashlib
+import logging
+import threading
+
+from django.conf import settings
+from django.db import connection, connections
+from django.urls import reverse
+
+from . import search
+from .models import Item
+from .pagination import count_version
+
+DEFAULT_LIMIT = 10
+MAX_LIMIT = 20
+# Longer prefixes are rare in a typeahead and only cost memory
+MAX_PREFIX_LENGTH = 20
+
+logger = logging.getLogger(__name__)
+
+
+def parse_limit(value):
+    """The `limit` query parameter, clamped to 1..MAX_LIMIT."""
+    if value is None or value == "":
+        return DEFAULT_LIMIT
+    limit = int(value)
+    return max(1, min(limit, MAX_LIMIT))
+
+
+def max_age():
+    """Seconds browsers and shared caches may reuse a typeahead response."""
+    return getattr(settings, "CORE_TYPEAHEAD_MAX_AGE", 60)
+
+
+class TrieNode:
+    __slots__ = ("children", "ranked")
+
+    def __init__(self):
+        self.children = {}
+        self.ranked = []  # (word position, -pk, pk), best first
+
+    def trim(self):
+        self.ranked.sort()
+        del self.ranked[MAX_LIMIT:]
+
+
+class TypeaheadIndex:
+    def __init__(self, version, rows):
+        self.version = version
+        self.root = TrieNode()
+        self.suggestions = {}  # pk -> {"name": ..., "url": ...}
+
+        # Built once instead of a reverse() per item
+        url_prefix = reverse("core:product-detail", kwargs={"slug": "-"})[:-1]
+        nodes = []
+        for pk, title, slug in rows:
+            self.suggestions[pk] = {"name": title, "url": url_prefix + slug}
+            positions = {}
+            for position, word in enumerate(search.query_terms(title)):
+                for end in range(1, min(len(word), MAX_PREFIX_LENGTH) + 1):
+                    positions.setdefault(word[:end], position)
+            for prefix, position in positions.items():
+                node = self.node(prefix, create=True)
+                if not node.ranked:
+                    nodes.append(node)
+                node.ranked.append((position, -pk, pk))
+                if len(node.ranked) > 4 * MAX_LIMIT:
+                    node.trim()
+        for node in nodes:
+            node.trim()
+
+    @classmethod
+    def build(cls, version):
+        rows = (
+            Item.objects.filter(available=True)
+            .values_list("pk", "title", "slug")
+            .iterator(chunk_size=2000)
+        )
+        return cls(version, rows)
+
+    def node(self, prefix, create=False):
+        node = self.root
+        for char in prefix:
+            child = node.children.get(char)
+            if child is None:
+                if not create:
+                    return None
+                child = node.children[char] = TrieNode()
+            node = child
+        return node
+
+    def lookup(self, query, limit=DEFAULT_LIMIT):
+        """Suggestions for `query`, as {"name": title, "url": url} dicts."""
+        terms = search.query_terms(query)
+        if not terms:
+            return []
+        if len(terms) == 1:
+            node = self.node(terms[0][:MAX_PREFIX_LENGTH])
+            ids = [pk for _, _, pk in node.ranked[:limit]] if node else []
+        else:
+            ids = search.typeahead_item_ids(query, limit=limit)
+        return [self.suggestions[pk] for pk in ids if pk in self.suggestions]
+
+
+_index = None
+_lock = threading.Lock()  # Held while a trie is being built
+
+
+def rebuild(version=None):
+    """Builds the trie on the calling thread and makes it the one of this process."""
+    global _index
+    if version is None:
+        version = count_version(Item)
+    index = TypeaheadIndex.build(version)
+    _index = index
+    return index
+
+
+def _rebuild_in_background(version):
+    try:
+        rebuild(version)
+    except Exception:
+        logger.exception("Cannot rebuild the typeahead index")
+    finally:
+        _lock.release()
+        # The connection of this thread would otherwise stay open
+        connections.close_all()
+
+
+def get_index():
+    """The trie of this process, rebuilt when the catalog has changed."""
+    version = count_version(Item)
+    index = _index
+    if index is None or (index.version != version and connection.in_atomic_block):
+        with _lock:
+            if _index is None or _index.version != version:
+                rebuild(version)
+        return _index
+    if index.version != version and _lock.acquire(blocking=False):
+        # Released by the thread once the new trie is in place
+        threading.Thread(
+            target=_rebuild_in_background, args=(version,), name="typeahead-rebuild", daemon=True
+        ).start()
+    return index
+
+
+def suggest(query, limit=DEFAULT_LIMIT):
+    return get_index().lookup(query, limit)
+
+
+def etag(query, limit):
+    """Changes with the query, the limit and the trie the suggestions come from."""
+    terms = " ".join(search.query_terms(query))
+    digest = hashlib.md5(f"{terms}:{limit}".encode()).hexdigest()
+    # The version of the trie served, which may still be the previous one
+    return f"{get_index().version}-{digest}"
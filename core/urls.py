@@ -6,6 +6,7 @@ from .views import (
     MenView,
     WomenView,
     AllProductsView,
+    catalog_items,
     CartView,
     OrderListView,
     ItemDetailView,
@@ -13,6 +14,7 @@ from .views import (
     PaymentView,
     order_complete,
     add_to_cart,
+    update_cart,
     remove_from_cart,
     update_order_item_quantity,
     remove_completely_from_cart,
@@ -32,12 +34,14 @@ urlpatterns = [
     path('men/', MenView.as_view(), name='men'),
     path('women/', WomenView.as_view(), name='women'),
     path('all-products/', AllProductsView.as_view(), name='all-products'),
+    path('api/items/', catalog_items, name='catalog-items'),
     path('product-detail/<slug:slug>', ItemDetailView.as_view(), name='product-detail'),
     path('cart/', CartView.as_view(), name='cart'),
     path('orders/', OrderListView.as_view(), name='order-list'),
     path('apply-coupon/', apply_coupon, name='apply-coupon'),
     path('update-quantity/<int:order_item_id>/', update_order_item_quantity, name='update-quantity'),
     path('add-to-cart/<slug:slug>', add_to_cart, name='add-to-cart'),
+    path('update-cart/', update_cart, name='update-cart'),
     path('remove-from-cart/<slug:slug>', remove_from_cart, name='remove-from-cart'),
     path('remove-completely-from-cart/<slug:slug>', remove_completely_from_cart, name='remove-completely-from-cart'),
     path('checkout/', CheckoutView.as_view(), name='checkout'),
@@ -1,3 +1,4 @@
+import functools
 import json
 import os
 import random
@@ -9,14 +10,29 @@ from django.shortcuts import render
 from django.conf import settings
 from django.core.exceptions import ObjectDoesNotExist
 from core.models import Item, Order, OrderItem, Address, Payment, Coupon
-from .forms import CheckoutForm, RefundForm, ReviewForm
+from .cart import (
+    InvalidCartChange,
+    OrderAlreadyPlaced,
+    add_to_order,
+    apply_cart_changes,
+    cart_lines,
+    forget_cart_count,
+    get_cart_summary,
+    get_or_create_open_order,
+    place_order,
+    reopen_order,
+)
+from . import search, typeahead
+from .pagination import CachingPaginator
+from .forms import CatalogFilterForm, CheckoutForm, RefundForm, ReviewForm
 from django.views.generic import ListView, DetailView, View
 from django.contrib.auth.decorators import login_required
-from django.views.decorators.http import require_POST
+from django.utils.cache import patch_cache_control
+from django.views.decorators.http import condition, require_POST
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.shortcuts import get_object_or_404, render, redirect
+from django.urls import reverse
 from django.contrib import messages
-from django.db.models import Avg, Count, Case, When, Q, Value
 from django.core.paginator import Paginator
 
 # Generative AI
@@ -26,73 +42,163 @@ from django.views.decorators.csrf import csrf_exempt
 stripe.api_key = settings.STRIPE_SECRET_KEY
 
 
+class CatalogFilterMixin:
+    """Narrows a product listing by the facets in the query string."""
+
+    def get_filter_form(self):
+        if not hasattr(self, "filter_form"):
+            self.filter_form = CatalogFilterForm(self.request.GET)
+        return self.filter_form
+
+    def filter_catalog(self, queryset):
+        return self.get_filter_form().filter(queryset)
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context["filter_form"] = self.get_filter_form()
+        # Carried over by the pagination links
+        query = self.request.GET.copy()
+        query.pop("page", None)
+        context["filter_query"] = query.urlencode()
+        return context
+
+
 class HomeView(ListView):
     model = Item
+    paginator_class = CachingPaginator
     template_name = "core/index.html"
     paginate_by = 8
     context_object_name = "items"
 
     def get_queryset(self):
-        return Item.objects.filter(Q(label="P") | Q(label="D")).order_by(
-            Case(
-                When(label="P", then=Value(0)),  # Best sellers first (label 'P')
-                default=Value(1),  # Then big discount (label 'D')
-            )
-        )
+        # Best sellers (label 'P') first, then big discounts (label 'D')
+        return Item.objects.featured()
+
+
+def typeahead_etag(request):
+    try:
+        limit = typeahead.parse_limit(request.GET.get("limit"))
+    except ValueError:
+        return None
+    return typeahead.etag(request.GET.get("q", ""), limit)
+
+
+def public_unless_error(view):
+    """Lets shared caches keep the responses of `view`, except its errors."""
 
+    @functools.wraps(view)
+    def wrapper(request, *args, **kwargs):
+        response = view(request, *args, **kwargs)
+        if response.status_code in (200, 304):
+            patch_cache_control(response, public=True, max_age=typeahead.max_age())
+        return response
 
+    return wrapper
+
+
+@public_unless_error
+@condition(etag_func=typeahead_etag)
 def search_items(request):
-    if "q" in request.GET:
-        query = request.GET.get("q")
-        items = Item.objects.filter(title__icontains=query, available=True)
-        results = [
-            {"name": item.title, "url": item.get_absolute_url()} for item in items
-        ]
-        return JsonResponse({"results": results})
-    return JsonResponse({"results": []})
+    try:
+        limit = typeahead.parse_limit(request.GET.get("limit"))
+    except ValueError:
+        return JsonResponse({"error": "limit must be an integer"}, status=400)
+    results = typeahead.suggest(request.GET.get("q", ""), limit)
+    return JsonResponse({"results": results})
 
 
-class MenView(ListView):
+class MenView(CatalogFilterMixin, ListView):
     model = Item
+    paginator_class = CachingPaginator
     template_name = "core/men.html"
     paginate_by = 12
     context_object_name = "items"
 
     def get_queryset(self):
-        return Item.objects.filter(category="M", available=True)
+        return self.filter_catalog(
+            Item.objects.filter(category="M", available=True).listed()
+        )
 
 
-class WomenView(ListView):
+class WomenView(CatalogFilterMixin, ListView):
     model = Item
+    paginator_class = CachingPaginator
     template_name = "core/women.html"
     paginate_by = 12
     context_object_name = "items"
 
     def get_queryset(self):
-        return Item.objects.filter(category="W", available=True)
+        return self.filter_catalog(
+            Item.objects.filter(category="W", available=True).listed()
+        )
 
 
-class AllProductsView(ListView):
+class AllProductsView(CatalogFilterMixin, ListView):
     model = Item
+    paginator_class = CachingPaginator
     template_name = "core/all-products.html"
     paginate_by = 8
     context_object_name = "items"
 
+    def get_queryset(self):
+        return self.filter_catalog(Item.objects.listed())
+
+
+def catalog_items(request):
+    """
+    JSON listing of the catalog, narrowed by the same facets as the product
+    pages (category, label, min_price, max_price, in_stock), with the number
+    of matching items per category and label.
+    """
+    form = CatalogFilterForm(request.GET)
+    items = form.filter(Item.objects.all())
+    page = Paginator(items.listed(), 24).get_page(request.GET.get("page"))
+    detail_url = reverse("core:product-detail", kwargs={"slug": "-"})[:-1]
+    return JsonResponse(
+        {
+            "results": [
+                {
+                    "title": item["title"],
+                    "url": detail_url + item["slug"],
+                    "price": str(item["price"]),
+                    "discount_price": str(item["discount_price"]) if item["discount_price"] is not None else None,
+                    "category": item["category"],
+                    "label": item["label"],
+                    "available": item["available"],
+                }
+                for item in page.object_list.values(
+                    "title", "slug", "price", "discount_price", "category", "label", "available"
+                )
+            ],
+            "facets": items.facet_counts(),
+            "page": page.number,
+            "num_pages": page.paginator.num_pages,
+        }
+    )
+
 
-class SearchResultsView(ListView):
+class SearchResultsView(CatalogFilterMixin, ListView):
     model = Item
+    paginator_class = CachingPaginator
     template_name = "core/search-results.html"
     paginate_by = 8
     context_object_name = "items"
 
     def get_queryset(self):
         query = self.request.GET.get("q", "")
-        if query:
-            return Item.objects.filter(
-                Q(title__icontains=query) | Q(description__icontains=query),
-                available=True,
-            ).distinct()
-        return Item.objects.none()  # Return an empty queryset if no query
+        # Ranked best match first by the full-text index
+        ids = search.search_item_ids(query)
+        if not ids:
+            return Item.objects.none()  # Return an empty queryset if no match
+        if self.get_filter_form().has_facets():
+            # Keep the matches that pass the facets, in rank order
+            allowed = set(
+                self.filter_catalog(Item.objects.filter(pk__in=ids)).values_list(
+                    "pk", flat=True
+                )
+            )
+            ids = [pk for pk in ids if pk in allowed]
+        return search.RankedItems(ids)
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
@@ -111,14 +217,12 @@ class ItemDetailView(DetailView):
         context["review_form"] = ReviewForm()
         context["is_in_cart"] = self.object.is_in_user_cart(self.request.user)
 
-        # Calculate the average rating and the number of reviews
-        reviews = self.object.review_set.all().aggregate(
-            average_rating=Avg("rating"), number_of_reviews=Count("id")
-        )
+        # Average rating, total and per-star counts are stored on the item
+        stats = self.object.get_review_stats()
 
         # Set default values if reviews are None
-        context["average_rating"] = reviews["average_rating"] or 0
-        context["number_of_reviews"] = reviews["number_of_reviews"] or 0
+        context["average_rating"] = stats["average_rating"] or 0
+        context["number_of_reviews"] = stats["number_of_reviews"] or 0
 
         # Calculate the number of full, half, and empty stars
         full_stars = int(context["average_rating"])
@@ -132,11 +236,11 @@ class ItemDetailView(DetailView):
 
         # Get the count of reviews for each star rating
         star_counts = {
-            "5_stars": self.object.review_set.filter(rating=5).count(),
-            "4_stars": self.object.review_set.filter(rating=4).count(),
-            "3_stars": self.object.review_set.filter(rating=3).count(),
-            "2_stars": self.object.review_set.filter(rating=2).count(),
-            "1_star": self.object.review_set.filter(rating=1).count(),
+            "5_stars": stats["stars_5"],
+            "4_stars": stats["stars_4"],
+            "3_stars": stats["stars_3"],
+            "2_stars": stats["stars_2"],
+            "1_star": stats["stars_1"],
         }
 
         # Calculate the percentage of each star rating
@@ -149,7 +253,7 @@ class ItemDetailView(DetailView):
         context.update(star_counts)
 
         # Get all reviews and paginate them
-        reviews = self.object.review_set.all()
+        reviews = self.object.review_set.select_related("user")
         paginator = Paginator(reviews, 5)  # Show 5 reviews per page
         page_number = self.request.GET.get("page")
         page_obj = paginator.get_page(page_number)
@@ -189,50 +293,29 @@ def add_review(request, item_id):
 
 class CartView(LoginRequiredMixin, View):  # view.py
     def get(self, *args, **kwargs):
-        try:
-            order_items = OrderItem.objects.filter(
-                order__user=self.request.user, order__is_ordered=False
-            )
-            order = Order.objects.filter(
-                user=self.request.user, is_ordered=False
-            ).first()
-            coupon_code = self.request.GET.get("coupon_code")
-
-            if order and order.coupon:
-                coupon_discount_percentage = order.coupon.discount
-            else:
-                coupon_discount_percentage = 0
-
-            subtotal = sum([item.get_total_cost() for item in order_items])
-            saving = sum([item.get_total_discount() for item in order_items])
-            shipping = 0
-            subtotal_after_saving = subtotal - saving
-            coupon_discount = (subtotal_after_saving * coupon_discount_percentage) / 100
-            total = subtotal_after_saving - coupon_discount
-
-            context = {
-                "order_items": order_items,
-                "subtotal": subtotal,
-                "saving": saving,
-                "coupon_discount": coupon_discount,
-                "total": total,
-                "coupon_code": coupon_code,
-                "coupon_discount_percentage": coupon_discount_percentage,
-                "shipping": shipping,
-            }
-            return render(self.request, "core/cart.html", context)
-        except ObjectDoesNotExist:
-            messages.warning(self.request, "You have no items in your cart.")
-            return redirect("core:index")
+        summary = get_cart_summary(self.request.user)
+        context = {
+            "order_items": cart_lines(self.request.user),
+            "subtotal": summary.subtotal,
+            "saving": summary.saving,
+            "coupon_discount": summary.coupon_discount,
+            "total": summary.total,
+            "coupon_code": self.request.GET.get("coupon_code"),
+            "coupon_discount_percentage": summary.coupon_discount_percentage,
+            "shipping": summary.shipping,
+        }
+        return render(self.request, "core/cart.html", context)
 
 
-class OrderListView(ListView):
+class OrderListView(LoginRequiredMixin, ListView):
     model = Order
+    paginator_class = CachingPaginator
     template_name = "core/order-list.html"
+    paginate_by = 10
     context_object_name = "user_orders"
 
     def get_queryset(self):
-        return Order.objects.filter(user=self.request.user).order_by("-ordered_date")
+        return Order.objects.history(self.request.user)
 
 
 def apply_coupon(self):
@@ -266,35 +349,41 @@ def add_to_cart(request, slug):
     data = json.loads(request.body)
     quantity = data.get("quantity")
     quantity = int(quantity) if quantity.isdigit() else 1
-    order_qs = Order.objects.filter(user=request.user, is_ordered=False)
-
-    if order_qs.exists():
-        order = order_qs.first()
-        order_item_qs = OrderItem.objects.filter(item=item, order=order)
-
-        if order_item_qs.exists():
-            order_item = order_item_qs.first()
-            order_item.quantity += quantity  # Increment by the specified quantity
-            order_item.save()
-            messages.info(request, "The quantity of this item was increased.")
-        else:
-            order_item = OrderItem.objects.create(
-                item=item, order=order, quantity=quantity
-            )
-            messages.info(
-                request,
-                f"This item was added to your cart with quantity of {quantity}.",
-            )
+    order = get_or_create_open_order(request.user)
+    if add_to_order(order, item, quantity):
+        messages.info(
+            request,
+            f"This item was added to your cart with quantity of {quantity}.",
+        )
     else:
-        order = Order.objects.create(user=request.user)
-        order_item = OrderItem.objects.create(item=item, order=order, quantity=quantity)
-        order.items.add(order_item)
+        messages.info(request, "The quantity of this item was increased.")
 
+    forget_cart_count(request.user.pk)
     return JsonResponse(
         {"status": "success", "message": "Item quantity updated.", "quantity": quantity}
     )
 
 
+@login_required
+@require_POST
+def update_cart(request):
+    """
+    Applies several quantity changes to the cart at once. Expects a JSON body
+    like {"changes": [{"slug": "linen-shirt", "quantity": 2}, ...]}, where a
+    quantity of 0 removes the item, and returns the new cart summary.
+    """
+    try:
+        data = json.loads(request.body)
+    except json.JSONDecodeError:
+        return JsonResponse({"error": "Invalid JSON"}, status=400)
+    changes = data.get("changes") if isinstance(data, dict) else data
+    try:
+        summary = apply_cart_changes(request.user, changes)
+    except InvalidCartChange as e:
+        return JsonResponse({"error": str(e)}, status=400)
+    return JsonResponse({"status": "success", "summary": summary.as_dict()})
+
+
 @login_required
 def remove_from_cart(request, slug):
     item = get_object_or_404(Item, slug=slug)
@@ -305,6 +394,7 @@ def remove_from_cart(request, slug):
         if order_item_qs.exists():
             order_item = order_item_qs.first()
             order_item.delete()
+            forget_cart_count(request.user.pk)
             messages.info(request, "This item was removed from your cart.")
         else:
             messages.warning(request, "This item was not in your cart.")
@@ -322,6 +412,7 @@ def remove_completely_from_cart(request, slug):
         if order_item_qs.exists():
             order_item = order_item_qs.first()
             order_item.delete()
+            forget_cart_count(request.user.pk)
             messages.info(request, "This item was removed from your cart.")
         else:
             messages.warning(request, "This item was not in your cart.")
@@ -337,6 +428,7 @@ def update_order_item_quantity(request, order_item_id):
     if quantity:
         order_item.quantity = int(quantity)
         order_item.save()
+        forget_cart_count(order_item.order.user_id)
     return redirect("core:cart")
 
 
@@ -348,13 +440,12 @@ class CheckoutView(LoginRequiredMixin, View):
     def get(self, *args, **kwargs):
         form = CheckoutForm()
         try:
-            order = Order.objects.get(user=self.request.user, is_ordered=False)
-            order_items = OrderItem.objects.filter(
-                order__user=self.request.user, order__is_ordered=False
-            )
+            # Raises when there is no open order
+            Order.objects.get(user=self.request.user, is_ordered=False)
+            summary = get_cart_summary(self.request.user)
 
             # Check if there are any items in the order
-            if not order_items.exists():
+            if not summary.item_count:
                 messages.warning(
                     self.request,
                     "Your cart is empty. Please add items before proceeding to checkout.",
@@ -369,30 +460,15 @@ class CheckoutView(LoginRequiredMixin, View):
                 user=self.request.user, address_type="S", default=True
             ).first()
 
-            # Add the logic for savings and coupon discount
-            if order.coupon:
-                coupon_discount_percentage = order.coupon.discount
-            else:
-                coupon_discount_percentage = 0
-
-            subtotal = sum([item.get_total_cost() for item in order_items])
-            saving = sum([item.get_total_discount() for item in order_items])
-            shipping = 0
-            subtotal_after_saving = subtotal - saving
-            coupon_discount = (subtotal_after_saving * coupon_discount_percentage) / 100
-            order_total = subtotal_after_saving - coupon_discount
-
-            subtotal = sum([item.get_final_price() for item in order_items])
-
             context = {
                 "form": form,
-                "order_items": order_items,
-                "subtotal": f"${subtotal:.2f}",
-                "saving": f"${saving:.2f}",
-                "coupon_discount": coupon_discount,
-                "coupon_discount_percentage": coupon_discount_percentage,
-                "shipping": f"${shipping:.2f}",
-                "order_total": f"${order_total:.2f}",
+                "order_items": cart_lines(self.request.user),
+                "subtotal": f"${summary.discounted_subtotal:.2f}",
+                "saving": f"${summary.saving:.2f}",
+                "coupon_discount": summary.coupon_discount,
+                "coupon_discount_percentage": summary.coupon_discount_percentage,
+                "shipping": f"${summary.shipping:.2f}",
+                "order_total": f"${summary.total:.2f}",
                 "default_billing_address": default_billing_address,
                 "default_shipping_address": default_shipping_address,
             }
@@ -438,10 +514,9 @@ class CheckoutView(LoginRequiredMixin, View):
 
                 save_info = form.cleaned_data.get("save_info")
                 payment_option = form.cleaned_data.get("payment_options")
-                order_item = OrderItem.objects.filter(order=order)
                 if payment_option == "S":
                     # Calculate total amount in cents
-                    final_price = sum([item.get_final_price() for item in order_item])
+                    final_price = get_cart_summary(self.request.user).discounted_subtotal
                     amount = int(final_price * 100)
 
                     # try:
@@ -470,9 +545,12 @@ class CheckoutView(LoginRequiredMixin, View):
                     #     messages.warning(self.request, "Your card has been declined.")
                     #     return redirect('core:checkout')
 
-                    order.is_ordered = True
-                    order.ref_code = genterate_random_ref_code()
-                    order.save()
+                    try:
+                        place_order(order, ref_code=genterate_random_ref_code())
+                    except OrderAlreadyPlaced:
+                        # Submitted twice, the other request placed it
+                        messages.warning(self.request, "This order has already been placed.")
+                        return redirect("core:order-list")
 
                     messages.success(
                         self.request, "Your order has been add it successfully."
@@ -480,7 +558,7 @@ class CheckoutView(LoginRequiredMixin, View):
                     return redirect("core:order-complete")
                 elif payment_option == "P":
                     # Calculate total amount in cents
-                    final_price = sum([item.get_final_price() for item in order_item])
+                    final_price = get_cart_summary(self.request.user).discounted_subtotal
                     amount = int(final_price * 100)
                 else:
                     return redirect("core:order-complete")
@@ -560,53 +638,59 @@ class PaymentView(View):
         return render(self.request, "core/payment.html")
 
     def post(self, request, *args, **kwargs):
-        order = Order.objects.get(user=self.request.user, is_ordered=False)
+        try:
+            order = Order.objects.get(user=self.request.user, is_ordered=False)
+        except ObjectDoesNotExist:
+            messages.warning(self.request, "You do not have an active order")
+            return redirect("core:cart")
         token = request.POST.get("stripeToken")
-        amount = int(order.get_total() * 100)  # cents
 
+        # Placed before the charge, in its own transaction, so that no lock is
+        # held during the call to Stripe; a failed charge reopens the order
+        try:
+            summary = place_order(order, ref_code=genterate_random_ref_code())
+        except OrderAlreadyPlaced:
+            messages.warning(self.request, "This order has already been placed.")
+            return redirect("core:order-list")
+
+        amount = int(summary.total * 100)  # in cents
         try:
             charge = stripe.Charge.create(
-                amount=amount,  # in cents
+                amount=amount,
                 currency="usd",
                 source=token,
                 description=f"Charge for {request.user.username}",
+                # Unique to this attempt: place_order draws a new ref_code
+                # for each, so a retry after a decline is charged anew
+                idempotency_key=f"order-{order.pk}-{order.ref_code}",
             )
-
+        except stripe.error.CardError as e:
+            error = "There was a card error."
+        except stripe.error.RateLimitError as e:
+            error = "Too many requests to Stripe."
+        except stripe.error.InvalidRequestError as e:
+            error = "Invalid parameters."
+        except stripe.error.AuthenticationError as e:
+            error = "Authentication with Stripe failed."
+        except stripe.error.APIConnectionError as e:
+            error = "Network communication with Stripe failed."
+        except stripe.error.StripeError as e:
+            error = "Something went wrong. You were not charged. Please try again."
+        except Exception as e:
+            error = "A serious error occurred. We have been notified."
+        else:
             # create payment
             payment = Payment()
             payment.stripe_charge_id = charge["id"]
             payment.user = self.request.user
-            payment.amount = order.get_total()
+            payment.amount = order.total
             payment.save()
 
-            # assign the payment to the order
-            order.is_ordered = True
-            order.payment = payment
-            order.save()
-
             messages.success(self.request, "Your order was successful!")
             return redirect("/")
 
-        except stripe.error.CardError as e:
-            messages.error(self.request, "There was a card error.")
-        except stripe.error.RateLimitError as e:
-            messages.error(self.request, "Too many requests to Stripe.")
-        except stripe.error.InvalidRequestError as e:
-            messages.error(self.request, "Invalid parameters.")
-        except stripe.error.AuthenticationError as e:
-            messages.error(self.request, "Authentication with Stripe failed.")
-        except stripe.error.APIConnectionError as e:
-            messages.error(self.request, "Network communication with Stripe failed.")
-        except stripe.error.StripeError as e:
-            messages.error(
-                self.request,
-                "Something went wrong. You were not charged. Please try again.",
-            )
-        except Exception as e:
-            messages.error(
-                self.request, "A serious error occurred. We have been notified."
-            )
-
+        reopen_order(order)
+        messages.error(self.request, error)
         return redirect("/")
 
 
@@ -0,0 +1,358 @@
+"""
+Request instrumentation shared by every app of the project.
+
+InstrumentationMiddleware records, for each request, the resolved URL name,
+the wall time, the number and time of database queries, the time spent
+rendering templates and the time spent calling TMDB, Gemini and AssemblyAI.
+Records go into an in-memory ring buffer (one per process) and are served to
+staff as JSON at /_instrumentation/ and in the Prometheus text format at
+/_instrumentation/metrics.
+
+Outbound calls are timed by wrapping requests and httpx (matched on the host)
+and the Gemini SDK entry points. Calls made outside of a request, for example
+by the TMDB sync thread, are not recorded.
+"""
+
+import functools
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from urllib.parse import urlparse
+
+from django.conf import settings
+from django.contrib.admin.views.decorators import staff_member_required
+from django.db import connection
+from django.http import HttpResponse, JsonResponse
+
+SERVICE_HOSTS = {
+    "api.themoviedb.org": "tmdb",
+    "generativelanguage.googleapis.com": "gemini",
+    "api.assemblyai.com": "assemblyai",
+}
+
+# Latest records returned by metrics_json unless ?recent= asks for another number
+DEFAULT_RECENT = 50
+
+_current = ContextVar("instrumentation_metrics", default=None)
+
+
+class RequestMetrics:
+    def __init__(self):
+        self.view = None
+        self.method = None
+        self.status = None
+        self.wall_time = 0.0
+        self.db_queries = 0
+        self.db_time = 0.0
+        self.template_time = 0.0
+        self.outbound = defaultdict(float)  # service -> seconds
+        # Nested timings (an include inside a render, an SDK call wrapping an
+        # HTTP call) are only counted once, at the outermost level
+        self._template_depth = 0
+        self._outbound_depth = 0
+
+    def execute_wrapper(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_queries += 1
+            self.db_time += time.perf_counter() - started
+
+    def as_dict(self):
+        return {
+            "view": self.view,
+            "method": self.method,
+            "status": self.status,
+            "wall_time": self.wall_time,
+            "db_queries": self.db_queries,
+            "db_time": self.db_time,
+            "template_time": self.template_time,
+            "outbound": dict(self.outbound),
+        }
+
+
+class MetricsStore:
+    """Ring buffer of the latest request records plus running totals per view."""
+
+    def __init__(self, size):
+        self._lock = threading.Lock()
+        self.records = deque(maxlen=size)
+        self.totals = defaultdict(lambda: defaultdict(float))  # view -> metric -> total
+
+    def add(self, record):
+        with self._lock:
+            self.records.append(record)
+            totals = self.totals[record["view"]]
+            totals["requests"] += 1
+            for name in ("wall_time", "db_queries", "db_time", "template_time"):
+                totals[name] += record[name]
+            for service, seconds in record["outbound"].items():
+                totals[f"outbound:{service}"] += seconds
+
+    def snapshot(self):
+        with self._lock:
+            return list(self.records), {
+                view: dict(totals) for view, totals in self.totals.items()
+            }
+
+    def clear(self):
+        with self._lock:
+            self.records.clear()
+            self.totals.clear()
+
+
+store = MetricsStore(getattr(settings, "INSTRUMENTATION_BUFFER_SIZE", 1000))
+
+
+@contextmanager
+def track_outbound(service):
+    """Times a block as an outbound call to `service` for the current request."""
+    metrics = _current.get()
+    if metrics is None:
+        yield
+        return
+    metrics._outbound_depth += 1
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics._outbound_depth -= 1
+        if metrics._outbound_depth == 0:
+            metrics.outbound[service] += time.perf_counter() - started
+
+
+def service_for_url(url):
+    host = urlparse(str(url)).hostname or ""
+    tmdb_host = urlparse(getattr(settings, "THEMOVIEDB_API_URL", "")).hostname
+    if host == tmdb_host:
+        return "tmdb"
+    for service_host, service in SERVICE_HOSTS.items():
+        if host == service_host or host.endswith("." + service_host):
+            return service
+    return None
+
+
+def _wrap_http_send(cls):
+    original = cls.send
+
+    @functools.wraps(original)
+    def send(self, request, *args, **kwargs):
+        service = service_for_url(request.url)
+        if service is None:
+            return original(self, request, *args, **kwargs)
+        with track_outbound(service):
+            return original(self, request, *args, **kwargs)
+
+    cls.send = send
+
+
+def _wrap_callable(owner, name, service):
+    original = getattr(owner, name)
+
+    @functools.wraps(original)
+    def wrapper(*args, **kwargs):
+        with track_outbound(service):
+            return original(*args, **kwargs)
+
+    setattr(owner, name, wrapper)
+
+
+def _wrap_template_render():
+    from django.template.backends.django import Template
+
+    original = Template.render
+
+    @functools.wraps(original)
+    def render(self, *args, **kwargs):
+        metrics = _current.get()
+        if metrics is None:
+            return original(self, *args, **kwargs)
+        metrics._template_depth += 1
+        started = time.perf_counter()
+        try:
+            return original(self, *args, **kwargs)
+        finally:
+            metrics._template_depth -= 1
+            if metrics._template_depth == 0:
+                metrics.template_time += time.perf_counter() - started
+
+    Template.render = render
+
+
+_hooks_installed = False
+_hooks_lock = threading.Lock()
+
+
+def install_hooks():
+    """Wraps the template, HTTP and SDK entry points once per process."""
+    global _hooks_installed
+    with _hooks_lock:
+        if _hooks_installed:
+            return
+        _hooks_installed = True
+
+    _wrap_template_render()
+
+    import requests
+
+    _wrap_http_send(requests.Session)
+
+    try:
+        import httpx  # Used by the AssemblyAI SDK
+    except ImportError:
+        pass
+    else:
+        _wrap_http_send(httpx.Client)
+
+    try:
+        import google.generativeai as genai
+        from google.generativeai import generative_models
+    except ImportError:
+        pass
+    else:
+        # The SDK talks gRPC, which the HTTP hooks above cannot see
+        _wrap_callable(generative_models.GenerativeModel, "generate_content", "gemini")
+        _wrap_callable(generative_models.ChatSession, "send_message", "gemini")
+        _wrap_callable(genai, "upload_file", "gemini")
+        _wrap_callable(genai, "get_file", "gemini")
+
+
+class InstrumentationMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+        install_hooks()
+
+    def __call__(self, request):
+        metrics = RequestMetrics()
+        token = _current.set(metrics)
+        started = time.perf_counter()
+        try:
+            with connection.execute_wrapper(metrics.execute_wrapper):
+                response = self.get_response(request)
+        finally:
+            metrics.wall_time = time.perf_counter() - started
+            _current.reset(token)
+
+        match = getattr(request, "resolver_match", None)
+        metrics.view = match.view_name if match else "<unresolved>"
+        metrics.method = request.method
+        metrics.status = response.status_code
+        store.add(metrics.as_dict())
+        return response
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(fraction * (len(values) - 1))))]
+
+
+def summarize(records):
+    """Per-view summary of the records currently in the ring buffer."""
+    by_view = defaultdict(list)
+    for record in records:
+        by_view[record["view"]].append(record)
+
+    summary = {}
+    for view, view_records in by_view.items():
+        count = len(view_records)
+        wall_times = [record["wall_time"] for record in view_records]
+        outbound = defaultdict(float)
+        for record in view_records:
+            for service, seconds in record["outbound"].items():
+                outbound[service] += seconds
+        summary[view] = {
+            "requests": count,
+            "wall_time_p50": percentile(wall_times, 0.5),
+            "wall_time_p95": percentile(wall_times, 0.95),
+            "wall_time_max": max(wall_times),
+            "wall_time_sum": sum(wall_times),
+            "db_queries_avg": sum(r["db_queries"] for r in view_records) / count,
+            "db_time_avg": sum(r["db_time"] for r in view_records) / count,
+            "template_time_avg": sum(r["template_time"] for r in view_records) / count,
+            "outbound_time_avg": {
+                service: seconds / count for service, seconds in outbound.items()
+            },
+        }
+    return summary
+
+
+def prometheus_text(records, totals):
+    def label(value):
+        return str(value).replace("\\", "\\\\").replace('"', '\\"')
+
+    lines = [
+        "# HELP django_view_requests_total Requests served, by resolved URL name.",
+        "# TYPE django_view_requests_total counter",
+    ]
+    for view, view_totals in sorted(totals.items()):
+        lines.append(f'django_view_requests_total{{view="{label(view)}"}} {view_totals["requests"]:g}')
+
+    for metric, key, help_text in [
+        ("django_view_wall_seconds_total", "wall_time", "Wall time spent in views."),
+        ("django_view_db_queries_total", "db_queries", "Database queries run by views."),
+        ("django_view_db_seconds_total", "db_time", "Time spent in database queries."),
+        ("django_view_template_seconds_total", "template_time", "Time spent rendering templates."),
+    ]:
+        lines += [f"# HELP {metric} {help_text}", f"# TYPE {metric} counter"]
+        for view, view_totals in sorted(totals.items()):
+            lines.append(f'{metric}{{view="{label(view)}"}} {view_totals[key]:g}')
+
+    lines += [
+        "# HELP django_view_outbound_seconds_total Time spent calling external APIs.",
+        "# TYPE django_view_outbound_seconds_total counter",
+    ]
+    for view, view_totals in sorted(totals.items()):
+        for key, seconds in sorted(view_totals.items()):
+            if key.startswith("outbound:"):
+                service = key.split(":", 1)[1]
+                lines.append(
+                    f'django_view_outbound_seconds_total{{view="{label(view)}",service="{label(service)}"}} {seconds:g}'
+                )
+
+    lines += [
+        "# HELP django_view_wall_seconds Wall time of the views, quantiles over the latest requests.",
+        "# TYPE django_view_wall_seconds summary",
+    ]
+    summaries = summarize(records)
+    for view, view_totals in sorted(totals.items()):
+        summary = summaries.get(view)
+        if summary is not None:
+            for quantile, key in (("0.5", "wall_time_p50"), ("0.95", "wall_time_p95")):
+                lines.append(
+                    f'django_view_wall_seconds{{view="{label(view)}",quantile="{quantile}"}} {summary[key]:g}'
+                )
+        # _sum and _count must never go down, so they come from the running
+        # totals rather than from the ring buffer
+        lines.append(f'django_view_wall_seconds_sum{{view="{label(view)}"}} {view_totals["wall_time"]:g}')
+        lines.append(f'django_view_wall_seconds_count{{view="{label(view)}"}} {view_totals["requests"]:g}')
+    return "\n".join(lines) + "\n"
+
+
+@staff_member_required
+def metrics_json(request):
+    records, totals = store.snapshot()
+    try:
+        limit = int(request.GET.get("recent", DEFAULT_RECENT))
+    except ValueError:
+        limit = DEFAULT_RECENT
+    limit = max(0, min(limit, store.records.maxlen))
+    return JsonResponse(
+        {
+            "views": summarize(records),
+            "totals": totals,
+            "recent": records[-limit:] if limit > 0 else [],
+        }
+    )
+
+
+@staff_member_required
+def metrics_prometheus(request):
+    records, totals = store.snapshot()
+    return HttpResponse(
+        prometheus_text(records, totals), content_type="text/plain; version=0.0.4"
+    )
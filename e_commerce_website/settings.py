@@ -13,6 +13,7 @@ https://docs.djangoproject.com/en/5.0/ref/settings/
 from datetime import timedelta
 from pathlib import Path
 import os
+import tempfile
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -74,6 +75,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # First, so that it times everything below it
+    "e_commerce_website.instrumentation.InstrumentationMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
@@ -125,6 +128,37 @@ DATABASES = {
     }
 }
 
+# Cache
+# https://docs.djangoproject.com/en/5.0/topics/cache/
+#
+# Every worker process must see the same cache: the cart counts, the listing
+# counts and the catalog version behind the search results and the typeahead
+# are invalidated by deleting or bumping entries, which a per-process cache
+# (the LocMemCache default) would only do in the worker that made the change.
+# The directory below is shared by the workers of one host. A site served from
+# several hosts must set CACHE_URL to a Redis server (needs the redis package).
+
+if os.environ.get("CACHE_URL"):
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.redis.RedisCache",
+            "LOCATION": os.environ["CACHE_URL"],
+        }
+    }
+else:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+            "LOCATION": os.environ.get(
+                "CACHE_DIR", os.path.join(tempfile.gettempdir(), "e_commerce_website_cache")
+            ),
+            "OPTIONS": {"MAX_ENTRIES": 10000},
+        }
+    }
+
+# The tests get a cache of their own, see test_runner.py
+TEST_RUNNER = "e_commerce_website.test_runner.IsolatedCacheRunner"
+
 
 AUTHENTICATION_BACKENDS = [
     "django.contrib.auth.backends.ModelBackend",
@@ -228,6 +262,33 @@ ASSEMBLYAI_API_KEY = os.environ.get("ASSEMBLYAI_API_KEY")
 
 # THEMOVIEDB_API_KEY
 THEMOVIEDB_API_KEY = os.environ.get("THEMOVIEDB_API_KEY")
+THEMOVIEDB_API_URL = os.environ.get("THEMOVIEDB_API_URL", "https://api.themoviedb.org/3")
+# Catalog sync: discover pages per run, and seconds between background runs
+THEMOVIEDB_SYNC_PAGES = 5
+THEMOVIEDB_SYNC_INTERVAL = 60 * 60
+# Seconds a rendered movie card stays in the cache
+SCREEN_SCENE_CARD_CACHE_TIMEOUT = 60 * 60 * 24
+# In-process cache in front of the TMDB search API, which also tells the local
+# search which movies answer a query it missed: entries, and seconds to keep
+# non-empty and empty results
+THEMOVIEDB_SEARCH_CACHE_SIZE = 1024
+THEMOVIEDB_SEARCH_CACHE_TTL = 60 * 10
+THEMOVIEDB_SEARCH_CACHE_EMPTY_TTL = 60
+
+# Number of latest requests kept in memory by the instrumentation middleware
+INSTRUMENTATION_BUFFER_SIZE = 1000
+
+# Seconds the product listings reuse their page counts (they are also reset when an item changes)
+PAGINATOR_COUNT_CACHE_TIMEOUT = 60
+# Seconds the number of lines of a cart is cached (it is also reset when a line changes)
+CART_COUNT_CACHE_TIMEOUT = 60 * 60
+# Seconds the ranked ids of a product search are cached (they are also dropped when an item changes)
+CORE_SEARCH_CACHE_TIMEOUT = 60
+# Seconds browsers and proxies may reuse a typeahead response (revalidated with its ETag after that)
+CORE_TYPEAHEAD_MAX_AGE = 60
+
+# Widths, in pixels, of the resized copies of the product images served through srcset
+IMAGE_DERIVATIVE_WIDTHS = (320, 640, 960, 1280)
 
 # Stripe API keys
 STRIPE_PUBLIC_KEY = os.environ.get("STRIPE_PUBLIC_KEY")
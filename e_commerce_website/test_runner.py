@@ -0,0 +1,48 @@
+"""
+Test runner that keeps the tests away from the cache of the site.
+
+The configured cache is shared by every process of the host (see CACHES in
+the settings), so tests running against it would wipe the entries of a
+development server with their cache.clear() calls, and read entries left by
+an earlier run. IsolatedCacheRunner points the default cache at a temporary
+directory for the run, with the same backend, and empties it before every
+test so no test sees the cached counts or versions of another.
+"""
+
+import shutil
+import tempfile
+import unittest
+
+from django.conf import settings
+from django.core.cache import caches
+from django.test.runner import DiscoverRunner
+from django.test.utils import override_settings
+
+
+class CacheClearingResultMixin:
+    def startTest(self, test):
+        for cache in caches.all():
+            cache.clear()
+        super().startTest(test)
+
+
+class IsolatedCacheRunner(DiscoverRunner):
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self._cache_dir = tempfile.mkdtemp(prefix="e_commerce_website_test_cache_")
+        default = {
+            **settings.CACHES["default"],
+            "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+            "LOCATION": self._cache_dir,
+        }
+        self._cache_override = override_settings(CACHES={**settings.CACHES, "default": default})
+        self._cache_override.enable()
+
+    def teardown_test_environment(self, **kwargs):
+        self._cache_override.disable()
+        shutil.rmtree(self._cache_dir, ignore_errors=True)
+        super().teardown_test_environment(**kwargs)
+
+    def get_resultclass(self):
+        base = super().get_resultclass() or unittest.TextTestResult
+        return type("CacheClearingResult", (CacheClearingResultMixin, base), {})
@@ -17,8 +17,12 @@ Including another URLconf
 from django.contrib import admin
 from django.urls import path, include
 
+from .instrumentation import metrics_json, metrics_prometheus
+
 urlpatterns = [
     path('admin/', admin.site.urls),
+    path('_instrumentation/', metrics_json, name='instrumentation'),
+    path('_instrumentation/metrics', metrics_prometheus, name='instrumentation-prometheus'),
     path('accounts/', include('allauth.urls')),
     path('', include('core.urls')),
     path('askvid/', include('ask_yourtube.urls')),
@@ -1,7 +1,14 @@
 from django.contrib import admin
-from .models import Favorite, Movie
+from .models import Favorite, Movie, Shelf, SyncRun
 
 # Register your models here.
 admin.site.register(Movie)
 admin.site.register(Favorite)
+admin.site.register(Shelf)
 
+
+class SyncRunAdmin(admin.ModelAdmin):
+    list_display = ('started_at', 'duration', 'pages_fetched', 'pages_failed', 'created', 'updated', 'unchanged')
+    readonly_fields = [f.name for f in SyncRun._meta.fields]
+
+admin.site.register(SyncRun, SyncRunAdmin)
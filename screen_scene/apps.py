@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class ScreenSceneConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'screen_scene'
+
+    def ready(self):
+        from . import signals  # noqa: F401
@@ -0,0 +1,63 @@
+"""
+Cached rendering of the movie_card component.
+
+A card only depends on the Movie row and on whether the current user has it
+in their favorites, so the rendered HTML is cached under
+(movie id, row version, favorite state). A page of cards is looked up with one
+get_many call and only the misses are rendered.
+"""
+
+import threading
+
+from django.conf import settings
+from django.core.cache import cache
+from django.template.loader import render_to_string
+
+CARD_TEMPLATE = "screen_scene/components/movie_card.html"
+IMG_PATH = "https://image.tmdb.org/t/p/w500"
+
+_stats_lock = threading.Lock()
+_stats = {"hits": 0, "misses": 0}
+
+
+def card_cache_key(movie):
+    is_favorite = int(bool(getattr(movie, "is_favorite", False)))
+    return f"screen_scene:movie_card:{movie.id}:{movie.updated_at.timestamp()}:{is_favorite}"
+
+
+def render_movie_cards(movies, request=None):
+    """Returns the concatenated card HTML for the given movies, in order."""
+    movies = list(movies)
+    keys = [card_cache_key(movie) for movie in movies]
+    cached = cache.get_many(keys)
+
+    rendered = {}
+    for key, movie in zip(keys, movies):
+        if key not in cached and key not in rendered:
+            rendered[key] = render_to_string(
+                CARD_TEMPLATE, {"movie": movie, "IMG_PATH": IMG_PATH}, request=request
+            )
+    if rendered:
+        cache.set_many(
+            rendered, getattr(settings, "SCREEN_SCENE_CARD_CACHE_TIMEOUT", 60 * 60 * 24)
+        )
+
+    with _stats_lock:
+        _stats["hits"] += len(keys) - len(rendered)
+        _stats["misses"] += len(rendered)
+
+    cached.update(rendered)
+    return "".join(cached[key] for key in keys)
+
+
+def card_cache_stats():
+    with _stats_lock:
+        stats = dict(_stats)
+    lookups = stats["hits"] + stats["misses"]
+    stats["hit_rate"] = stats["hits"] / lookups if lookups else 0
+    return stats
+
+
+def reset_card_cache_stats():
+    with _stats_lock:
+        _stats["hits"] = _stats["misses"] = 0
@@ -0,0 +1,63 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+
+from screen_scene.models import Movie, movie_fields_from_tmdb
+
+
+def fake_payloads(count, offset, popularity):
+    return [
+        {
+            "id": offset + i,
+            "title": f"Benchmark movie {i}",
+            "original_language": "en",
+            "original_title": f"Benchmark movie {i}",
+            "overview": "Generated by benchmark_movie_upsert.",
+            "poster_path": None,
+            "backdrop_path": None,
+            "popularity": popularity + i,
+            "release_date": "2024-01-01",
+            "video": False,
+            "vote_average": 7.0,
+            "vote_count": 10,
+        }
+        for i in range(count)
+    ]
+
+
+def update_or_create_each(payloads):
+    """The per-movie path the views used before bulk_upsert."""
+    for movie_data in payloads:
+        Movie.objects.update_or_create(
+            movie_id=movie_data["id"], defaults=movie_fields_from_tmdb(movie_data)
+        )
+
+
+class Command(BaseCommand):
+    help = 'Compares SQL statement counts of update_or_create per movie and Movie.objects.bulk_upsert (changes are rolled back)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--count', type=int, default=500, help='Number of movies in the payload')
+
+    def measure(self, label, write, payloads):
+        with CaptureQueriesContext(connection) as queries:
+            started = time.perf_counter()
+            write(payloads)
+            elapsed = time.perf_counter() - started
+        self.stdout.write(f'{label:<32} {len(queries):>6} statements {elapsed * 1000:>9.1f} ms')
+
+    def handle(self, *args, **options):
+        count = options['count']
+        # Ids far above real TMDB ids, so the benchmark never touches real rows
+        offset = 10 ** 9
+
+        with transaction.atomic():
+            self.stdout.write(f'Payload of {count} movies')
+            self.measure('update_or_create, insert', update_or_create_each, fake_payloads(count, offset, 1))
+            self.measure('update_or_create, update', update_or_create_each, fake_payloads(count, offset, 2))
+            self.measure('bulk_upsert, insert', Movie.objects.bulk_upsert, fake_payloads(count, offset + count, 1))
+            self.measure('bulk_upsert, update', Movie.objects.bulk_upsert, fake_payloads(count, offset + count, 2))
+            self.measure('bulk_upsert, unchanged', Movie.objects.bulk_upsert, fake_payloads(count, offset + count, 2))
+            transaction.set_rollback(True)
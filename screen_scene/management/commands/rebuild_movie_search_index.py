@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from screen_scene.models import Movie
+from screen_scene.search import fts_available, rebuild_index
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the full-text search index of the movie catalog from the Movie table'
+
+    def handle(self, *args, **options):
+        if not fts_available():
+            self.stdout.write('The database has no full-text index, nothing to rebuild')
+            return
+
+        rebuild_index()
+        self.stdout.write(self.style.SUCCESS(f'Indexed {Movie.objects.count()} movie(s)'))
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from screen_scene.shelves import rebuild_shelves
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the home page shelves from the Movie table (the catalog sync also does after every pass)'
+
+    def handle(self, *args, **options):
+        shelves = rebuild_shelves()
+        for name, movie_ids in shelves.items():
+            self.stdout.write(f'{name}: {len(movie_ids)} movie(s)')
+        self.stdout.write(self.style.SUCCESS('Shelves rebuilt'))
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from screen_scene.sync import run_sync
+
+
+class Command(BaseCommand):
+    help = 'Fetches the TMDB discover catalog and upserts new or changed movies'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--pages', type=int, default=None, help='Number of discover pages to fetch (default: THEMOVIEDB_SYNC_PAGES)')
+        parser.add_argument('--workers', type=int, default=5, help='Number of pages fetched concurrently')
+
+    def handle(self, *args, **options):
+        run = run_sync(pages=options['pages'], workers=options['workers'])
+
+        self.stdout.write(
+            f'Fetched {run.pages_fetched} page(s), {run.movies_seen} movie(s) in {run.duration:.2f}s: '
+            f'{run.created} created, {run.updated} updated, {run.unchanged} unchanged'
+        )
+        if run.error:
+            self.stderr.write(self.style.ERROR(run.error))
+        else:
+            self.stdout.write(self.style.SUCCESS('Sync finished successfully'))
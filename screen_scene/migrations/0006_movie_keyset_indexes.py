@@ -0,0 +1,21 @@
+# Generated by Django 5.0.3 on 2026-10-18 19:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('screen_scene', '0005_movie_updated_at'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='movie',
+            index=models.Index(fields=['-popularity', '-release_date', '-id'], name='movie_keyset_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='movie',
+            index=models.Index(fields=['-release_date'], name='movie_release_date_idx'),
+        ),
+    ]
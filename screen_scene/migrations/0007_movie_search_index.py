@@ -0,0 +1,33 @@
+# Generated by Django 5.0.3 on 2026-10-18 20:05
+
+from django.db import migrations
+
+
+def create_search_index(apps, schema_editor):
+    # FTS5 is SQLite only; other databases search with icontains instead
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute(
+        "CREATE VIRTUAL TABLE IF NOT EXISTS screen_scene_movie_fts "
+        "USING fts5(title, original_title, overview, tokenize='unicode61 remove_diacritics 2')"
+    )
+    schema_editor.execute(
+        "INSERT INTO screen_scene_movie_fts (rowid, title, original_title, overview) "
+        "SELECT id, title, original_title, overview FROM screen_scene_movie"
+    )
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        schema_editor.execute("DROP TABLE IF EXISTS screen_scene_movie_fts")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('screen_scene', '0006_movie_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
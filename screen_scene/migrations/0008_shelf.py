@@ -0,0 +1,22 @@
+# Generated by Django 5.0.3 on 2026-10-18 19:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('screen_scene', '0007_movie_search_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Shelf',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50, unique=True)),
+                ('movie_ids', models.JSONField(default=list)),
+                ('built_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.0.3 on 2026-10-18 20:51
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('screen_scene', '0008_shelf'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='syncrun',
+            name='started_at',
+            field=models.DateTimeField(db_index=True, default=django.utils.timezone.now),
+        ),
+    ]
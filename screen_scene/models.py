@@ -1,6 +1,117 @@
-from django.db import models
+from collections import namedtuple
+
+from django.db import models, transaction
+from django.db.models import Exists, OuterRef, Value
+from django.dispatch import Signal
 from django.conf import settings
 from django.urls import reverse
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+# Movie fields filled from a TMDB result; also the columns compared when upserting
+TMDB_FIELDS = [
+    "page",
+    "title",
+    "original_language",
+    "original_title",
+    "overview",
+    "poster_path",
+    "backdrop_path",
+    "media_type",
+    "popularity",
+    "release_date",
+    "video",
+    "vote_average",
+    "vote_count",
+]
+
+# Sent with the TMDB ids of the written rows, since bulk_create sends no post_save
+movies_upserted = Signal()
+
+UpsertResult = namedtuple("UpsertResult", ["created", "updated", "unchanged"])
+
+
+def movie_fields_from_tmdb(movie_data, page=0, media_type="movie"):
+    """Maps one TMDB result to Movie field values."""
+    return {
+        "page": page,
+        "title": movie_data.get("title"),
+        "original_language": movie_data.get("original_language"),
+        "original_title": movie_data.get("original_title"),
+        "overview": movie_data.get("overview"),
+        "poster_path": movie_data.get("poster_path"),
+        "backdrop_path": movie_data.get("backdrop_path"),
+        "media_type": media_type,
+        "popularity": movie_data.get("popularity") or 0,
+        "release_date": parse_date(movie_data.get("release_date") or ""),
+        "video": movie_data.get("video") or False,
+        "vote_average": movie_data.get("vote_average") or 0,
+        "vote_count": movie_data.get("vote_count") or 0,
+    }
+
+
+class MovieQuerySet(models.QuerySet):
+    def bulk_upsert(self, payloads, page=0, media_type="movie"):
+        """
+        Creates or updates movies from TMDB results in one transaction.
+
+        Rows are matched on movie_id. Only new rows and rows whose fields
+        changed are written, with batched INSERT ... ON CONFLICT DO UPDATE
+        statements. A payload may carry a "page" key overriding `page`; a movie
+        listed twice keeps its first payload. Returns an UpsertResult of TMDB
+        id lists.
+        """
+        rows = {}
+        for movie_data in payloads:
+            rows.setdefault(
+                movie_data["id"],
+                movie_fields_from_tmdb(
+                    movie_data, movie_data.get("page", page), media_type
+                ),
+            )
+
+        with transaction.atomic():
+            existing = {
+                row["movie_id"]: row
+                for row in self.filter(movie_id__in=rows.keys()).values(
+                    "movie_id", *TMDB_FIELDS
+                )
+            }
+            created, updated, unchanged, changed_movies = [], [], [], []
+            for movie_id, fields in rows.items():
+                row = existing.get(movie_id)
+                if row is None:
+                    created.append(movie_id)
+                elif any(row[name] != fields[name] for name in TMDB_FIELDS):
+                    updated.append(movie_id)
+                else:
+                    unchanged.append(movie_id)
+                    continue
+                changed_movies.append(self.model(movie_id=movie_id, **fields))
+
+            if changed_movies:
+                self.bulk_create(
+                    changed_movies,
+                    update_conflicts=True,
+                    unique_fields=["movie_id"],
+                    update_fields=TMDB_FIELDS + ["updated_at"],
+                )
+                movies_upserted.send(
+                    sender=self.model, movie_ids=created + updated
+                )
+
+        return UpsertResult(created, updated, unchanged)
+
+    def with_favorite_flag(self, user):
+        """Annotates each movie with `is_favorite` for the given user, in the same query."""
+        if not user.is_authenticated:
+            return self.annotate(is_favorite=Value(False))
+        return self.annotate(
+            is_favorite=Exists(
+                Favorite.objects.filter(user=user, movie=OuterRef("pk"))
+            )
+        )
+
 
 class Movie(models.Model):
     page = models.IntegerField(default=0)
@@ -17,6 +128,18 @@ class Movie(models.Model):
     video = models.BooleanField(default=False)
     vote_average = models.FloatField(default=0)
     vote_count = models.IntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)  # Content version of the row
+
+    objects = MovieQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # Matches pagination.KEYSET_ORDERING, used by every movie listing
+            models.Index(
+                fields=["-popularity", "-release_date", "-id"], name="movie_keyset_idx"
+            ),
+            models.Index(fields=["-release_date"], name="movie_release_date_idx"),
+        ]
     
     def get_absolute_url(self):
         """Returns the absolute URL for the Movie detail view."""
@@ -31,3 +154,37 @@ class Favorite(models.Model):
 
     class Meta:
         unique_together = ('user', 'movie') # Ensure a user can only favorite a movie once
+
+
+class SyncRun(models.Model):
+    """One pass of the TMDB catalog sync, kept for timing and row counts."""
+
+    started_at = models.DateTimeField(default=timezone.now, db_index=True)
+    duration = models.FloatField(default=0)  # Seconds
+    pages_fetched = models.IntegerField(default=0)
+    pages_failed = models.IntegerField(default=0)
+    movies_seen = models.IntegerField(default=0)
+    created = models.IntegerField(default=0)
+    updated = models.IntegerField(default=0)
+    unchanged = models.IntegerField(default=0)
+    error = models.TextField(blank=True)
+
+    class Meta:
+        ordering = ["-started_at"]
+
+    def __str__(self):
+        return (
+            f"Sync at {self.started_at:%Y-%m-%d %H:%M} --- "
+            f"created: {self.created}, updated: {self.updated} ({self.duration:.2f}s)"
+        )
+
+
+class Shelf(models.Model):
+    """Precomputed, ordered list of movie ids shown as a row on the home page."""
+
+    name = models.CharField(max_length=50, unique=True)
+    movie_ids = models.JSONField(default=list)
+    built_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.name} --- {len(self.movie_ids)} movies"
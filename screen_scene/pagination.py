@@ -0,0 +1,95 @@
+"""
+Keyset ("cursor") pagination for the infinite-scroll endpoints.
+
+Movies are listed by popularity, then release date, then id, all descending.
+Instead of an OFFSET, the client gets back an opaque cursor holding those three
+values for the last movie it has seen, and the next page starts right after
+it. Together with the matching index on Movie, every page costs the same.
+"""
+
+import base64
+import json
+
+from django.db.models import F, Q
+from django.utils.dateparse import parse_date
+
+KEYSET_ORDERING = (
+    F("popularity").desc(),
+    F("release_date").desc(nulls_last=True),
+    F("id").desc(),
+)
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def pack_cursor(values):
+    """Encodes a list of JSON-serializable values as an opaque, URL-safe token."""
+    payload = json.dumps(values)
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+
+def unpack_cursor(cursor):
+    try:
+        payload = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        return json.loads(payload)
+    except ValueError as e:
+        raise InvalidCursor(f"Invalid cursor: {cursor!r}") from e
+
+
+def encode_cursor(movie):
+    release_date = movie.release_date.isoformat() if movie.release_date else None
+    return pack_cursor([movie.popularity, release_date, movie.id])
+
+
+def decode_cursor(cursor):
+    try:
+        popularity, release_date, movie_id = unpack_cursor(cursor)
+        return (
+            float(popularity),
+            parse_date(release_date) if release_date else None,
+            int(movie_id),
+        )
+    except (ValueError, TypeError) as e:
+        raise InvalidCursor(f"Invalid cursor: {cursor!r}") from e
+
+
+def after_cursor(popularity, release_date, movie_id):
+    """Q object matching the movies that come after the cursor in KEYSET_ORDERING."""
+    if release_date is None:
+        # NULL release dates sort last, so only ids are left to compare
+        same_popularity = Q(release_date__isnull=True, id__lt=movie_id)
+    else:
+        same_popularity = (
+            Q(release_date__lt=release_date)
+            | Q(release_date__isnull=True)
+            | Q(release_date=release_date, id__lt=movie_id)
+        )
+    # The redundant popularity bound lets the database seek into the index
+    # instead of scanning it from the top
+    return Q(popularity__lte=popularity) & (
+        Q(popularity__lt=popularity) | (Q(popularity=popularity) & same_popularity)
+    )
+
+
+def keyset_page(queryset, cursor=None, size=8):
+    """
+    Returns (movies, next_cursor) for the page that follows `cursor`.
+    next_cursor is None when there is nothing after this page.
+    """
+    queryset = queryset.order_by(*KEYSET_ORDERING)
+    if cursor:
+        queryset = queryset.filter(after_cursor(*decode_cursor(cursor)))
+
+    movies = list(queryset[: size + 1])
+    if len(movies) > size:
+        movies = movies[:size]
+        return movies, encode_cursor(movies[-1])
+    return movies, None
+
+
+def cursor_after(movies):
+    """Cursor pointing after the last of the movies already shown, if any."""
+    movies = list(movies)
+    return encode_cursor(movies[-1]) if movies else ""
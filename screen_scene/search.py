@@ -0,0 +1,193 @@
+"""
+Local full-text search over the Movie catalog.
+
+On SQLite the movies are indexed in an FTS5 table (title, original title and
+overview) that is kept up to date by the signals in signals.py and by the
+catalog sync. Results are ranked with BM25, titles weighing the most, and are
+paged with a (score, id) cursor. Other databases fall back to `icontains`.
+
+TMDB is only asked when the local index has nothing for a query, and never on
+the request path: the lookup runs on a background thread. The movies it finds
+are stored, and the search cache of the TMDB client (tmdb.search_cache) tells
+which of them answer the query until its entry expires.
+"""
+
+import hashlib
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from django.core.cache import cache
+from django.db import close_old_connections, connection
+from django.db.models import Q
+
+from . import tmdb
+from .models import Movie
+from .tmdb import normalize_query
+from .pagination import (
+    KEYSET_ORDERING,
+    InvalidCursor,
+    keyset_page,
+    pack_cursor,
+    unpack_cursor,
+)
+
+logger = logging.getLogger(__name__)
+
+FTS_TABLE = "screen_scene_movie_fts"
+# BM25 column weights: title, original_title, overview
+FTS_RANK = f"bm25({FTS_TABLE}, 10.0, 5.0, 1.0)"
+
+_fallback_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="tmdb-search")
+
+
+def fts_available():
+    return connection.vendor == "sqlite"
+
+
+def fts_match_expression(query):
+    """Every word must match, as a prefix of a word in any indexed column."""
+    return " ".join(f'"{term}"*' for term in normalize_query(query).split())
+
+
+def _reindex(column, values):
+    if not fts_available():
+        return
+    values = list(values)
+    movie_table = Movie._meta.db_table
+    with connection.cursor() as cursor:
+        for start in range(0, len(values), 500):
+            chunk = values[start : start + 500]
+            placeholders = ", ".join(["%s"] * len(chunk))
+            cursor.execute(
+                f"DELETE FROM {FTS_TABLE} WHERE rowid IN "
+                f"(SELECT id FROM {movie_table} WHERE {column} IN ({placeholders}))",
+                chunk,
+            )
+            cursor.execute(
+                f"INSERT INTO {FTS_TABLE} (rowid, title, original_title, overview) "
+                f"SELECT id, title, original_title, overview FROM {movie_table} "
+                f"WHERE {column} IN ({placeholders})",
+                chunk,
+            )
+
+
+def reindex_movies(pks):
+    """Replaces the index entries of the given Movie primary keys."""
+    _reindex("id", pks)
+
+
+def reindex_tmdb_movies(movie_ids):
+    """Same as reindex_movies, for rows identified by their TMDB id (after a bulk upsert)."""
+    _reindex("movie_id", movie_ids)
+
+
+def unindex_movie(pk):
+    if fts_available():
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {FTS_TABLE} WHERE rowid = %s", [pk])
+
+
+def rebuild_index():
+    if not fts_available():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {FTS_TABLE}")
+        cursor.execute(
+            f"INSERT INTO {FTS_TABLE} (rowid, title, original_title, overview) "
+            f"SELECT id, title, original_title, overview FROM {Movie._meta.db_table}"
+        )
+
+
+def _fts_page(query, cursor, size):
+    sql = f"SELECT rowid, {FTS_RANK} AS score FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s"
+    params = [fts_match_expression(query)]
+    if cursor:
+        try:
+            score, pk = unpack_cursor(cursor)
+            params += [float(score), float(score), int(pk)]
+        except (ValueError, TypeError) as e:
+            raise InvalidCursor(f"Invalid cursor: {cursor!r}") from e
+        sql += " AND (score > %s OR (score = %s AND rowid > %s))"
+    sql += " ORDER BY score, rowid LIMIT %s"
+    params.append(size + 1)
+
+    with connection.cursor() as db_cursor:
+        db_cursor.execute(sql, params)
+        rows = db_cursor.fetchall()
+
+    next_cursor = None
+    if len(rows) > size:
+        rows = rows[:size]
+        pk, score = rows[-1]
+        next_cursor = pack_cursor([score, pk])
+    return [pk for pk, score in rows], next_cursor
+
+
+def search_page(queryset, query, cursor=None, size=8):
+    """
+    Returns (movies, next_cursor) for one page of `query` results, best match
+    first. `queryset` is the Movie queryset to load the hits from (for example
+    one annotated with favorites).
+    """
+    if not normalize_query(query):
+        return [], None
+
+    if not fts_available():
+        terms = normalize_query(query).split()
+        matches = Q()
+        for term in terms:
+            matches &= (
+                Q(title__icontains=term)
+                | Q(original_title__icontains=term)
+                | Q(overview__icontains=term)
+            )
+        return keyset_page(queryset.filter(matches), cursor=cursor, size=size)
+
+    pks, next_cursor = _fts_page(query, cursor, size)
+    movies = queryset.in_bulk(pks)
+    return [movies[pk] for pk in pks if pk in movies], next_cursor
+
+
+# TMDB fallback for queries the local index cannot answer
+
+def _query_digest(query):
+    return hashlib.md5(normalize_query(query).encode()).hexdigest()
+
+
+def _remote_pending_key(query):
+    return f"screen_scene:search:pending:{_query_digest(query)}"
+
+
+def recent_remote_results(queryset, query):
+    """Movies TMDB returned for this query, while they are in the search cache."""
+    results = tmdb.cached_search_results(query)
+    if not results:
+        return []
+    movie_ids = [movie_data["id"] for movie_data in results]
+    return list(queryset.filter(movie_id__in=movie_ids).order_by(*KEYSET_ORDERING))
+
+
+def fetch_tmdb_matches(query):
+    """Looks the query up on TMDB (filling the search cache) and stores the movies."""
+    try:
+        results = tmdb.search_movies(query)
+
+        Movie.objects.bulk_upsert(results, page=0, media_type="search")
+    except (requests.RequestException, ValueError, KeyError) as e:
+        logger.warning("TMDB search for %r failed: %s", query, e)
+    finally:
+        cache.delete(_remote_pending_key(query))
+        close_old_connections()
+
+
+def schedule_tmdb_fallback(query):
+    """
+    Starts a background TMDB lookup for a query, unless one is already running
+    or its results are still cached. Returns True when a lookup is in flight.
+    """
+    if tmdb.cached_search_results(query) is not None:
+        return False
+    if cache.add(_remote_pending_key(query), True, 60):
+        _fallback_executor.submit(fetch_tmdb_matches, query)
+    return True
@@ -0,0 +1,71 @@
+"""
+Home page shelves (latest, featured), precomputed as ordered lists of movie ids.
+
+The shelves are only built by the catalog sync and the rebuild_shelves
+command, never on the request path: a shelf that has not been built yet is
+shown empty. Rendering them costs one query for the shelves and one in_bulk
+query for all of their movies, however many shelves there are.
+
+The popular movies are not a stored shelf. The home page shows the first
+keyset page of popular() and the load-more endpoint the next ones, so the
+cursor always comes from the rows it pages through.
+"""
+
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Movie, Shelf
+from .pagination import KEYSET_ORDERING
+
+# Using a higher threshold for popularity
+POPULARITY_THRESHOLD = 500
+
+
+def popular(queryset):
+    """The popular movies of `queryset`, to page with pagination.keyset_page."""
+    return queryset.filter(popularity__gte=POPULARITY_THRESHOLD)
+
+
+def build_latest():
+    return Movie.objects.filter(
+        release_date__gte=timezone.now() - timezone.timedelta(days=30)
+    ).order_by("-release_date")[:16]
+
+
+def build_featured():
+    return popular(Movie.objects.all()).order_by(*KEYSET_ORDERING)[:3]
+
+
+SHELVES = {
+    "latest": build_latest,
+    "featured": build_featured,
+}
+
+
+def rebuild_shelves():
+    """Recomputes every shelf and stores its movie ids. Returns {name: ids}."""
+    shelves = {
+        name: list(build().values_list("id", flat=True))
+        for name, build in SHELVES.items()
+    }
+    with transaction.atomic():
+        Shelf.objects.exclude(name__in=SHELVES).delete()
+        for name, movie_ids in shelves.items():
+            Shelf.objects.update_or_create(name=name, defaults={"movie_ids": movie_ids})
+    return shelves
+
+
+def get_shelves(queryset):
+    """
+    Returns {shelf name: [movies]} with the movies loaded from `queryset` (for
+    example one annotated with favorites) in a single query.
+    """
+    stored = dict(Shelf.objects.filter(name__in=SHELVES).values_list("name", "movie_ids"))
+    shelves = {name: stored.get(name, []) for name in SHELVES}
+
+    movie_ids = {pk for ids in shelves.values() for pk in ids}
+    movies = queryset.in_bulk(movie_ids) if movie_ids else {}
+    return {
+        name: [movies[pk] for pk in ids if pk in movies]
+        for name, ids in shelves.items()
+    }
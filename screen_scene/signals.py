@@ -0,0 +1,21 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from . import search
+from .models import Movie, movies_upserted
+
+
+@receiver(post_save, sender=Movie)
+def index_movie(sender, instance, **kwargs):
+    """Keeps the full-text search index in step with the saved movie."""
+    search.reindex_movies([instance.pk])
+
+
+@receiver(post_delete, sender=Movie)
+def unindex_movie(sender, instance, **kwargs):
+    search.unindex_movie(instance.pk)
+
+
+@receiver(movies_upserted, sender=Movie)
+def index_upserted_movies(sender, movie_ids, **kwargs):
+    search.reindex_tmdb_movies(movie_ids)
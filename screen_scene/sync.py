@@ -0,0 +1,134 @@
+"""
+Background sync of the TMDB "discover" catalog into the Movie table.
+
+The pages are fetched concurrently and written with Movie.objects.bulk_upsert,
+which only touches new or changed rows, then the home page shelves are
+rebuilt. Every pass is recorded as a SyncRun. Page views never call TMDB
+themselves; they only poke the in-process scheduler, which runs the sync on
+its own thread.
+"""
+
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from django.conf import settings
+from django.db import close_old_connections
+from django.utils import timezone
+
+from . import tmdb
+from .models import Movie, SyncRun
+from .shelves import rebuild_shelves
+
+logger = logging.getLogger(__name__)
+
+
+def fetch_discover_pages(pages, workers=5):
+    """
+    Fetches discover pages 1..pages concurrently.
+    Returns (TMDB results tagged with their page, failed pages), in page order.
+    """
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, pages))) as executor:
+        futures = {
+            page: executor.submit(tmdb.discover_page, page)
+            for page in range(1, pages + 1)
+        }
+
+    movies, failed = [], []
+    for page, future in futures.items():
+        try:
+            results = future.result()
+        except (requests.RequestException, ValueError, KeyError) as e:
+            logger.warning("TMDB discover page %s failed: %s", page, e)
+            failed.append(page)
+            continue
+        movies.extend(dict(movie_data, page=page) for movie_data in results)
+    return movies, failed
+
+
+def run_sync(pages=None, workers=5):
+    """Runs one full sync pass and returns the recorded SyncRun."""
+    if pages is None:
+        pages = getattr(settings, "THEMOVIEDB_SYNC_PAGES", 5)
+    started = time.monotonic()
+    # Set now rather than on save, which only happens once the pass is over
+    run = SyncRun(started_at=timezone.now())
+
+    movies, failed = fetch_discover_pages(pages, workers=workers)
+    # A movie listed on several pages keeps the first (most popular) one
+    result = Movie.objects.bulk_upsert(movies, media_type="movie")
+    rebuild_shelves()
+
+    run.pages_fetched = pages - len(failed)
+    run.pages_failed = len(failed)
+    run.movies_seen = len(result.created) + len(result.updated) + len(result.unchanged)
+    run.created = len(result.created)
+    run.updated = len(result.updated)
+    run.unchanged = len(result.unchanged)
+    if failed:
+        run.error = "Failed pages: " + ", ".join(str(page) for page in failed)
+    run.duration = time.monotonic() - started
+    run.save()
+    return run
+
+
+def last_sync_is_fresh(interval):
+    latest = SyncRun.objects.filter(pages_fetched__gt=0).first()
+    return latest is not None and latest.started_at >= timezone.now() - timezone.timedelta(
+        seconds=interval
+    )
+
+
+class SyncScheduler:
+    """
+    Runs the sync on a daemon thread every `interval` seconds.
+
+    The thread is started lazily by the first request that calls
+    ensure_started(), so management commands and tests never spawn it. A pass
+    is skipped when another process already synced within the interval.
+    """
+
+    def __init__(self, interval=None):
+        self._interval = interval
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._force = False
+
+    @property
+    def interval(self):
+        if self._interval is not None:
+            return self._interval
+        return getattr(settings, "THEMOVIEDB_SYNC_INTERVAL", 60 * 60)
+
+    def ensure_started(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(
+                    target=self._loop, name="tmdb-sync", daemon=True
+                )
+                self._thread.start()
+
+    def trigger(self):
+        """Asks for a sync as soon as possible, ignoring the freshness check."""
+        self._force = True
+        self.ensure_started()
+        self._wakeup.set()
+
+    def _loop(self):
+        while True:
+            force, self._force = self._force, False
+            try:
+                if force or not last_sync_is_fresh(self.interval):
+                    run_sync()
+            except Exception:
+                logger.exception("TMDB sync failed")
+            finally:
+                close_old_connections()
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+
+
+scheduler = SyncScheduler()
@@ -1,3 +1,484 @@
-from django.test import TestCase
+import datetime
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import StringIO
+from unittest import mock
+from urllib.parse import parse_qs, urlparse
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from .models import Favorite, Movie, Shelf, SyncRun
+from . import cards, search, shelves, sync, tmdb
+from .pagination import decode_cursor, keyset_page
+
+
+def tmdb_movie(movie_id, **overrides):
+    data = {
+        "id": movie_id,
+        "title": f"Movie {movie_id}",
+        "original_language": "en",
+        "original_title": f"Movie {movie_id}",
+        "overview": "",
+        "poster_path": f"/{movie_id}.jpg",
+        "backdrop_path": None,
+        "popularity": 1000.0 - movie_id,
+        "release_date": "2024-01-01",
+        "video": False,
+        "vote_average": 7.5,
+        "vote_count": 100,
+    }
+    data.update(overrides)
+    return data
+
+
+class FakeTMDBServer:
+    """A local stand-in for the TMDB API serving canned discover pages."""
+
+    def __init__(self, pages):
+        self.pages = pages  # {page number: [movie dicts]}
+        self.requests = []
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                url = urlparse(self.path)
+                query = parse_qs(url.query)
+                server.requests.append((url.path, query))
+                page = int(query.get("page", ["1"])[0])
+                if url.path != "/discover/movie" or page not in server.pages:
+                    self.send_response(404)
+                    self.end_headers()
+                    return
+                body = json.dumps({"page": page, "results": server.pages[page]}).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.httpd.server_address[1]}"
+
+    def __enter__(self):
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+class CatalogSyncTests(TestCase):
+    def sync_against(self, pages, requested_pages=2):
+        with FakeTMDBServer(pages) as server:
+            with override_settings(THEMOVIEDB_API_URL=server.url):
+                return sync.run_sync(pages=requested_pages)
+
+    def test_sync_creates_movies_and_records_run(self):
+        run = self.sync_against({1: [tmdb_movie(1), tmdb_movie(2)], 2: [tmdb_movie(3)]})
+
+        self.assertEqual(Movie.objects.count(), 3)
+        self.assertEqual(Movie.objects.get(movie_id=3).page, 2)
+        self.assertEqual((run.created, run.updated, run.unchanged), (3, 0, 0))
+        self.assertEqual(run.pages_fetched, 2)
+        self.assertEqual(SyncRun.objects.count(), 1)
+
+    def test_run_records_when_the_pass_started(self):
+        during = []
+        with mock.patch.object(sync, "rebuild_shelves", lambda: during.append(timezone.now())):
+            run = self.sync_against({1: [tmdb_movie(1)], 2: []})
+
+        self.assertLess(run.started_at, during[0])
+        self.assertEqual(SyncRun.objects.get().started_at, run.started_at)
+
+    def test_second_sync_only_updates_changed_movies(self):
+        self.sync_against({1: [tmdb_movie(1), tmdb_movie(2)], 2: []})
+        run = self.sync_against(
+            {1: [tmdb_movie(1), tmdb_movie(2, popularity=5.0)], 2: [tmdb_movie(4)]}
+        )
+
+        self.assertEqual((run.created, run.updated, run.unchanged), (1, 1, 1))
+        self.assertEqual(Movie.objects.get(movie_id=2).popularity, 5.0)
+
+    def test_failed_pages_are_reported(self):
+        with self.assertLogs("screen_scene.sync", "WARNING"):
+            run = self.sync_against({1: [tmdb_movie(1)]}, requested_pages=3)
+
+        self.assertEqual(run.pages_fetched, 1)
+        self.assertEqual(run.pages_failed, 2)
+        self.assertIn("2, 3", run.error)
+        self.assertEqual(Movie.objects.count(), 1)
+
+    def test_index_does_not_call_tmdb(self):
+        with mock.patch.object(sync, "scheduler") as scheduler, mock.patch.object(
+            tmdb.session, "get"
+        ) as get:
+            self.client.get(reverse("screen-scene:index"), {"page": "2"})
+
+        get.assert_not_called()
+        # Page views never force a sync past the interval
+        scheduler.ensure_started.assert_called_once()
+        scheduler.trigger.assert_not_called()
+
+    def test_forced_sync_is_staff_only(self):
+        url = reverse("screen-scene:trigger_sync")
+        with mock.patch.object(sync, "scheduler") as scheduler:
+            self.client.post(url)
+            scheduler.trigger.assert_not_called()
+
+            staff = get_user_model().objects.create_user("staff", password="pass", is_staff=True)
+            self.client.force_login(staff)
+            response = self.client.post(url)
+
+        self.assertEqual(response.json(), {"triggered": True})
+        scheduler.trigger.assert_called_once()
+
+
+class FavoriteFlagTests(TestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create_user("viewer", password="pass")
+        self.movies = [
+            Movie.objects.create(movie_id=i, title=f"Movie {i}", popularity=600 + i)
+            for i in range(3)
+        ]
+        Favorite.objects.create(user=self.user, movie=self.movies[1])
+
+    def test_with_favorite_flag_annotates_each_movie(self):
+        flags = {
+            movie.movie_id: movie.is_favorite
+            for movie in Movie.objects.with_favorite_flag(self.user)
+        }
+        self.assertEqual(flags, {0: False, 1: True, 2: False})
+
+    def test_anonymous_user_has_no_favorites(self):
+        movies = Movie.objects.with_favorite_flag(AnonymousUser())
+        self.assertFalse(any(movie.is_favorite for movie in movies))
+
+    def test_load_more_uses_a_single_movie_query(self):
+        self.client.force_login(self.user)
+        # Session, user and the annotated movie page
+        with self.assertNumQueries(3):
+            response = self.client.post(
+                reverse("screen-scene:load_more_all_movies")
+            )
+        self.assertEqual(response.json()["html"].count('data-is-favorite="true"'), 1)
+
+
+class MovieCardCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        cards.reset_card_cache_stats()
+        for i in range(3):
+            Movie.objects.create(movie_id=i, title=f"Movie {i}", popularity=600 + i)
+
+    def load_more(self):
+        return self.client.post(
+            reverse("screen-scene:load_more_all_movies")
+        ).json()["html"]
+
+    def test_repeated_pages_are_served_from_cache(self):
+        first = self.load_more()
+        second = self.load_more()
+
+        self.assertEqual(first, second)
+        self.assertEqual(cards.card_cache_stats()["misses"], 3)
+        self.assertEqual(cards.card_cache_stats()["hits"], 3)
+
+    def test_changed_movie_is_rendered_again(self):
+        self.load_more()
+        movie = Movie.objects.get(movie_id=1)
+        movie.title = "Renamed"
+        movie.save()
+
+        html = self.load_more()
+
+        self.assertIn("Renamed", html)
+        self.assertEqual(cards.card_cache_stats()["misses"], 4)
+
+
+class KeysetPaginationTests(TestCase):
+    def setUp(self):
+        # Ties on popularity and release date, and movies without a release date
+        dates = [datetime.date(2024, 1, 1), datetime.date(2023, 1, 1), None]
+        for i in range(20):
+            Movie.objects.create(
+                movie_id=i, popularity=600 + i % 3, release_date=dates[i % 3]
+            )
+
+    def test_pages_cover_every_movie_once_in_order(self):
+        seen, cursor = [], None
+        while True:
+            movies, cursor = keyset_page(Movie.objects.all(), cursor=cursor, size=6)
+            seen.extend(movie.id for movie in movies)
+            if cursor is None:
+                break
+
+        expected = [
+            movie.id
+            for movie in sorted(
+                Movie.objects.all(),
+                key=lambda m: (
+                    -m.popularity,
+                    m.release_date is None,
+                    -(m.release_date or datetime.date.min).toordinal(),
+                    -m.id,
+                ),
+            )
+        ]
+        self.assertEqual(seen, expected)
+
+    def test_endpoint_returns_next_cursor(self):
+        response = self.client.post(reverse("screen-scene:load_more_all_movies"))
+        cursor = response.json()["next_cursor"]
+        self.assertEqual(len(decode_cursor(cursor)), 3)
+
+        response = self.client.post(
+            reverse("screen-scene:load_more_all_movies"), {"cursor": cursor}
+        )
+        self.assertEqual(response.json()["html"].count("favorite-button"), 8)
+
+    def test_invalid_cursor_is_rejected(self):
+        response = self.client.post(
+            reverse("screen-scene:load_more_all_movies"), {"cursor": "not-a-cursor"}
+        )
+        self.assertEqual(response.status_code, 400)
+
+
+class MovieSearchTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        tmdb.search_cache.clear()
+        self.knight = Movie.objects.create(
+            movie_id=1, title="The Dark Knight", overview="Batman raises the stakes."
+        )
+        self.other = Movie.objects.create(
+            movie_id=2, title="Gotham Stories", overview="A knight errant in the city."
+        )
+
+    def search(self, query, **kwargs):
+        movies, next_cursor = search.search_page(Movie.objects.all(), query, **kwargs)
+        return [movie.movie_id for movie in movies], next_cursor
+
+    def test_title_matches_rank_first(self):
+        self.assertEqual(self.search("knight")[0], [1, 2])
+
+    def test_prefixes_of_every_word_must_match(self):
+        self.assertEqual(self.search("dark kni")[0], [1])
+        self.assertEqual(self.search("dark gotham")[0], [])
+
+    def test_results_are_paged_with_a_cursor(self):
+        first, cursor = self.search("knight", size=1)
+        second, last_cursor = self.search("knight", cursor=cursor, size=1)
+        self.assertEqual((first, second, last_cursor), ([1], [2], None))
+
+    def test_index_follows_saves_and_deletes(self):
+        self.knight.title = "The Dark Night"
+        self.knight.save()
+        self.assertEqual(self.search("night")[0], [1])
+
+        self.knight.delete()
+        self.assertEqual(self.search("night")[0], [])
+
+    def test_bulk_upsert_updates_the_index(self):
+        Movie.objects.bulk_upsert([tmdb_movie(3, title="Knightfall")])
+        self.assertEqual(self.search("knightfall")[0], [3])
+
+    def test_only_true_misses_go_to_tmdb(self):
+        with mock.patch.object(search, "_fallback_executor") as executor:
+            self.client.get(reverse("screen-scene:search_movies"), {"q": "knight"})
+            executor.submit.assert_not_called()
+
+            response = self.client.get(
+                reverse("screen-scene:search_movies"), {"q": "zorro"}
+            )
+            self.client.get(reverse("screen-scene:search_movies"), {"q": "Zorro!"})
+
+        self.assertTrue(response.context["searching_remote"])
+        executor.submit.assert_called_once_with(search.fetch_tmdb_matches, "zorro")
+
+    def test_remote_results_are_served_from_cache(self):
+        def fake_get(url, params, timeout):
+            response = mock.Mock(status_code=200)
+            response.json.return_value = {"results": [tmdb_movie(7, title="Zorro")]}
+            return response
+
+        with mock.patch.object(tmdb.session, "get", side_effect=fake_get) as get:
+            search.fetch_tmdb_matches("el zorro")
+            response = self.client.get(
+                reverse("screen-scene:search_movies"), {"q": "el zorro"}
+            )
+
+        self.assertEqual(get.call_count, 1)
+        self.assertEqual([movie.movie_id for movie in response.context["movies"]], [7])
+
+
+class TMDBQueryCacheTests(TestCase):
+    def test_entries_expire_after_their_ttl(self):
+        query_cache = tmdb.QueryCache(maxsize=10, ttl=60, empty_ttl=0)
+        load = mock.Mock(side_effect=[[1], [], []])
+
+        self.assertEqual(query_cache.get_or_load("a", load), [1])
+        self.assertEqual(query_cache.get_or_load("a", load), [1])
+        # Empty results use the shorter TTL, zero here
+        self.assertEqual(query_cache.get_or_load("b", load), [])
+        self.assertEqual(query_cache.get_or_load("b", load), [])
+        self.assertEqual(load.call_count, 3)
+
+    def test_peek_returns_live_entries_without_loading(self):
+        query_cache = tmdb.QueryCache(maxsize=10, ttl=60, empty_ttl=0)
+        query_cache.get_or_load("a", lambda: [1])
+        query_cache.get_or_load("b", lambda: [])
+
+        self.assertEqual(query_cache.peek("a"), [1])
+        # Expired right away
+        self.assertIsNone(query_cache.peek("b"))
+        self.assertIsNone(query_cache.peek("c"))
+
+    def test_least_recently_used_entry_is_evicted(self):
+        query_cache = tmdb.QueryCache(maxsize=2, ttl=60, empty_ttl=60)
+        for key in ["a", "b", "a", "c"]:
+            query_cache.get_or_load(key, lambda key=key: [key])
+
+        load = mock.Mock(return_value=["b"])
+        query_cache.get_or_load("a", load)
+        query_cache.get_or_load("b", load)
+        load.assert_called_once()
+
+    def test_concurrent_identical_loads_share_one_call(self):
+        query_cache = tmdb.QueryCache(maxsize=10, ttl=60, empty_ttl=60)
+        calls = []
+
+        def slow_load():
+            calls.append(1)
+            time.sleep(0.2)
+            return ["result"]
+
+        results = []
+        threads = [
+            threading.Thread(
+                target=lambda: results.append(query_cache.get_or_load("q", slow_load))
+            )
+            for _ in range(5)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, [["result"]] * 5)
+
+    def test_search_key_is_the_normalized_query(self):
+        tmdb.search_cache.clear()
+        with mock.patch.object(tmdb, "get", return_value={"results": []}) as get:
+            tmdb.search_movies("The  Matrix!")
+            tmdb.search_movies("the matrix")
+        get.assert_called_once_with("/search/movie", query="the matrix")
+
+
+class BulkUpsertTests(TestCase):
+    def test_reports_created_updated_and_unchanged_ids(self):
+        Movie.objects.bulk_upsert([tmdb_movie(1), tmdb_movie(2)])
+        result = Movie.objects.bulk_upsert(
+            [tmdb_movie(1), tmdb_movie(2, vote_count=5), tmdb_movie(3)]
+        )
+
+        self.assertEqual(result, ([3], [2], [1]))
+        self.assertEqual(Movie.objects.get(movie_id=2).vote_count, 5)
+
+    def test_first_payload_of_a_movie_wins(self):
+        Movie.objects.bulk_upsert(
+            [dict(tmdb_movie(1), page=1), dict(tmdb_movie(1, title="Later"), page=2)]
+        )
+        movie = Movie.objects.get(movie_id=1)
+        self.assertEqual((movie.page, movie.title), (1, "Movie 1"))
+
+    def test_statement_count_does_not_grow_per_movie(self):
+        payloads = [tmdb_movie(i) for i in range(500)]
+        with CaptureQueriesContext(connection) as queries:
+            Movie.objects.bulk_upsert(payloads)
+        # One diff SELECT, batched INSERTs and the search index refresh,
+        # against two statements per movie with update_or_create
+        self.assertLess(len(queries), 40)
+        self.assertEqual(Movie.objects.count(), 500)
+
+
+class ShelfTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        for i in range(12):
+            Movie.objects.create(
+                movie_id=i, popularity=400 + i * 20, release_date=datetime.date.today()
+            )
+
+    def test_sync_rebuilds_the_shelves(self):
+        with FakeTMDBServer({1: [tmdb_movie(100, popularity=5000)]}) as server:
+            with override_settings(THEMOVIEDB_API_URL=server.url):
+                sync.run_sync(pages=1)
+
+        featured = Shelf.objects.get(name="featured").movie_ids
+        self.assertEqual(featured[0], Movie.objects.get(movie_id=100).id)
+        self.assertEqual(len(featured), 3)
+        self.assertEqual(len(Shelf.objects.get(name="latest").movie_ids), 12)
+
+    def test_home_page_query_count_is_fixed(self):
+        shelves.rebuild_shelves()
+        user = get_user_model().objects.create_user("viewer", password="pass")
+        self.client.force_login(user)
+
+        with mock.patch.object(sync, "scheduler"):
+            # Session, user, shelves, one in_bulk for every shelf movie and
+            # the first page of the popular movies
+            with self.assertNumQueries(5):
+                response = self.client.get(reverse("screen-scene:index"))
+
+        self.assertEqual(len(response.context["latest_movies"]), 12)
+        self.assertEqual(len(response.context["popular_movies"]), 7)
+        self.assertEqual(response.context["popular_cursor"], "")
+
+    def test_home_page_does_not_build_the_shelves(self):
+        with mock.patch.object(sync, "scheduler"):
+            response = self.client.get(reverse("screen-scene:index"))
+
+        self.assertFalse(Shelf.objects.exists())
+        self.assertEqual(response.context["latest_movies"], [])
+        self.assertEqual(len(response.context["popular_movies"]), 7)
+
+    def test_popular_load_more_continues_the_home_page(self):
+        for i in range(12, 16):
+            Movie.objects.create(movie_id=i, popularity=400 + i * 20)
+        with mock.patch.object(sync, "scheduler"):
+            response = self.client.get(reverse("screen-scene:index"))
+        shown = [movie.movie_id for movie in response.context["popular_movies"]]
+
+        # A movie climbing into the first page after it was rendered
+        Movie.objects.filter(movie_id=15).update(popularity=10000)
+        more = self.client.post(
+            reverse("screen-scene:load_more_movies"),
+            {"cursor": response.context["popular_cursor"]},
+        ).json()
+
+        self.assertEqual(shown, [15, 14, 13, 12, 11, 10, 9, 8])
+        self.assertEqual(more["html"].count("favorite-button"), 3)
+        self.assertIsNone(more["next_cursor"])
+
+    def test_rebuild_shelves_command(self):
+        out = StringIO()
+        call_command("rebuild_shelves", stdout=out)
+
+        self.assertEqual(
+            set(Shelf.objects.values_list("name", flat=True)), {"latest", "featured"}
+        )
+        self.assertIn("latest: 12 movie(s)", out.getvalue())
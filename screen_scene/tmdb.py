@@ -0,0 +1,130 @@
+"""
+Client for the TMDB API shared by the catalog sync and the search fallback.
+
+All calls go through one pooled requests.Session. Search results are kept in
+an in-process cache keyed by the normalized query: bounded in size (least
+recently used entries go first), expiring after a TTL that is shorter for
+empty results, and single-flight, so concurrent identical searches wait for
+one upstream call instead of each making their own.
+"""
+
+import re
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+
+TIMEOUT = 10
+
+session = requests.Session()
+session.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=16))
+session.mount("http://", HTTPAdapter(pool_connections=4, pool_maxsize=16))
+
+
+def get_api_url():
+    return getattr(settings, "THEMOVIEDB_API_URL", "https://api.themoviedb.org/3")
+
+
+def normalize_query(query):
+    return " ".join(re.findall(r"\w+", query.lower()))
+
+
+def get(path, **params):
+    """GETs an API path and returns the decoded JSON, raising on HTTP errors."""
+    response = session.get(
+        f"{get_api_url()}{path}",
+        params={"api_key": settings.THEMOVIEDB_API_KEY, **params},
+        timeout=TIMEOUT,
+    )
+    response.raise_for_status()
+    return response.json()
+
+
+class QueryCache:
+    """Thread-safe LRU cache with per-entry TTL and single-flight loading."""
+
+    def __init__(self, maxsize, ttl, empty_ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.empty_ttl = empty_ttl
+        self._entries = OrderedDict()  # key -> (expires_at, value)
+        self._in_flight = {}  # key -> Future shared by the waiting callers
+        self._lock = threading.Lock()
+        self.hits = self.misses = 0
+
+    def get_or_load(self, key, load):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+            future = self._in_flight.get(key)
+            leader = future is None
+            if leader:
+                future = self._in_flight[key] = Future()
+
+        if not leader:
+            return future.result()
+
+        try:
+            value = load()
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(value)
+            with self._lock:
+                ttl = self.ttl if value else self.empty_ttl
+                self._entries[key] = (time.monotonic() + ttl, value)
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.maxsize:
+                    self._entries.popitem(last=False)
+            return value
+        finally:
+            with self._lock:
+                self._in_flight.pop(key, None)
+
+    def peek(self, key):
+        """The value cached for `key`, or None when missing or expired. Never loads."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] <= time.monotonic():
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = 0
+
+
+search_cache = QueryCache(
+    maxsize=getattr(settings, "THEMOVIEDB_SEARCH_CACHE_SIZE", 1024),
+    ttl=getattr(settings, "THEMOVIEDB_SEARCH_CACHE_TTL", 60 * 10),
+    empty_ttl=getattr(settings, "THEMOVIEDB_SEARCH_CACHE_EMPTY_TTL", 60),
+)
+
+
+def search_movies(query):
+    """Returns the TMDB search results for a query, from the cache when possible."""
+    normalized = normalize_query(query)
+    return search_cache.get_or_load(
+        normalized, lambda: get("/search/movie", query=normalized)["results"]
+    )
+
+
+def cached_search_results(query):
+    """The cached TMDB search results for a query, or None when it must be searched."""
+    return search_cache.peek(normalize_query(query))
+
+
+def discover_page(page):
+    """Returns one page of the discover catalog, most popular first. Never cached."""
+    return get("/discover/movie", sort_by="popularity.desc", page=page)["results"]
@@ -19,4 +19,6 @@ urlpatterns = [
     path('logout/', views.user_logout, name='user_logout'),
     path('search/', views.search_movies, name='search_movies'), 
     path('load-more-search-results/', views.load_more_search_results, name='load_more_search_results'),
+    path('card-cache-stats/', views.movie_card_cache_stats, name='movie_card_cache_stats'),
+    path('sync/', views.trigger_sync, name='trigger_sync'),
 ] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
\ No newline at end of file
@@ -1,55 +1,39 @@
-from functools import reduce
 from django.shortcuts import render, redirect
 from django.contrib.auth import login, logout, authenticate, get_user_model
 from django.contrib.auth.decorators import login_required
+from django.contrib.admin.views.decorators import staff_member_required
 from django.views.decorators.http import require_POST
-from urllib.parse import quote  # Use quote from urllib.parse
-from django.template.loader import render_to_string
 from django.contrib import messages
 from .forms import CustomUserCreationForm, CustomAuthenticationForm
 from .models import Favorite, Movie
+from . import search, sync
+from .cards import card_cache_stats, render_movie_cards
+from .pagination import KEYSET_ORDERING, InvalidCursor, cursor_after, keyset_page
+from .shelves import get_shelves, popular
 from django.http import JsonResponse
 from django.shortcuts import get_object_or_404
 from django.core.paginator import Paginator
-import re
-from django.conf import settings
-from django.utils import timezone
-from datetime import timedelta
-import requests
 from django.urls import reverse  # Import reverse
-from django.db.models import Q  # Import Q for complex queries
 
 
 def index(request):
     page = request.GET.get("page", 1)  # Get page from query parameters, default to 1
 
-    if page == "2":
-        update_movie_data(request)
+    # The catalog is refreshed in the background, never inside the request,
+    # and no more often than THEMOVIEDB_SYNC_INTERVAL (see trigger_sync)
+    sync.scheduler.ensure_started()
 
-    latest_movies = Movie.objects.filter(
-        release_date__gte=timezone.now() - timedelta(days=30)
-    ).order_by("-release_date")[:16]
-
-    # Get popular movies (using a higher threshold for popularity)
-    popular_movies = Movie.objects.filter(popularity__gte=500)[:8]
-
-    if request.user.is_authenticated:
-        # Get the IDs of the user's favorite movies
-        favorite_movie_ids = Favorite.objects.filter(user=request.user).values_list(
-            "movie_id", flat=True
-        )
-
-        # Add a 'is_favorite' field to each movie in 'latest_movies' and 'popular_movies'
-        for movie in latest_movies:
-            movie.is_favorite = movie.id in favorite_movie_ids
-
-        for movie in popular_movies:
-            movie.is_favorite = movie.id in favorite_movie_ids
+    # Every shelf comes from the precomputed id lists, loaded in one query
+    movies = Movie.objects.with_favorite_flag(request.user)
+    shelves = get_shelves(movies)
+    # The first page of what load_more_movies pages through, cursor included
+    popular_movies, popular_cursor = keyset_page(popular(movies), size=8)
 
     context = {
-        "latest_movies": latest_movies,
+        "latest_movies": shelves["latest"],
         "popular_movies": popular_movies,
-        "featured_movie": popular_movies[:3],
+        "popular_cursor": popular_cursor or "",
+        "featured_movie": shelves["featured"],
         "IMG_PATH": "https://image.tmdb.org/t/p/w500",
         "current_page": page,  # Pass the current page to the template
     }
@@ -59,69 +43,20 @@ def index(request):
 
 @require_POST  # Restrict this view to POST requests
 def load_more_movies(request):
-    start_from = int(request.POST.get("start_from", 0))
     movies_to_load = 8
 
-    popular_movies = Movie.objects.filter(popularity__gte=500)[
-        start_from : start_from + movies_to_load
-    ]
-
-    if request.user.is_authenticated:
-        favorite_movie_ids = Favorite.objects.filter(user=request.user).values_list(
-            "movie_id", flat=True
+    try:
+        popular_movies, next_cursor = keyset_page(
+            popular(Movie.objects.with_favorite_flag(request.user)),
+            cursor=request.POST.get("cursor"),
+            size=movies_to_load,
         )
-        for movie in popular_movies:
-            movie.is_favorite = movie.id in favorite_movie_ids
+    except InvalidCursor:
+        return JsonResponse({"error": "Invalid cursor"}, status=400)
 
-    rendered_movies = ""  # Start with an empty string
-
-    for movie in popular_movies:  # Iterate through the movies
-        rendered_movies += render_to_string(
-            "screen_scene/components/movie_card.html",
-            {"movie": movie, "IMG_PATH": "https://image.tmdb.org/t/p/w500"},
-            request=request,
-        )
-
-    return JsonResponse({"html": rendered_movies})
-
-def update_movie_data(request):
-    for page in range(1, 6):
-        api_url = f"https://api.themoviedb.org/3/discover/movie?sort_by=popularity.desc&api_key={settings.THEMOVIEDB_API_KEY}&page={page}"
-        response = requests.get(api_url)
-
-        if response.status_code == 200:
-            data = response.json()
-            movies = data["results"]
-
-            for movie_data in movies:
-                # **Update or create movie records:**
-                movie, created = Movie.objects.update_or_create(
-                    movie_id=movie_data["id"],  # Use movie_id as the lookup key
-                    defaults={
-                        "page": page,
-                        "title": movie_data["title"],
-                        "original_language": movie_data["original_language"],
-                        "original_title": movie_data["original_title"],
-                        "overview": movie_data["overview"],
-                        "poster_path": movie_data["poster_path"],
-                        "backdrop_path": movie_data["backdrop_path"],
-                        "media_type": "movie",
-                        "popularity": movie_data["popularity"],
-                        "release_date": (
-                            movie_data["release_date"]
-                            if movie_data["release_date"]
-                            else None
-                        ),
-                        "video": movie_data["video"],
-                        "vote_average": movie_data["vote_average"],
-                        "vote_count": movie_data["vote_count"],
-                    },
-                )
-        else:
-            return render(
-                request, "screen_scene/index.html", {"error": "Error fetching data"}
-            )
+    rendered_movies = render_movie_cards(popular_movies, request=request)
 
+    return JsonResponse({"html": rendered_movies, "next_cursor": next_cursor})
 
 def movie_detail(request, movie_id):
     movie = get_object_or_404(Movie, pk=movie_id)
@@ -163,9 +98,9 @@ def favorites(request):
     favorite_movies = Favorite.objects.filter(user=request.user).values_list(
         "movie", flat=True
     )
-    movies = Movie.objects.filter(id__in=favorite_movies)
-    for movie in movies:
-        movie.is_favorite = movie.id in favorite_movies
+    movies = Movie.objects.with_favorite_flag(request.user).filter(
+        id__in=favorite_movies
+    )
 
     # Pagination (optional but recommended)
     paginator = Paginator(movies, 4)  # Show 12 movies per page
@@ -180,21 +115,18 @@ def movies(request):
     page = request.GET.get("page", 1)
     movies_to_load = 8
 
-    all_movies = Movie.objects.all().order_by("-popularity", "-release_date")
+    all_movies = Movie.objects.with_favorite_flag(request.user).order_by(
+        *KEYSET_ORDERING
+    )
 
     # Pagination
     paginator = Paginator(all_movies, movies_to_load)
     page_obj = paginator.get_page(page)
 
-    if request.user.is_authenticated:
-        favorite_movie_ids = Favorite.objects.filter(user=request.user).values_list(
-            "movie_id", flat=True
-        )
-        for movie in page_obj:
-            movie.is_favorite = movie.id in favorite_movie_ids
-
     context = {
         "movies": page_obj,
+        # "Show more" continues after the last movie of this page
+        "next_cursor": cursor_after(page_obj) if page_obj.has_next() else "",
         "IMG_PATH": "https://image.tmdb.org/t/p/w500",
     }
     return render(request, "screen_scene/movies.html", context)
@@ -202,113 +134,44 @@ def movies(request):
 
 @require_POST
 def load_more_all_movies(request):
-    start_from = int(request.POST.get("start_from", 0))
     movies_to_load = 8
 
-    movies = Movie.objects.all().order_by("-popularity", "-release_date")[
-        start_from : start_from + movies_to_load
-    ]
-
-    if request.user.is_authenticated:
-        favorite_movie_ids = Favorite.objects.filter(user=request.user).values_list(
-            "movie_id", flat=True
+    try:
+        movies, next_cursor = keyset_page(
+            Movie.objects.with_favorite_flag(request.user),
+            cursor=request.POST.get("cursor"),
+            size=movies_to_load,
         )
-        for movie in movies:
-            movie.is_favorite = movie.id in favorite_movie_ids
+    except InvalidCursor:
+        return JsonResponse({"error": "Invalid cursor"}, status=400)
 
-    rendered_movies = ""  # Start with an empty string
+    rendered_movies = render_movie_cards(movies, request=request)
 
-    for movie in movies:  # Iterate through the movies
-        rendered_movies += render_to_string(
-            "screen_scene/components/movie_card.html",
-            {"movie": movie, "IMG_PATH": "https://image.tmdb.org/t/p/w500"},
-            request=request,
-        )
-
-    return JsonResponse({"html": rendered_movies})
+    return JsonResponse({"html": rendered_movies, "next_cursor": next_cursor})
 
 
 def search_movies(request):
     search_query = request.GET.get("q", "")
 
     if search_query:
-        # 1.  Split the search query into words (allow for spaces and hyphens)
-        search_terms = re.split(r"[- ]+", search_query)
-
-        # 2.  Search in the database first, allowing partial matches for each word
-        db_movies = Movie.objects.filter(
-            reduce(lambda x, y: x | Q(title__icontains=y), search_terms, Q())
-        ).order_by("-popularity", "-release_date")[:8]
-        # 2. Fetch from TMDB if fewer than 8 results from the database
-        if db_movies.count() < 8:
-            api_url = f"https://api.themoviedb.org/3/search/movie?api_key={settings.THEMOVIEDB_API_KEY}&query={quote(search_query)}"
-            response = requests.get(api_url)
-
-            if response.status_code == 200:
-                data = response.json()
-                results = data["results"]
-
-                # 3. Save/Update results from TMDB to the database
-                for movie_data in results:
-                    movie, created = Movie.objects.update_or_create(
-                        movie_id=movie_data["id"],  # Use movie_id as the lookup key
-                        defaults={
-                            "page": 0,
-                            "title": movie_data["title"],
-                            "original_language": movie_data["original_language"],
-                            "original_title": movie_data["original_title"],
-                            "overview": movie_data["overview"],
-                            "poster_path": movie_data["poster_path"],
-                            "backdrop_path": movie_data["backdrop_path"],
-                            "media_type": "search",
-                            "popularity": movie_data["popularity"],
-                            "release_date": (
-                                movie_data["release_date"]
-                                if movie_data["release_date"]
-                                else None
-                            ),
-                            "video": movie_data["video"],
-                            "vote_average": movie_data["vote_average"],
-                            "vote_count": movie_data["vote_count"],
-                        },
-                    )
-
-                # 4. Combine and sort results (database + API)
-                all_movies = [
-                    movie
-                    for movie in Movie.objects.filter(
-                        movie_id__in=[m["id"] for m in results]
-                    )
-                ]
-                all_movies.sort(
-                    key=lambda x: (
-                        x.popularity,
-                        (
-                            x.release_date
-                            if x.release_date
-                            else timezone.now() - timedelta(days=365 * 100)
-                        ),
-                    ),
-                    reverse=True,
-                )  # Sort by popularity and then release date
+        movies = Movie.objects.with_favorite_flag(request.user)
 
-            else:
-                # Handle API error
-                # ... (display an error message to the user)
-                all_movies = db_movies  # Use only database results if API error
-        else:
-            all_movies = db_movies  # If there are 8 results from the database
+        # Ranked results from the local full-text index
+        all_movies, next_cursor = search.search_page(movies, search_query, size=8)
 
-        if request.user.is_authenticated:
-            favorite_movie_ids = Favorite.objects.filter(user=request.user).values_list(
-                "movie_id", flat=True
-            )
-            for movie in all_movies:
-                movie.is_favorite = movie.id in favorite_movie_ids
+        # Only a true miss goes to TMDB, in the background; what it finds is
+        # served from the cache on the next searches for the same query
+        searching_remote = False
+        if not all_movies:
+            all_movies = search.recent_remote_results(movies, search_query)
+            if not all_movies:
+                searching_remote = search.schedule_tmdb_fallback(search_query)
 
         context = {
             "search_query": search_query,
-            "movies": all_movies,  # Use the combined and sorted results
+            "movies": all_movies,
+            "next_cursor": next_cursor or "",
+            "searching_remote": searching_remote,
             "IMG_PATH": "https://image.tmdb.org/t/p/w500",
         }
         return render(request, "screen_scene/search_results.html", context)
@@ -321,34 +184,40 @@ def search_movies(request):
 @require_POST
 def load_more_search_results(request):
     search_query = request.POST.get("q", "")
-    start_from = int(request.POST.get("start_from", 0))
     movies_to_load = 8
 
     if search_query:
-        movies = Movie.objects.filter(Q(title__icontains=search_query)).order_by(
-            "-popularity", "-release_date"
-        )[start_from : start_from + movies_to_load]
-
-        if request.user.is_authenticated:
-            favorite_movie_ids = Favorite.objects.filter(user=request.user).values_list(
-                "movie_id", flat=True
-            )
-            for movie in movies:
-                movie.is_favorite = movie.id in favorite_movie_ids
-
-        rendered_movies = ""  # Start with an empty string
-        for movie in movies:  # Iterate through the movies
-            rendered_movies += render_to_string(
-                "screen_scene/components/movie_card.html",
-                {"movie": movie, "IMG_PATH": "https://image.tmdb.org/t/p/w500"},
-                request=request,
+        try:
+            movies, next_cursor = search.search_page(
+                Movie.objects.with_favorite_flag(request.user),
+                search_query,
+                cursor=request.POST.get("cursor"),
+                size=movies_to_load,
             )
+        except InvalidCursor:
+            return JsonResponse({"error": "Invalid cursor"}, status=400)
 
-        return JsonResponse({"html": rendered_movies})
+        rendered_movies = render_movie_cards(movies, request=request)
+
+        return JsonResponse({"html": rendered_movies, "next_cursor": next_cursor})
     else:
         return JsonResponse({"error": "Missing search query"})
 
 
+@staff_member_required
+@require_POST
+def trigger_sync(request):
+    """Runs a catalog sync in the background now, whenever the last one ran."""
+    sync.scheduler.trigger()
+    return JsonResponse({"triggered": True})
+
+
+@staff_member_required
+def movie_card_cache_stats(request):
+    """Hit/miss counters of the rendered movie card cache (this process only)."""
+    return JsonResponse(card_cache_stats())
+
+
 User = get_user_model()  # Get the User model
 
 
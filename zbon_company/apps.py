@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class ZbonCompanyConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'zbon_company'
+
+    def ready(self):
+        from . import signals  # noqa: F401
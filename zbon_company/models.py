@@ -23,6 +23,8 @@ class Product(models.Model):
     description = models.TextField(blank=True)
     price = models.DecimalField(max_digits=10, decimal_places=2)
     image = models.ImageField(upload_to='product_images/', blank=True)
+    # Width of the image once its derivatives are built, see core.images
+    image_width = models.PositiveIntegerField(null=True, blank=True, editable=False)
     is_featured = models.BooleanField(default=False)
     is_active = models.BooleanField(default=True)
     created_at = models.DateTimeField(auto_now_add=True)
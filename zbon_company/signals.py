@@ -0,0 +1,16 @@
+from django.db.models.signals import post_save, pre_save
+from django.dispatch import receiver
+
+from core import images
+
+from .models import Product
+
+
+@receiver(pre_save, sender=Product)
+def mark_uploaded_image(sender, instance, **kwargs):
+    images.mark_uploaded_image(instance)
+
+
+@receiver(post_save, sender=Product)
+def build_image_derivatives(sender, instance, **kwargs):
+    images.schedule_derivatives(instance)